@@ -1,83 +1,784 @@
 # Backend using Flask
-from flask import Flask, request, jsonify
-import google.generativeai as genai
+#
+# Endpoints import their heavy dependencies (the Gemini SDK, requests,
+# smtplib, the MIME modules, cProfile) on first use, and NumPy only loads
+# when the semantic cache is on, so a cold start mostly pays for Flask.
+# Under gunicorn use the create_app() factory with --preload, see the Procfile.
+import time
+
+# Startup is timed from here (see create_app() and STARTUP_BUDGET_MS)
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import re
+import hmac
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from functools import lru_cache
+from string import Template
+from cache import cache_from_env, make_cache_key
+from smtp_pool import pool_from_env
+from singleflight import singleflight_from_env
+from delivery import queue_from_env
+from backends import GenerationResult, backends_from_env, is_retryable
+from resilience import UpstreamUnavailable, guard_from_env
+from prompts import RENDERS, PromptTemplateError, RenderedPrompt, library_from_env
+from tokens import budget_from_env, estimate_tokens
+from history import history_from_env
+from semantic_cache import semantic_cache_from_env
+from shared_state import state_from_env
+from email_format import EmailDocument, MessageBuilder
+from textproc import is_valid_email
+import metrics
+from metrics import timed, timed_function
 
 # Load environment variables
 load_dotenv()
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 8))
+VARIANTS_MAX = int(os.getenv('VARIANTS_MAX', 5))
+BULK_MAX_MESSAGES = int(os.getenv('BULK_MAX_MESSAGES', 5000))
+# How far ahead a send may be scheduled; its credentials stay in memory until then
+SCHEDULE_MAX_DELAY = float(os.getenv('SCHEDULE_MAX_DELAY', 86400))
+HISTORY_MAX_PAGE = int(os.getenv('HISTORY_MAX_PAGE', 100))
+# /history returns every user's emails, so it needs "Authorization: Bearer <token>";
+# unset, the endpoint stays closed even with history enabled
+HISTORY_TOKEN = os.getenv('HISTORY_TOKEN', '')
+# Distinct email bodies whose encoded MIME parts are kept for reuse
+MIME_BUILDER_CACHE = int(os.getenv('MIME_BUILDER_CACHE', 256))
+# Log requests slower than this many milliseconds (0 disables the slow log)
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+# Allow ?profile=1 to run a request under cProfile; stats go to the log or PROFILE_DIR
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', '0').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+# What /generate serves while the backend is failing or shedding load:
+# "cache" (a stale cached email), "template" (a generic draft), both, or "none"
+FALLBACK_MODE = {mode.strip() for mode in os.getenv('FALLBACK_MODE', 'cache').split(',') if mode.strip()}
+# Import what endpoints otherwise load on first use in create_app(); with
+# gunicorn --preload the workers then share it copy-on-write and no first
+# request pays for it, at the price of a slower master boot
+PRELOAD_MODULES = os.getenv('PRELOAD_MODULES', '0').lower() in ('1', 'true', 'yes')
+# Warn when import plus create_app() takes longer than this (0 disables)
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', 0))
 
 app = Flask(__name__)
 CORS(app)
 
-# Get Gemini API key from .env file or environment variable
-api_key = os.getenv('GEMINI_API_KEY')
-if not api_key:
-    raise ValueError("GEMINI_API_KEY is not set in the environment")
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.request_phases = metrics.start_request_trace()
+    if PROFILE_REQUESTS and request.args.get('profile') == '1':
+        import cProfile
+
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        phases = ", ".join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in g.request_phases)
+        app.logger.warning("Slow request %s %s took %.1fms (%s)", request.method, request.path,
+                           elapsed * 1000, phases or "no phases recorded")
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if PROFILE_DIR:
+            path = os.path.join(PROFILE_DIR, f"{endpoint.strip('/').replace('/', '_') or 'root'}-{time.time():.0f}.prof")
+            profiler.dump_stats(path)
+            response.headers['X-Profile-File'] = path
+        else:
+            import io
+            import pstats
+
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+            app.logger.warning("Profile for %s %s\n%s", request.method, request.path, out.getvalue())
+    return response
+
+# Generation backends (Gemini by default, see backends.py); the Gemini
+# backend still requires GEMINI_API_KEY from .env or the environment
+DEFAULT_BACKEND, llm_backends = backends_from_env()
+
+# Cache tier, rate limits, single-flight locks and job status shared by every
+# worker (SHARED_STATE_URL, see shared_state.py); None keeps them per process
+shared_state = state_from_env()
+
+# Rate limit, retries, admission control and circuit breaker per backend
+llm_guards = {name: guard_from_env(name, shared_state) for name in llm_backends}
+
+# Cache of generated emails keyed on the normalized prompt and model name
+response_cache = cache_from_env(shared_state)
+
+# Optional near-duplicate tier behind the exact cache (needs NumPy)
+semantic_cache = semantic_cache_from_env()
+
+# Identical concurrent generations share one upstream call
+singleflight, async_singleflight = singleflight_from_env(shared_state)
+
+# Authenticated SMTP sessions reused across /send-email calls
+smtp_pool = pool_from_env()
+
+# Every generated email, for /history search and reuse (see history.py)
+generation_history = history_from_env()
+
+# Prompt templates from prompts/ (see prompts.py), compiled once at startup
+prompt_library = library_from_env()
+
+# Input token budget every prompt is compacted and trimmed to (see tokens.py)
+prompt_budget = budget_from_env()
+
+def select_template(data):
+    # "prompt_template" pins a template id, e.g. to compare A/B variants
+    if data.get('prompt_template'):
+        template = prompt_library.get(data['prompt_template'])
+        if template is None:
+            raise PromptTemplateError(f"Unknown prompt template: {data['prompt_template']}")
+        return template
+    return prompt_library.select(
+        data.get('tone', 'Formal'), data.get('purpose', ''), str(data.get('ab_key') or data.get('prompt', ''))
+    )
+
+def request_key_points(data):
+    key_points = data.get('key_points') or []
+    return [str(point) for point in key_points] if isinstance(key_points, list) else [str(key_points)]
+
+@timed_function("prompt_build")
+def build_prompt(data):
+    # Returns a RenderedPrompt; raises PromptTemplateError for bad input or
+    # a prompt that can't be brought within the token budget
+    template = select_template(data)
+    values = {
+        "prompt": str(data.get('prompt', '')),
+        "tone": str(data.get('tone', 'Formal')).lower(),
+        "purpose": str(data.get('purpose', '')),
+        "recipient": str(data.get('recipient', '')),
+        "sender_name": str(data.get('sender_name', '')),
+        "key_points": request_key_points(data),
+    }
+    text, input_tokens, trimmed = prompt_budget.fit(template, values, prompt_budget.limit(data.get('max_input_tokens')))
+    RENDERS.inc(template=template.id, version=template.version)
+    return RenderedPrompt(text, template, input_tokens, trimmed, values)
+
+def template_info(rendered):
+    return {"id": rendered.template.id, "version": rendered.template.version}
+
+def usage_info(rendered, result):
+    # Backend-reported token counts where available, estimates otherwise
+    usage = {
+        "input_tokens": result.input_tokens or rendered.input_tokens,
+        "output_tokens": result.output_tokens or estimate_tokens(result.text),
+        "estimated": not (result.input_tokens and result.output_tokens),
+    }
+    if rendered.trimmed:
+        usage["trimmed"] = rendered.trimmed
+    return usage
+
+def email_document(email_text):
+    # Parsed once here so clients and /send-email never re-parse the text
+    return EmailDocument.parse(email_text).to_dict()
+
+def bad_prompt_response(e):
+    return jsonify({
+        "success": False,
+        "error": str(e)
+    }), 400
+
+def select_backend(data):
+    # The request may route to any configured backend; None if it names another
+    return llm_backends.get(data.get('backend') or DEFAULT_BACKEND)
+
+def unknown_backend_response(data):
+    return jsonify({
+        "success": False,
+        "error": f"Unknown backend: {data.get('backend')}"
+    }), 400
 
-genai.configure(api_key=api_key)
+def record_history(data, rendered, backend, email_text, cached):
+    # Write-behind: this only enqueues the entry, so it never blocks (not even
+    # the event loop in asgi.py)
+    if generation_history is not None:
+        generation_history.record({
+            "backend": backend.name,
+            "model": backend.model_id,
+            "template_id": rendered.template.id,
+            "template_version": rendered.template.version,
+            "tone": data.get('tone', 'Formal'),
+            "purpose": data.get('purpose', ''),
+            "recipient": data.get('recipient', ''),
+            "sender_name": data.get('sender_name', ''),
+            "prompt": str(data.get('prompt', '')),
+            "key_points": request_key_points(data),
+            "body": email_text,
+            "cached": cached
+        })
+
+def find_reusable(data):
+    # With "reuse_previous", a close earlier email for the same tone, purpose,
+    # recipient and sender is served instead of generating; returns the body or None
+    if generation_history is None or not data.get('reuse_previous'):
+        return None
+    with timed("history_reuse"):
+        item, similarity = generation_history.nearest(
+            data.get('tone', 'Formal'), data.get('purpose', ''), data.get('recipient', ''),
+            data.get('sender_name', ''), str(data.get('prompt', '')), request_key_points(data)
+        )
+    if item is None:
+        return None
+    return {
+        "email": item["body"],
+        "document": email_document(item["body"]),
+        "success": True,
+        "cached": True,
+        "reused": {"id": item["id"], "similarity": similarity, "created_at": item["created_at"]}
+    }
+
+def prompt_cache_key(rendered, backend):
+    template_key = rendered.template.key + (f"#{rendered.variant}" if rendered.variant else "")
+    return make_cache_key(rendered.text, backend.model_id, template_key)
+
+def semantic_key(rendered, backend):
+    # Returns (scope, vector): only requests for the same model, template,
+    # tone, recipient and sender may share an email; the rest is compared by meaning
+    values = rendered.values
+    if rendered.embedding is None:
+        rendered.embedding = semantic_cache.embed(
+            "\n".join([values["purpose"], values["prompt"], *values["key_points"]])
+        )
+    scope = "\x00".join([
+        backend.model_id, rendered.template.key, values["tone"], values["recipient"], values["sender_name"],
+        str(rendered.variant)
+    ])
+    return scope, rendered.embedding
+
+def lookup_cached(rendered, backend, bypass_cache=False):
+    # Returns (cache_key, cached_text), cached_text is None on a miss; an
+    # exact match is tried first, then a near-duplicate from the semantic cache
+    cache_key = prompt_cache_key(rendered, backend)
+    if bypass_cache:
+        return cache_key, None
+    if response_cache is not None:
+        with timed("cache_lookup"):
+            cached_text = response_cache.get(cache_key)
+        if cached_text is not None:
+            return cache_key, cached_text
+    if semantic_cache is not None:
+        with timed("semantic_lookup"):
+            cached_text, _ = semantic_cache.get(*semantic_key(rendered, backend))
+        return cache_key, cached_text
+    return cache_key, None
+
+def store_cached(rendered, backend, cache_key, email_text):
+    # Bypassed requests still refresh the entry for later callers
+    if response_cache is not None:
+        response_cache.set(cache_key, email_text)
+    if semantic_cache is not None:
+        semantic_cache.set(*semantic_key(rendered, backend), email_text)
+
+def generate_text(rendered, backend, bypass_cache=False):
+    # Returns (GenerationResult, cached) for a built prompt; a result shared
+    # from a concurrent identical request counts as cached
+    cache_key, cached_text = lookup_cached(rendered, backend, bypass_cache)
+    if cached_text is not None:
+        return GenerationResult(cached_text), True
+
+    def produce():
+        # Generate email content using the selected backend
+        with timed("llm_generate"):
+            result = llm_guards[backend.name].call(lambda: backend.generate(rendered.text))
+        metrics.record_tokens(backend.name, result)
+        store_cached(rendered, backend, cache_key, result.text)
+        return result
+
+    # A bypass asks for a fresh generation, so it never joins someone else's
+    if singleflight is None or bypass_cache:
+        return produce(), False
+
+    def recheck():
+        cached_text = response_cache.get(cache_key) if response_cache is not None else None
+        return GenerationResult(cached_text) if cached_text is not None else None
+
+    result, shared = singleflight.do(cache_key, produce, recheck)
+    return result, shared
+
+def cache_blocks():
+    # True when a cache call may wait on SQLite, Redis or a NumPy scan
+    return (shared_state is not None or semantic_cache is not None
+            or (response_cache is not None and response_cache.store is not None))
+
+async def offload(fn, *args):
+    # Cache calls that block go to a thread so the event loop keeps serving;
+    # a purely in-process LRU is cheaper to call directly
+    if not cache_blocks():
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+async def generate_text_async(rendered, backend, bypass_cache=False):
+    # Same as generate_text but awaits the backend's non-blocking client (used by asgi.py)
+    cache_key, cached_text = await offload(lookup_cached, rendered, backend, bypass_cache)
+    if cached_text is not None:
+        return GenerationResult(cached_text), True
+
+    async def produce():
+        with timed("llm_generate"):
+            result = await llm_guards[backend.name].call_async(lambda: backend.generate_async(rendered.text))
+        metrics.record_tokens(backend.name, result)
+        await offload(store_cached, rendered, backend, cache_key, result.text)
+        return result
+
+    if async_singleflight is None or bypass_cache:
+        return await produce(), False
+
+    async def recheck():
+        cached_text = await offload(response_cache.get, cache_key) if response_cache is not None else None
+        return GenerationResult(cached_text) if cached_text is not None else None
+
+    result, shared = await async_singleflight.do(cache_key, produce, recheck)
+    return result, shared
+
+def template_email(data):
+    # Generic draft built from the request fields alone, no model involved
+    key_points = "\n".join(f"- {point}" for point in request_key_points(data))
+    return (
+        f"Subject: {data.get('purpose') or 'Following up'}\n\n"
+        f"Dear {data.get('recipient') or 'Sir or Madam'},\n\n"
+        f"{data.get('prompt', '')}\n\n"
+        + (f"{key_points}\n\n" if key_points else "")
+        + f"Best regards,\n{data.get('sender_name', '')}"
+    )
+
+def fallback_email(data, rendered, backend):
+    # Returns an email to serve when the backend can't, or None (see FALLBACK_MODE)
+    if 'cache' in FALLBACK_MODE and response_cache is not None:
+        stale_text = response_cache.get(prompt_cache_key(rendered, backend), allow_stale=True)
+        if stale_text is not None:
+            return stale_text
+    if 'template' in FALLBACK_MODE:
+        return template_email(data)
+    return None
+
+def upstream_failure_response(data, rendered, backend, e):
+    # Returns (body, status, headers) after the backend failed or refused the call
+    email_text = fallback_email(data, rendered, backend)
+    if email_text is not None:
+        return {
+            "email": email_text,
+            "document": email_document(email_text),
+            "success": True,
+            "cached": False,
+            "fallback": True,
+            "template": template_info(rendered)
+        }, 200, {}
+    retry_after = e.retry_after if isinstance(e, UpstreamUnavailable) else llm_guards[backend.name].breaker.retry_after()
+    return {"success": False, "error": str(e)}, 503, {"Retry-After": str(retry_after)}
+
+def variant_requests(data):
+    # Returns ([(request, variant number)], error) for n_variants / tones;
+    # the list is None for an ordinary single-email request
+    tones = data.get('tones')
+    try:
+        n_variants = int(data.get('n_variants', 1))
+    except (TypeError, ValueError):
+        return None, "n_variants must be a number"
+    if tones is None and n_variants == 1:
+        return None, None
+    if tones is not None and (not isinstance(tones, list) or not tones
+                              or not all(isinstance(tone, str) and tone.strip() for tone in tones)):
+        return None, "tones must be a non-empty list of tone names"
+    if n_variants < 1:
+        return None, "n_variants must be at least 1"
+
+    # Each tone gets n_variants candidates; repeats of a tone are numbered so
+    # they are generated (and cached) separately
+    requests = []
+    for tone in tones or [data.get('tone', 'Formal')]:
+        for variant in range(n_variants):
+            requests.append((dict(data, tone=tone), variant))
+    if len(requests) > VARIANTS_MAX:
+        return None, f"At most {VARIANTS_MAX} variants can be generated per request"
+    return requests, None
+
+def build_variants(data):
+    # Returns ([(request, RenderedPrompt)], error); both None for a single email
+    requests, error = variant_requests(data)
+    if requests is None:
+        return None, error
+    variants = []
+    for variant_data, variant in requests:
+        try:
+            rendered = build_prompt(variant_data)
+        except PromptTemplateError as e:
+            return None, str(e)
+        rendered.variant = variant
+        variants.append((variant_data, rendered))
+    return variants, None
+
+def variant_result(index, data, rendered, backend, result, cached, elapsed):
+    record_history(data, rendered, backend, result.text, cached)
+    return {
+        "index": index,
+        "tone": data.get('tone', 'Formal'),
+        "success": True,
+        "email": result.text,
+        "document": email_document(result.text),
+        "cached": cached,
+        "latency_ms": round(elapsed * 1000, 1),
+        "template": template_info(rendered),
+        "usage": usage_info(rendered, result)
+    }
+
+def variant_error(index, data, e, elapsed):
+    metrics.record_error("/generate", e)
+    return {
+        "index": index,
+        "tone": data.get('tone', 'Formal'),
+        "success": False,
+        "error": str(e),
+        "latency_ms": round(elapsed * 1000, 1)
+    }
+
+def generate_variant(index, data, rendered, backend, bypass_cache):
+    start = time.perf_counter()
+    try:
+        result, cached = generate_text(rendered, backend, bypass_cache)
+    except Exception as e:
+        return variant_error(index, data, e, time.perf_counter() - start)
+    return variant_result(index, data, rendered, backend, result, cached, time.perf_counter() - start)
+
+async def generate_variant_async(index, data, rendered, backend, bypass_cache):
+    start = time.perf_counter()
+    try:
+        result, cached = await generate_text_async(rendered, backend, bypass_cache)
+    except Exception as e:
+        return variant_error(index, data, e, time.perf_counter() - start)
+    return variant_result(index, data, rendered, backend, result, cached, time.perf_counter() - start)
+
+def variants_body(results, elapsed):
+    # The first successful candidate also fills the single-email fields
+    first = next((result for result in results if result["success"]), None)
+    body = {
+        "success": first is not None,
+        "variants": results,
+        "latency_ms": round(elapsed * 1000, 1)
+    }
+    if first is not None:
+        body.update(email=first["email"], document=first["document"], cached=first["cached"],
+                    template=first["template"])
+    else:
+        body["error"] = results[0]["error"]
+    return body
+
+def generate_variants(variants, backend, bypass_cache):
+    # Candidates are generated concurrently, one thread each
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(variants)) as executor:
+        futures = [
+            executor.submit(generate_variant, index, variant_data, rendered, backend, bypass_cache)
+            for index, (variant_data, rendered) in enumerate(variants)
+        ]
+        results = [future.result() for future in futures]
+    return variants_body(results, time.perf_counter() - start)
 
 @app.route('/generate', methods=['POST'])
 def generate_email():
     data = request.get_json()
-    prompt = data.get('prompt', '')
-    tone = data.get('tone', 'Formal')
-    purpose = data.get('purpose', '')
-    recipient = data.get('recipient', '')
-    sender_name = data.get('sender_name', '')
-    key_points = data.get('key_points', [])
-    
-    # Create a detailed prompt for better generation
-    key_points_text = "\n".join([f"- {point}" for point in key_points]) if key_points else ""
-    
-    full_prompt = f"""
-    Generate a professional {tone.lower()} email for {purpose}.
-    
-    Context: {prompt}
-    
-    Recipient: {recipient}
-    Sender: {sender_name}
-    
-    Key points to include:
-    {key_points_text}
-    
-    The email should have:
-    1. A clear and appropriate subject line
-    2. A greeting that matches the tone
-    3. Well-structured body paragraphs
-    4. A call-to-action if applicable
-    5. An appropriate sign-off
-    
-    Format the email with subject line, greeting, body, and closing.
-    """
+    backend = select_backend(data)
+    if backend is None:
+        return unknown_backend_response(data)
+    variants, error = build_variants(data)
+    if error:
+        return jsonify({
+            "success": False,
+            "error": error
+        }), 400
+    if variants is not None:
+        body = generate_variants(variants, backend, bool(data.get('bypass_cache', False)))
+        return jsonify(body), 200 if body["success"] else 500
+    try:
+        rendered = build_prompt(data)
+    except PromptTemplateError as e:
+        return bad_prompt_response(e)
+    bypass_cache = bool(data.get('bypass_cache', False))
+    reused = find_reusable(data)
+    if reused is not None:
+        return jsonify(reused)
 
     try:
-        # Generate email content using Gemini API
-        model = genai.GenerativeModel('models/gemini-1.5-flash')
-        response = model.generate_content(full_prompt)
-        email_text = response.text
+        result, cached = generate_text(rendered, backend, bypass_cache)
+        record_history(data, rendered, backend, result.text, cached)
         
         return jsonify({
-            "email": email_text,
-            "success": True
+            "email": result.text,
+            "document": email_document(result.text),
+            "success": True,
+            "cached": cached,
+            "template": template_info(rendered),
+            "usage": usage_info(rendered, result)
         })
     except Exception as e:
+        metrics.record_error("/generate", e)
+        if isinstance(e, UpstreamUnavailable) or is_retryable(e):
+            body, status, headers = upstream_failure_response(data, rendered, backend, e)
+            return jsonify(body), status, headers
         return jsonify({
             "error": str(e),
             "success": False
         }), 500
 
-@app.route('/send-email', methods=['POST'])
-def send_email():
+def merge_batch_item(template, item):
+    # Per-recipient fields override the template; $variables fill merge fields,
+    # the recipient's over the template's shared ones
+    merged = dict(template)
+    merged.update({k: v for k, v in item.items() if k != 'variables'})
+    merged.pop('variables', None)
+    variables = {k: v for k, v in merged.items() if isinstance(v, str)}
+    variables.update(template.get('variables', {}))
+    variables.update(item.get('variables', {}))
+    merged['prompt'] = Template(merged.get('prompt', '')).safe_substitute(variables)
+    merged['key_points'] = [
+        Template(point).safe_substitute(variables) for point in merged.get('key_points', [])
+    ]
+    return merged
+
+def batch_fields_error(fields):
+    # Returns why merge_batch_item() can't use these template/recipient fields, or None
+    if not isinstance(fields.get('variables', {}), dict):
+        return "variables must be an object of merge fields"
+    key_points = fields.get('key_points', [])
+    if not isinstance(key_points, list) or not all(isinstance(point, str) for point in key_points):
+        return "key_points must be a list of strings"
+    for field in ('prompt', 'tone', 'purpose', 'recipient', 'sender_name', 'recipient_email', 'sender_email'):
+        if not isinstance(fields.get(field, ''), str):
+            return f"{field} must be a string"
+    return None
+
+def generate_batch_item(index, data, backend, bypass_cache):
+    try:
+        rendered = build_prompt(data)
+    except PromptTemplateError as e:
+        return {"index": index, "success": False, "error": str(e)}
+    reused = find_reusable(data)
+    if reused is not None:
+        return {"index": index, **reused}
+    try:
+        result, cached = generate_text(rendered, backend, bypass_cache)
+        record_history(data, rendered, backend, result.text, cached)
+        return {
+            "index": index,
+            "success": True,
+            "email": result.text,
+            "document": email_document(result.text),
+            "cached": cached,
+            "template": template_info(rendered),
+            "usage": usage_info(rendered, result)
+        }
+    except Exception as e:
+        metrics.record_error("/generate/batch", e)
+        if isinstance(e, UpstreamUnavailable) or is_retryable(e):
+            body, _, headers = upstream_failure_response(data, rendered, backend, e)
+            if 'Retry-After' in headers:
+                body["retry_after"] = int(headers['Retry-After'])
+            return {"index": index, **body}
+        return {"index": index, "success": False, "error": str(e)}
+
+@app.route('/generate/batch', methods=['POST'])
+def generate_email_batch():
     data = request.get_json()
-    email_content = data.get('email_content', '')
+    backend = select_backend(data)
+    if backend is None:
+        return unknown_backend_response(data)
+    template = data.get('template', {})
+    recipients = data.get('recipients', [])
+    bypass_cache = bool(data.get('bypass_cache', False))
+    stream = bool(data.get('stream', False))
+
+    if not isinstance(template, dict):
+        return jsonify({
+            "success": False,
+            "error": "template must be an object of shared fields"
+        }), 400
+
+    if not isinstance(recipients, list) or not recipients:
+        return jsonify({
+            "success": False,
+            "error": "recipients must be a non-empty list"
+        }), 400
+
+    if not all(isinstance(item, dict) for item in recipients):
+        return jsonify({
+            "success": False,
+            "error": "Each recipient must be an object of per-recipient fields"
+        }), 400
+
+    for index, fields in enumerate([template, *recipients]):
+        error = batch_fields_error(fields)
+        if error:
+            return jsonify({
+                "success": False,
+                "error": error if index == 0 else f"Recipient {index - 1}: {error}"
+            }), 400
+
+    if len(recipients) > BATCH_MAX_ITEMS:
+        return jsonify({
+            "success": False,
+            "error": f"A batch may contain at most {BATCH_MAX_ITEMS} recipients"
+        }), 400
+
+    # Requested concurrency is clamped to the server-side limit
+    try:
+        concurrency = int(data.get('concurrency', BATCH_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        concurrency = BATCH_MAX_CONCURRENCY
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY, len(recipients)))
+
+    items = [merge_batch_item(template, item) for item in recipients]
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = [
+        executor.submit(generate_batch_item, index, item, backend, bypass_cache)
+        for index, item in enumerate(items)
+    ]
+
+    if stream:
+        # Emit one JSON line per result as soon as it completes
+        def lines():
+            try:
+                for future in as_completed(futures):
+                    yield json.dumps(future.result()) + "\n"
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+    try:
+        results = [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False)
+
+    return jsonify({
+        "success": all(result["success"] for result in results),
+        "results": results,
+        "concurrency": concurrency
+    })
+
+def sse_event(event, payload):
+    # Format one server-sent event frame
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_email_stream():
+    data = request.get_json()
+    backend = select_backend(data)
+    if backend is None:
+        return unknown_backend_response(data)
+    try:
+        rendered = build_prompt(data)
+    except PromptTemplateError as e:
+        return bad_prompt_response(e)
+    bypass_cache = bool(data.get('bypass_cache', False))
+    cache_key, cached_text = lookup_cached(rendered, backend, bypass_cache)
+
+    def events():
+        if cached_text is not None:
+            record_history(data, rendered, backend, cached_text, True)
+            yield sse_event("chunk", {"text": cached_text})
+            yield sse_event("done", {
+                "success": True,
+                "document": email_document(cached_text),
+                "cached": True,
+                "template": template_info(rendered),
+                "usage": usage_info(rendered, GenerationResult(cached_text))
+            })
+            return
+
+        try:
+            # Forward chunks to the client as soon as the backend produces them
+            chunks = []
+            start = time.perf_counter()
+            with llm_guards[backend.name].streaming():
+                for text in backend.stream(rendered.text):
+                    if text:
+                        if not chunks:
+                            metrics.PHASE_SECONDS.observe(time.perf_counter() - start, phase="llm_first_chunk")
+                        chunks.append(text)
+                        yield sse_event("chunk", {"text": text})
+            metrics.PHASE_SECONDS.observe(time.perf_counter() - start, phase="llm_stream")
+
+            email_text = "".join(chunks)
+            store_cached(rendered, backend, cache_key, email_text)
+            record_history(data, rendered, backend, email_text, False)
+
+            yield sse_event("done", {
+                "success": True,
+                "document": email_document(email_text),
+                "cached": False,
+                "template": template_info(rendered),
+                "usage": usage_info(rendered, GenerationResult(email_text))
+            })
+        except UpstreamUnavailable as e:
+            metrics.record_error("/generate/stream", e)
+            yield sse_event("error", {"success": False, "error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            metrics.record_error("/generate/stream", e)
+            yield sse_event("error", {"success": False, "error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@lru_cache(maxsize=MIME_BUILDER_CACHE)
+def message_builder(document):
+    # One document sent to many recipients is rendered and encoded once
+    return MessageBuilder(document)
+
+def request_document(data, default=None):
+    # The structured email_document from /generate, else email_content (text or
+    # preview HTML); raises ValueError for a malformed document
+    if data.get('email_document') is not None:
+        return EmailDocument.from_dict(data['email_document'])
+    if 'email_content' in data or default is None:
+        return EmailDocument.from_content(str(data.get('email_content', '')))
+    return default
+
+@timed_function("mime_build")
+def build_message(payload):
+    if 'email_document' in payload:
+        document = EmailDocument.from_dict(payload['email_document'])
+    else:
+        # Queued before payloads carried the parsed document
+        document = EmailDocument.from_content(payload['email_content'])
+    return message_builder(document).message(
+        payload['recipient_email'],
+        payload['sender_name'],
+        payload['sender_email']
+    )
+
+def deliver_message(payload, sender_password):
+    # Send one message through the shared SMTP pool
+    msg = build_message(payload)
+    smtp_pool.send(payload['email_host'], payload['email_port'], payload['sender_email'], sender_password, msg)
+
+# Background workers for /send-email/bulk; job status is kept in SQLite
+delivery_queue = queue_from_env(deliver_message, shared_state)
+
+def parse_send_request(data):
+    # Returns (payload, sender_password, error) for a /send-email body
     recipient_email = data.get('recipient_email', '')
     sender_name = data.get('sender_name', 'Email Generator User')
     
@@ -88,81 +789,342 @@ def send_email():
     email_port = int(data.get('email_port', EMAIL_PORT))
     
     # Validate email addresses
-    if not re.match(r"[^@]+@[^@]+\.[^@]+", recipient_email):
+    if not is_valid_email(recipient_email):
+        return None, None, "Invalid recipient email address format"
+        
+    if not is_valid_email(sender_email):
+        return None, None, "Invalid sender email address format"
+    
+    # Check required credentials
+    if not sender_email or not sender_password:
+        return None, None, "Sender email and password are required."
+    
+    try:
+        document = request_document(data)
+    except ValueError as e:
+        return None, None, str(e)
+    
+    payload = {
+        "email_document": document.to_dict(),
+        "recipient_email": recipient_email,
+        "sender_name": sender_name,
+        "sender_email": sender_email,
+        "email_host": email_host,
+        "email_port": email_port
+    }
+    return payload, sender_password, None
+
+def parse_schedule(data):
+    # Returns (send_at, send_over, error). send_at is epoch seconds or an ISO 8601
+    # time (UTC unless it has an offset), None to send now; send_over spreads a
+    # bulk job's messages evenly over that many seconds
+    send_at = data.get('send_at')
+    try:
+        send_over = float(data.get('send_over') or 0)
+        if isinstance(send_at, str):
+            parsed = datetime.fromisoformat(send_at)
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            send_at = parsed.timestamp()
+        elif send_at is not None:
+            send_at = float(send_at)
+    except (TypeError, ValueError):
+        return None, 0, "send_at must be an ISO 8601 time or epoch seconds, send_over a number of seconds"
+    if send_over < 0:
+        return None, 0, "send_over must not be negative"
+    if max(send_at or 0, time.time()) + send_over > time.time() + SCHEDULE_MAX_DELAY:
+        return None, 0, f"Sends can be scheduled at most {int(SCHEDULE_MAX_DELAY)} seconds ahead"
+    if ((send_at or 0) > time.time() or send_over) and not delivery_queue.durable:
+        # An in-memory queue would lose them silently on the next restart
+        return None, 0, "Scheduled sends are disabled while DELIVERY_DB_PATH is :memory:"
+    return send_at, send_over, None
+
+def schedule_send(payload, sender_password, send_at):
+    # A future /send-email becomes a one-message delivery job; returns the 202 body
+    job_id = delivery_queue.submit([payload], sender_password, send_at=send_at)
+    return {
+        "success": True,
+        "job_id": job_id,
+        "send_at": send_at,
+        "status_url": f"/jobs/{job_id}"
+    }
+
+def send_error(e):
+    # Map a send failure to the (body, status) returned to the client
+    import smtplib
+
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        return {
+            "success": False,
+            "error": "Authentication failed. Please check your email and password. For Gmail, use an App Password instead of your regular password."
+        }, 401
+    if isinstance(e, smtplib.SMTPException):
+        return {
+            "success": False,
+            "error": f"SMTP Error: {str(e)}"
+        }, 500
+    return {
+        "success": False,
+        "error": f"Failed to send email: {str(e)}"
+    }, 500
+
+@app.route('/send-email', methods=['POST'])
+def send_email():
+    data = request.get_json()
+    payload, sender_password, error = parse_send_request(data)
+    if not error:
+        send_at, _, error = parse_schedule(data)
+    if error:
         return jsonify({
             "success": False,
-            "error": "Invalid recipient email address format"
+            "error": error
         }), 400
+    
+    if send_at is not None and send_at > time.time():
+        return jsonify(schedule_send(payload, sender_password, send_at)), 202
+    
+    try:
+        # Send email over a pooled, already authenticated session
+        deliver_message(payload, sender_password)
         
-    if not re.match(r"[^@]+@[^@]+\.[^@]+", sender_email):
+        return jsonify({
+            "success": True,
+            "message": f"Email sent successfully to {payload['recipient_email']}"
+        })
+    except Exception as e:
+        metrics.record_error("/send-email", e)
+        body, status = send_error(e)
+        return jsonify(body), status
+
+@app.route('/send-email/bulk', methods=['POST'])
+def send_email_bulk():
+    data = request.get_json()
+    messages = data.get('messages', [])
+    sender_name = data.get('sender_name', 'Email Generator User')
+    
+    # Get user's email credentials from request
+    sender_email = data.get('sender_email', '')
+    sender_password = data.get('sender_password', '')
+    email_host = data.get('email_host', EMAIL_HOST)
+    email_port = int(data.get('email_port', EMAIL_PORT))
+    
+    if not is_valid_email(sender_email):
         return jsonify({
             "success": False,
             "error": "Invalid sender email address format"
         }), 400
     
-    # Check required credentials
     if not sender_email or not sender_password:
         return jsonify({
             "success": False,
             "error": "Sender email and password are required."
         }), 400
     
-    # Extract subject from the email content
-    subject_match = re.search(r"Subject:(.*?)(?:\n|<br>)", email_content, re.IGNORECASE)
-    subject = subject_match.group(1).strip() if subject_match else "Generated Email"
+    if not isinstance(messages, list) or not messages:
+        return jsonify({
+            "success": False,
+            "error": "messages must be a non-empty list"
+        }), 400
+    
+    if len(messages) > BULK_MAX_MESSAGES:
+        return jsonify({
+            "success": False,
+            "error": f"A bulk send may contain at most {BULK_MAX_MESSAGES} messages"
+        }), 400
     
-    # Clean up HTML from email content if present for plain text version
-    email_text = re.sub(r'<.*?>', '', email_content)
+    send_at, send_over, error = parse_schedule(data)
+    if error:
+        return jsonify({
+            "success": False,
+            "error": error
+        }), 400
     
     try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['From'] = f"{sender_name} <{sender_email}>"
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        
-        # Create both plain text and HTML versions
-        text_part = MIMEText(email_text, 'plain')
-        html_part = MIMEText(email_content, 'html')
-        
-        msg.attach(text_part)
-        msg.attach(html_part)
-        
-        # Send email
-        with smtplib.SMTP(email_host, email_port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
-        
+        # Shared content is parsed once, not once per recipient
+        default_document = request_document(data)
+    except ValueError as e:
         return jsonify({
-            "success": True,
-            "message": f"Email sent successfully to {recipient_email}"
+            "success": False,
+            "error": str(e)
+        }), 400
+    
+    payloads = []
+    for index, message in enumerate(messages):
+        recipient_email = message.get('recipient_email', '') if isinstance(message, dict) else ''
+        if not is_valid_email(recipient_email):
+            return jsonify({
+                "success": False,
+                "error": f"Invalid recipient email address format for message {index}"
+            }), 400
+        try:
+            document = request_document(message, default_document)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": f"{e} for message {index}"
+            }), 400
+        payloads.append({
+            "email_document": document.to_dict(),
+            "recipient_email": recipient_email,
+            "sender_name": message.get('sender_name', sender_name),
+            "sender_email": sender_email,
+            "email_host": email_host,
+            "email_port": email_port
         })
-    except smtplib.SMTPAuthenticationError:
+    
+    job_id = delivery_queue.submit(payloads, sender_password, send_at=send_at, spread=send_over)
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "queued": len(payloads),
+        "send_at": send_at,
+        "status_url": f"/jobs/{job_id}"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = delivery_queue.job_status(job_id)
+    if status is None:
         return jsonify({
             "success": False,
-            "error": "Authentication failed. Please check your email and password. For Gmail, use an App Password instead of your regular password."
-        }), 401
-    except smtplib.SMTPException as e:
+            "error": "Job not found"
+        }), 404
+    return jsonify({"success": True, **status})
+
+@app.route('/history', methods=['GET'])
+def history():
+    if generation_history is None:
         return jsonify({
             "success": False,
-            "error": f"SMTP Error: {str(e)}"
-        }), 500
-    except Exception as e:
+            "error": "Generation history is disabled"
+        }), 404
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not HISTORY_TOKEN or not hmac.compare_digest(supplied.encode('utf-8'), HISTORY_TOKEN.encode('utf-8')):
         return jsonify({
             "success": False,
-            "error": f"Failed to send email: {str(e)}"
-        }), 500
+            "error": "History search needs a valid HISTORY_TOKEN"
+        }), 403
+    args = request.args
+    try:
+        limit = max(1, min(int(args.get('limit', 20)), HISTORY_MAX_PAGE))
+        before_id = int(args['cursor']) if args.get('cursor') else None
+        since = float(args['since']) if args.get('since') else None
+        until = float(args['until']) if args.get('until') else None
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "limit, cursor, since and until must be numbers"
+        }), 400
+    page = generation_history.search(
+        q=args.get('q'),
+        sender_name=args.get('sender_name'),
+        recipient=args.get('recipient'),
+        purpose=args.get('purpose'),
+        since=since,
+        until=until,
+        limit=limit,
+        before_id=before_id
+    )
+    return jsonify({"success": True, **page})
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "ok"})
+    return jsonify({
+        "status": "ok",
+        "backends": sorted(llm_backends),
+        "default_backend": DEFAULT_BACKEND,
+        "prompt_templates": prompt_library.versions(),
+        "upstream": {name: guard.stats() for name, guard in llm_guards.items()},
+        "cache": response_cache.stats() if response_cache is not None else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "smtp_pool": smtp_pool.stats(),
+        "delivery": delivery_queue.stats(),
+        "shared_state": shared_state.stats() if shared_state is not None else None,
+        "history": generation_history.stats() if generation_history is not None else None,
+        "startup_ms": round(startup_seconds * 1000, 1) if startup_seconds is not None else None
+    })
+
+def register_gauges():
+    # Component stats are read at scrape time rather than mirrored into counters
+    metrics.registry.gauge(
+        "email_api_llm_circuit_open", "1 while the backend's circuit breaker is failing fast",
+        lambda: {(name,): int(guard.breaker.state != "closed") for name, guard in llm_guards.items()},
+        ("backend",))
+    if response_cache is not None:
+        metrics.registry.gauge(
+            "email_api_cache_events", "Response cache lookups by outcome",
+            lambda: {(name,): response_cache.stats()[name] for name in ("hits", "store_hits", "misses", "evictions")},
+            ("outcome",))
+        metrics.registry.gauge(
+            "email_api_cache_entries", "Entries in the in-process response cache",
+            lambda: response_cache.stats()["entries"])
+    if semantic_cache is not None:
+        metrics.registry.gauge(
+            "email_api_semantic_cache_events", "Semantic cache lookups by outcome",
+            lambda: {(name,): semantic_cache.stats()[name] for name in ("hits", "misses", "evictions")},
+            ("outcome",))
+        metrics.registry.gauge(
+            "email_api_semantic_cache_entries", "Vectors held by the semantic cache",
+            lambda: semantic_cache.stats()["entries"])
+    metrics.registry.gauge(
+        "email_api_smtp_pool", "SMTP pool connection events and idle sessions",
+        lambda: {(name,): value for name, value in smtp_pool.stats().items()},
+        ("stat",))
+    metrics.registry.gauge(
+        "email_api_delivery_queue", "Delivery queue depth (delayed includes scheduled sends)",
+        lambda: {(name,): value for name, value in delivery_queue.stats().items() if name != "started"},
+        ("stat",))
+    metrics.registry.gauge(
+        "email_api_startup_seconds", "Module import plus create_app() in the serving process",
+        lambda: startup_seconds or 0.0)
+
+register_gauges()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({"message": "Email Generator API is running"})
 
+# Seconds from the first line of this module to the end of create_app()
+startup_seconds = None
+
+def preload_modules():
+    # Everything the endpoints would otherwise import on first use
+    for backend in llm_backends.values():
+        preload = getattr(backend, 'preload', None)
+        if preload is not None:
+            preload()
+    for name in ("smtplib", "email.mime.multipart", "email.mime.text"):
+        __import__(name)
+
+def after_fork_in_child():
+    # Connections, pooled sockets and lock state of the process we were forked
+    # from must not be shared; background threads didn't come along either
+    components = [shared_state, response_cache.store if response_cache is not None else None,
+                  smtp_pool, delivery_queue, generation_history]
+    for component in {id(c): c for c in components if c is not None}.values():
+        component.after_fork()
+
+os.register_at_fork(after_in_child=after_fork_in_child)
+
+def create_app():
+    # App factory for `gunicorn --preload 'app:create_app()'`: the master
+    # imports this module and builds every component once, then forks the
+    # workers, which share those pages copy-on-write
+    global startup_seconds
+    if PRELOAD_MODULES:
+        preload_modules()
+    if startup_seconds is None:
+        startup_seconds = time.perf_counter() - IMPORT_STARTED
+        if STARTUP_BUDGET_MS and startup_seconds * 1000 > STARTUP_BUDGET_MS:
+            app.logger.warning("Startup took %.0fms, over the %.0fms budget (see benchmarks/bench_startup.py)",
+                               startup_seconds * 1000, STARTUP_BUDGET_MS)
+    return app
+
 if __name__ == '__main__':
     # Use the PORT environment variable provided by Render
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
+    create_app().run(host="0.0.0.0", port=port)
@@ -0,0 +1,186 @@
+# ASGI entry point: /generate and /send-email run on the event loop, every
+# other route is served by the Flask app through an ASGI adapter.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port $PORT
+#
+# One process holds many in-flight Gemini calls at once instead of one per
+# sync gunicorn worker. SMTP stays on smtplib (and the shared pool) but runs
+# on a bounded thread pool so it never blocks the loop. The Flask routes
+# (streaming, batch, bulk sends, ...) run on a pool of ASGI_WSGI_THREADS
+# threads, so they are served concurrently too.
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+
+import app as api
+import metrics
+from backends import is_retryable
+from prompts import PromptTemplateError
+from resilience import UpstreamUnavailable
+
+SMTP_THREADS = int(os.getenv('ASGI_SMTP_THREADS', 32))
+# Concurrent requests to the Flask routes; a stream holds its thread until it ends
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 32))
+
+# Not asgiref's WsgiToAsgi: it runs every request on one shared thread
+flask_app = WSGIMiddleware(api.create_app(), workers=WSGI_THREADS)
+smtp_executor = ThreadPoolExecutor(max_workers=SMTP_THREADS, thread_name_prefix="smtp")
+
+
+async def read_json(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    try:
+        data = json.loads(body or b'null')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def send_json(send, body, status=200, headers=None):
+    payload = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode('ascii')),
+            # Matches the flask_cors defaults applied to the WSGI routes
+            (b'access-control-allow-origin', b'*'),
+        ] + [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in (headers or {}).items()],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def generate_email(data):
+    backend = api.select_backend(data)
+    if backend is None:
+        return {
+            "success": False,
+            "error": f"Unknown backend: {data.get('backend')}"
+        }, 400
+    variants, error = api.build_variants(data)
+    if error:
+        return {
+            "success": False,
+            "error": error
+        }, 400
+    if variants is not None:
+        # Candidates are awaited together on the loop
+        bypass_cache = bool(data.get('bypass_cache', False))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            api.generate_variant_async(index, variant_data, rendered, backend, bypass_cache)
+            for index, (variant_data, rendered) in enumerate(variants)
+        ))
+        body = api.variants_body(list(results), time.perf_counter() - start)
+        return body, 200 if body["success"] else 500
+    try:
+        rendered = api.build_prompt(data)
+    except PromptTemplateError as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }, 400
+    bypass_cache = bool(data.get('bypass_cache', False))
+    # The history search is a SQLite query
+    reused = await asyncio.to_thread(api.find_reusable, data) if data.get('reuse_previous') else None
+    if reused is not None:
+        return reused, 200
+    try:
+        result, cached = await api.generate_text_async(rendered, backend, bypass_cache)
+        api.record_history(data, rendered, backend, result.text, cached)
+        return {
+            "email": result.text,
+            "document": api.email_document(result.text),
+            "success": True,
+            "cached": cached,
+            "template": api.template_info(rendered),
+            "usage": api.usage_info(rendered, result)
+        }, 200
+    except Exception as e:
+        metrics.record_error("/generate", e)
+        if isinstance(e, UpstreamUnavailable) or is_retryable(e):
+            return await api.offload(api.upstream_failure_response, data, rendered, backend, e)
+        return {
+            "error": str(e),
+            "success": False
+        }, 500
+
+
+async def send_email(data):
+    payload, sender_password, error = api.parse_send_request(data)
+    if not error:
+        send_at, _, error = api.parse_schedule(data)
+    if error:
+        return {
+            "success": False,
+            "error": error
+        }, 400
+    if send_at is not None and send_at > time.time():
+        # submit() is a SQLite transaction (and a shared-state write), never
+        # cheap enough for the event loop
+        return await asyncio.to_thread(api.schedule_send, payload, sender_password, send_at), 202
+
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(smtp_executor, api.deliver_message, payload, sender_password)
+        return {
+            "success": True,
+            "message": f"Email sent successfully to {payload['recipient_email']}"
+        }, 200
+    except Exception as e:
+        metrics.record_error("/send-email", e)
+        return api.send_error(e)
+
+
+ROUTES = {
+    ('POST', '/generate'): generate_email,
+    ('POST', '/send-email'): send_email,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            smtp_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http':
+        handler = ROUTES.get((scope['method'], scope['path']))
+        if handler is not None:
+            start = time.perf_counter()
+            metrics.start_request_trace()
+            data = await read_json(receive)
+            if data is None:
+                body, status = {
+                    "success": False,
+                    "error": "Request body must be a JSON object"
+                }, 400
+            else:
+                # Handlers return (body, status) or (body, status, headers)
+                body, status, *headers = await handler(data)
+            await send_json(send, body, status, *headers)
+            metrics.REQUESTS.inc(method=scope['method'], endpoint=scope['path'], status=status)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=scope['path'])
+            return
+
+    await flask_app(scope, receive, send)
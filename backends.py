@@ -0,0 +1,241 @@
+# Text generation backends selected by configuration
+#
+#   LLM_BACKEND   default backend: gemini, fake or openai
+#   LLM_BACKENDS  comma-separated backends requests may pick with "backend"
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+from model_registry import ModelRegistry
+
+
+# google.api_core exception names, matched by name so the SDK stays optional
+THROTTLE_ERRORS = {"ResourceExhausted", "TooManyRequests"}
+TRANSIENT_ERRORS = {"ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "GatewayTimeout",
+                    "Aborted", "Unknown"}
+
+
+def _status_code(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) or getattr(error, 'code', None)
+
+
+def is_throttle(error):
+    # Upstream said "slow down": 429 or quota exhausted
+    return type(error).__name__ in THROTTLE_ERRORS or _status_code(error) == 429
+
+
+def is_retryable(error):
+    # Worth retrying after a pause; client errors such as bad arguments are not
+    if is_throttle(error) or type(error).__name__ in TRANSIENT_ERRORS:
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # requests loads with the first HTTP backend call; before that none of its errors can exist
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    status = _status_code(error)
+    return isinstance(status, int) and status >= 500
+
+
+class GenerationResult:
+    def __init__(self, text, input_tokens=None, output_tokens=None):
+        self.text = text
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, model_name, api_key):
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY is not set in the environment")
+        self.model_name = model_name
+        self.api_key = api_key
+        self._genai = None
+        # Configured models are built once and shared by every request
+        self.models = ModelRegistry(self._build_model)
+
+    def _sdk(self):
+        # The SDK and the gRPC stack under it load with the first model the
+        # registry builds, not at startup
+        if self._genai is None:
+            import google.generativeai as genai
+
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+
+    def preload(self):
+        self._sdk()
+
+    def _build_model(self, name, generation_config):
+        return self._sdk().GenerativeModel(name, generation_config=generation_config)
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model_name}"
+
+    @staticmethod
+    def _result(response):
+        usage = getattr(response, 'usage_metadata', None)
+        return GenerationResult(
+            response.text,
+            input_tokens=getattr(usage, 'prompt_token_count', None),
+            output_tokens=getattr(usage, 'candidates_token_count', None),
+        )
+
+    def generate(self, prompt):
+        return self._result(self.models.get(self.model_name).generate_content(prompt))
+
+    def stream(self, prompt):
+        for chunk in self.models.get(self.model_name).generate_content(prompt, stream=True):
+            yield chunk.text
+
+    async def generate_async(self, prompt):
+        response = await self.models.get(self.model_name).generate_content_async(prompt)
+        return self._result(response)
+
+
+class FakeBackend:
+    """Deterministic offline backend with configurable latency, for load tests."""
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, model_name="fake-email-v1"):
+        self.latency = latency
+        self.model_name = model_name
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model_name}"
+
+    def _text(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        return (
+            f"Subject: Generated email {digest}\n\n"
+            "Dear Recipient,\n\n"
+            f"This is a deterministic placeholder email generated from a {len(prompt)} character prompt.\n\n"
+            "Best regards,\n"
+            "Email Generator"
+        )
+
+    def _result(self, prompt):
+        text = self._text(prompt)
+        return GenerationResult(text, input_tokens=len(prompt.split()), output_tokens=len(text.split()))
+
+    def generate(self, prompt):
+        time.sleep(self.latency)
+        return self._result(prompt)
+
+    def stream(self, prompt):
+        words = self._text(prompt).split(" ")
+        delay = self.latency / len(words)
+        for i, word in enumerate(words):
+            time.sleep(delay)
+            yield word if i == 0 else " " + word
+
+    async def generate_async(self, prompt):
+        await asyncio.sleep(self.latency)
+        return self._result(prompt)
+
+
+class OpenAICompatibleBackend:
+    """Chat completions over HTTP, e.g. a local vLLM, llama.cpp or Ollama server."""
+
+    name = "openai"
+
+    def __init__(self, base_url, model_name, api_key=None, timeout=60):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model_name = model_name
+        self.timeout = timeout
+        self.api_key = api_key
+        self._session = None
+
+    def preload(self):
+        return self.session
+
+    @property
+    def session(self):
+        # requests loads with the first call rather than at startup
+        if self._session is None:
+            import requests
+
+            session = requests.Session()
+            if self.api_key:
+                session.headers["Authorization"] = f"Bearer {self.api_key}"
+            self._session = session
+        return self._session
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model_name}"
+
+    def _body(self, prompt, stream):
+        return {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": stream,
+        }
+
+    def generate(self, prompt):
+        response = self.session.post(self.url, json=self._body(prompt, False), timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get("usage") or {}
+        return GenerationResult(
+            data["choices"][0]["message"]["content"],
+            input_tokens=usage.get("prompt_tokens"),
+            output_tokens=usage.get("completion_tokens"),
+        )
+
+    def stream(self, prompt):
+        with self.session.post(self.url, json=self._body(prompt, True), stream=True,
+                               timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                choices = json.loads(data).get("choices") or [{}]
+                text = (choices[0].get("delta") or {}).get("content")
+                if text:
+                    yield text
+
+    async def generate_async(self, prompt):
+        # requests has no async client; keep the HTTP call off the event loop
+        return await asyncio.to_thread(self.generate, prompt)
+
+
+def create_backend(name):
+    if name == "gemini":
+        return GeminiBackend(
+            os.getenv('GEMINI_MODEL', 'models/gemini-1.5-flash'),
+            os.getenv('GEMINI_API_KEY'),
+        )
+    if name == "fake":
+        return FakeBackend(latency=float(os.getenv('FAKE_LLM_LATENCY', 0.5)))
+    if name == "openai":
+        return OpenAICompatibleBackend(
+            os.getenv('OPENAI_BASE_URL', 'http://127.0.0.1:8000/v1'),
+            os.getenv('OPENAI_MODEL', 'local-model'),
+            api_key=os.getenv('OPENAI_API_KEY'),
+            timeout=float(os.getenv('OPENAI_TIMEOUT', 60)),
+        )
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+def backends_from_env():
+    # Returns (default_name, {name: backend}) for the configured backends
+    default = os.getenv('LLM_BACKEND', 'gemini')
+    names = [name.strip() for name in os.getenv('LLM_BACKENDS', '').split(",") if name.strip()]
+    if default not in names:
+        names.insert(0, default)
+    return default, {name: create_backend(name) for name in names}
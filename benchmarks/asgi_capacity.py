@@ -0,0 +1,120 @@
+# Concurrent-request capacity of one server process against a fake LLM
+#
+#   python -m benchmarks.asgi_capacity --server asgi --latency 0.5 --levels 1,10,100,500
+#   python -m benchmarks.asgi_capacity --server wsgi --latency 0.5 --levels 1,10
+#   python -m benchmarks.asgi_capacity --server asgi --path /generate/stream --levels 1,4,32
+#
+# The server runs in a subprocess with LLM_BACKEND=fake, which just sleeps for
+# --latency. "wsgi" is a single-threaded WSGI server, i.e. what one sync
+# gunicorn worker can do; "asgi" is uvicorn running asgi:app. /generate runs
+# on the event loop there, /generate/stream goes through the WSGI adapter's
+# thread pool, so with either path in-flight requests should track concurrency.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.client import HOST, percentile, request, wait_for_server
+
+
+def serve(server, port):
+    if server == "asgi":
+        import uvicorn
+        uvicorn.run("asgi:app", host=HOST, port=port, log_level="warning", backlog=4096)
+    else:
+        from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        import app as api
+        make_server(HOST, port, api.app, handler_class=QuietHandler).serve_forever()
+
+
+async def run_level(port, path, concurrency, total):
+    body = {"prompt": "Load test", "tone": "Formal", "purpose": "benchmarking", "bypass_cache": True}
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                status = await request(port, "POST", path, body)
+            except OSError:
+                status = 0
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+async def drive(port, path, levels, latency):
+    await wait_for_server(port)
+    results = []
+    for concurrency in levels:
+        result = await run_level(port, path, concurrency, max(concurrency * 4, 20))
+        # Requests actually in flight on average, by Little's law
+        result["effective_concurrency"] = round(result["throughput_rps"] * latency, 1)
+        print(f"c={concurrency:<5} {result['throughput_rps']:>9.1f} req/s  p50 {result['p50_ms']:>8.1f} ms  "
+              f"p99 {result['p99_ms']:>8.1f} ms  in-flight ~{result['effective_concurrency']}  "
+              f"errors {result['errors']}")
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-process concurrency load test")
+    parser.add_argument("--server", choices=["asgi", "wsgi"], default="asgi")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake LLM latency in seconds")
+    parser.add_argument("--path", choices=["/generate", "/generate/stream"], default="/generate")
+    parser.add_argument("--levels", default="1,10,100,500")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.server, args.port)
+        return
+
+    env = dict(os.environ, LLM_BACKEND="fake", FAKE_LLM_LATENCY=str(args.latency))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.asgi_capacity", "--serve", "--server", args.server,
+         "--port", str(args.port)],
+        env=env
+    )
+    try:
+        levels = [int(level) for level in args.levels.split(",")]
+        results = asyncio.run(drive(args.port, args.path, levels, args.latency))
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"server": args.server, "path": args.path, "latency": args.latency, "results": results},
+                      f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
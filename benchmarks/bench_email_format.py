@@ -0,0 +1,92 @@
+# MIME assembly and body rendering: regex-over-HTML per message vs. a
+# structured document rendered once and a MIME builder shared across recipients
+#
+#   python -m benchmarks.bench_email_format --paragraphs 200 --recipients 100
+import argparse
+import re
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from email_format import EmailDocument, MessageBuilder
+from textproc import text_to_html
+
+
+def make_email(paragraphs):
+    sentence = "Thank you for the detailed update on the rollout – we’re on track for the review. "
+    body = "\n\n".join(sentence * 6 for _ in range(paragraphs))
+    return f"Subject: Quarterly review follow-up\n\nDear Ms. Smith,\n\n{body}\n\nBest regards,\nAlex"
+
+
+def old_message(email_html, recipient):
+    # What /send-email did for every message
+    match = re.search(r"Subject:(.*?)(?:\n|<br>)", email_html, re.IGNORECASE)
+    subject = match.group(1).strip() if match else "Generated Email"
+    msg = MIMEMultipart('alternative')
+    msg['From'] = "Alex <alex@example.com>"
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(re.sub(r'<.*?>', '', email_html), 'plain'))
+    msg.attach(MIMEText(email_html, 'html'))
+    return msg
+
+
+def html_to_text(html):
+    # What the frontend did to turn the preview HTML back into editable text
+    return re.sub(r"<[^>\n]*>", '', html.replace("<br>", "\n"))
+
+
+def new_messages(document, recipients):
+    builder = MessageBuilder(document)
+    return [builder.message(recipient, "Alex", "alex@example.com") for recipient in recipients]
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(label, before, after):
+    print(f"{label:<28} before {before * 1000:9.2f} ms  after {after * 1000:9.2f} ms  "
+          f"({before / after:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Email rendering and MIME assembly benchmark")
+    parser.add_argument("--paragraphs", type=int, default=200)
+    parser.add_argument("--recipients", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = make_email(args.paragraphs)
+    email_html = text_to_html(text)
+    document = EmailDocument.parse(text)
+    recipients = [f"user{i}@example.com" for i in range(args.recipients)]
+    print(f"body: {len(text) / 1024:.0f} KiB, {args.recipients} recipients")
+
+    # Building and serializing, since the encoded parts are what gets reused
+    before = measure(lambda: [old_message(email_html, r).as_bytes() for r in recipients], args.repeat)
+    after = measure(lambda: [msg.as_bytes() for msg in new_messages(document, recipients)], args.repeat)
+    report("bulk send (build + flatten)", before, after)
+
+    before = measure(lambda: [old_message(email_html, r) for r in recipients], args.repeat)
+    after = measure(lambda: new_messages(document, recipients), args.repeat)
+    report("bulk send (build only)", before, after)
+
+    # The frontend used to convert between preview HTML and text on reruns; now
+    # it parses once per generated email and keeps the rendered strings
+    convert = measure(lambda: text_to_html(html_to_text(email_html)), args.repeat * 20)
+    parse = measure(lambda: EmailDocument.parse(text), args.repeat * 20)
+    render = measure(lambda: (document.render_html(include_subject=True), document.render_text(include_subject=True)),
+                     args.repeat * 20)
+    print(f"{'html <-> text round trip':<28} {convert * 1000:9.2f} ms (old, per conversion)")
+    print(f"{'parse document':<28} {parse * 1000:9.2f} ms (once per email)")
+    print(f"{'render html + text':<28} {render * 1000:9.2f} ms (once per email)")
+
+
+if __name__ == '__main__':
+    main()
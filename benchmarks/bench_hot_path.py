@@ -0,0 +1,76 @@
+# Per-request setup cost before and after the model registry / precompiled regexes
+#
+#   python -m benchmarks.bench_hot_path --number 20000
+import argparse
+import re
+import timeit
+
+import textproc
+from model_registry import ModelRegistry
+
+EMAIL_TEXT = (
+    "Subject: Quarterly review follow-up\n\n"
+    "Dear Ms. Smith,\n\n" + "Thank you for your time today. " * 40 + "\n\nBest regards,\nAlex"
+)
+
+
+def old_validation():
+    # What /send-email and the frontend did inline on every call
+    re.match(r"[^@]+@[^@]+\.[^@]+", "recipient@example.com")
+    re.match(r"[^@]+@[^@]+\.[^@]+", "sender@example.com")
+
+
+def new_validation():
+    textproc.is_valid_email("recipient@example.com")
+    textproc.is_valid_email("sender@example.com")
+
+
+def old_preview():
+    # What the frontend did to render a generated email on every rerun
+    re.sub(r"Subject: (.*)", r"<strong>Subject:</strong> \1", EMAIL_TEXT).replace("\n", "<br>")
+
+
+def new_preview():
+    textproc.text_to_html(EMAIL_TEXT)
+
+
+def report(label, before, after, number):
+    before_us = before / number * 1e6
+    after_us = after / number * 1e6
+    print(f"{label:<18} before {before_us:9.2f} us/call  after {after_us:9.2f} us/call  "
+          f"({before_us / after_us:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path micro-benchmark")
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    # Subject extraction and tag stripping are gone from the send path; see
+    # bench_email_format for what replaced them
+    for label, old, new in (("address validation", old_validation, new_validation),
+                            ("preview render", old_preview, new_preview)):
+        before = min(timeit.repeat(old, number=args.number, repeat=3))
+        after = min(timeit.repeat(new, number=args.number, repeat=3))
+        report(label, before, after, args.number)
+
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        print("google-generativeai is not installed; skipping model construction benchmark")
+        return
+
+    genai.configure(api_key="benchmark-key")
+    registry = ModelRegistry(
+        lambda name, generation_config: genai.GenerativeModel(name, generation_config=generation_config)
+    )
+    model_number = max(1, args.number // 10)
+    before = min(timeit.repeat(lambda: genai.GenerativeModel('models/gemini-1.5-flash'),
+                               number=model_number, repeat=3))
+    after = min(timeit.repeat(lambda: registry.get('models/gemini-1.5-flash'),
+                              number=model_number, repeat=3))
+    report("model per request", before, after, model_number)
+
+
+if __name__ == '__main__':
+    main()
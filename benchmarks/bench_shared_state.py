@@ -0,0 +1,67 @@
+# Several worker processes drawing from one rate limit, with per-process
+# buckets vs. a shared bucket (SQLite file or the local Redis stand-in)
+#
+#   python -m benchmarks.bench_shared_state --workers 4 --rate 50 --seconds 3
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.redis_sink import RedisSink
+from ratelimit import SharedTokenBucket, TokenBucket
+from shared_state import state_from_url
+
+
+def worker(url, rate, seconds, results):
+    # Calls as fast as the bucket allows, like a busy gunicorn worker would
+    if url:
+        bucket = SharedTokenBucket(state_from_url(url), "bench", rate, 1)
+    else:
+        bucket = TokenBucket(rate, 1)
+    calls = 0
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while True:
+        start = time.perf_counter()
+        wait = bucket.take()
+        latencies.append(time.perf_counter() - start)
+        if time.monotonic() + wait > deadline:
+            break
+        time.sleep(wait)
+        calls += 1
+    results.put((calls, sorted(latencies)[len(latencies) // 2]))
+
+
+def run(label, url, args):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(url, args.rate, args.seconds, results))
+                 for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    calls = sum(count for count, _ in outcomes)
+    median_us = max(latency for _, latency in outcomes) * 1e6
+    print(f"{label:<18} {calls / args.seconds:8.1f} calls/s across {args.workers} workers "
+          f"(limit {args.rate}/s)  take() median {median_us:7.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared rate limit benchmark")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=50)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    run("per-process", "", args)
+    with tempfile.TemporaryDirectory() as directory:
+        run("shared sqlite", "sqlite:///" + os.path.join(directory, "state.db"), args)
+    sink = RedisSink().start()
+    run("shared redis sink", f"redis://127.0.0.1:{sink.port}/0", args)
+    sink.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Compare per-message latency of fresh SMTP sessions against the pool
+#
+#   python -m benchmarks.bench_smtp_pool --messages 200 --latency 0.005
+import argparse
+import smtplib
+import statistics
+import time
+from email.mime.text import MIMEText
+
+from benchmarks.smtp_sink import SMTPSink
+from smtp_pool import SMTPConnectionPool
+
+SENDER = "sender@example.com"
+PASSWORD = "app-password"
+
+
+def build_message(i):
+    msg = MIMEText(f"Benchmark message {i}", "plain")
+    msg['From'] = SENDER
+    msg['To'] = "recipient@example.com"
+    msg['Subject'] = f"Benchmark {i}"
+    return msg
+
+
+def send_fresh(port, msg):
+    # What /send-email did before pooling: connect, login, send, quit
+    with smtplib.SMTP("127.0.0.1", port) as server:
+        server.login(SENDER, PASSWORD)
+        server.send_message(msg)
+
+
+def measure(label, send, messages):
+    timings = []
+    for i in range(messages):
+        msg = build_message(i)
+        start = time.perf_counter()
+        send(msg)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    result = {
+        "mode": label,
+        "messages": messages,
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 3),
+    }
+    print(f"{label:>6}: mean {result['mean_ms']:.3f} ms  p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SMTP pool benchmark")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="simulated server reply latency in seconds")
+    args = parser.parse_args()
+
+    sink = SMTPSink(latency=args.latency).start()
+    # The local sink speaks plain SMTP, so skip STARTTLS on both paths
+    pool = SMTPConnectionPool(starttls=False)
+    try:
+        fresh = measure("fresh", lambda msg: send_fresh(sink.port, msg), args.messages)
+        pooled = measure("pooled", lambda msg: pool.send("127.0.0.1", sink.port, SENDER, PASSWORD, msg),
+                         args.messages)
+    finally:
+        pool.close_all()
+        sink.shutdown()
+
+    print(f"speedup: {fresh['mean_ms'] / pooled['mean_ms']:.1f}x  pool stats: {pool.stats()}")
+
+
+if __name__ == '__main__':
+    main()
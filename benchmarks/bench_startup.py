@@ -0,0 +1,115 @@
+# Cold start of the API: `python -X importtime` breakdown of `import app`,
+# what endpoints import on first use, and wall-clock startup plus the first
+# /generate with those imports lazy (the default) vs. up front (PRELOAD_MODULES=1)
+#
+#   python -m benchmarks.bench_startup --repeat 5 --budget-ms 400
+#
+# Exits non-zero when the median import + create_app() time is over
+# --budget-ms, so it can guard startup time in CI.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import app
+app.create_app()
+ready = time.perf_counter()
+response = app.app.test_client().post('/generate', json={"prompt": "Quarterly review follow-up", "bypass_cache": True})
+done = time.perf_counter()
+print(json.dumps({"startup": ready - start, "first_request": done - ready, "status": response.status_code}))
+"""
+
+
+def child_env(preload):
+    env = dict(os.environ)
+    env.setdefault("LLM_BACKEND", "fake")
+    env.setdefault("FAKE_LLM_LATENCY", "0")
+    env["PRELOAD_MODULES"] = "1" if preload else "0"
+    return env
+
+
+def import_times(preload):
+    # (self_us, cumulative_us, depth, module) for every import of `import app`
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app; app.create_app()"],
+                            cwd=ROOT, env=child_env(preload), capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def cold_starts(preload, repeat):
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=child_env(preload),
+                                capture_output=True, text=True, check=True)
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return runs
+
+
+def interpreter_ms(repeat):
+    # Python itself starting and exiting, which no change to the app can save
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def median_ms(runs, field):
+    return statistics.median(run[field] for run in runs) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API import and cold start benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="modules to list by cumulative import time")
+    parser.add_argument("--budget-ms", type=float, default=0, help="fail if median startup is over this")
+    args = parser.parse_args()
+
+    rows = import_times(preload=False)
+    total = sum(self_us for self_us, _, _, _ in rows)
+    app_us = next(cumulative for _, cumulative, _, name in rows if name == "app")
+    print(f"import app: {app_us / 1000:.1f} ms of {total / 1000:.1f} ms importing {len(rows)} modules")
+    print(f"{'module':<40} {'cumulative':>12} {'self':>10}")
+    # Top-level modules and app's direct imports are where lazy loading pays off
+    for self_us, cumulative_us, depth, name in sorted((row for row in rows if row[2] <= 1),
+                                                      key=lambda row: row[1], reverse=True)[:args.top]:
+        print(f"{'  ' * depth + name:<40} {cumulative_us / 1000:9.1f} ms {self_us / 1000:7.1f} ms")
+
+    # What PRELOAD_MODULES=1 (or the first request to each endpoint) imports on top
+    imported = {name for _, _, _, name in rows}
+    deferred = [(name, self_us) for self_us, _, _, name in import_times(preload=True) if name not in imported]
+    print(f"\n{len(deferred)} modules ({sum(us for _, us in deferred) / 1000:.1f} ms) deferred to first use: "
+          f"{', '.join(sorted(name for name, _ in deferred))}")
+
+    print(f"\npython -c pass: {interpreter_ms(args.repeat):.1f} ms")
+    print(f"{'':<22} {'startup':>10} {'first /generate':>16}")
+    results = {}
+    for label, preload in (("lazy (default)", False), ("PRELOAD_MODULES=1", True)):
+        runs = results[label] = cold_starts(preload, args.repeat)
+        print(f"{label:<22} {median_ms(runs, 'startup'):7.1f} ms {median_ms(runs, 'first_request'):13.1f} ms")
+
+    if args.budget_ms:
+        startup = median_ms(results["lazy (default)"], "startup")
+        if startup > args.budget_ms:
+            print(f"\nstartup {startup:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+            sys.exit(1)
+        print(f"\nstartup {startup:.1f} ms is within the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# Dependency-free asyncio HTTP/1.1 client for driving the server in benchmarks
+import asyncio
+import json
+import time
+
+HOST = "127.0.0.1"
+
+
+async def request(port, method, path, body=None, host=HOST):
+    # Returns the status code; one connection per request, like a fresh browser tab
+    reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(body).encode() if body is not None else b""
+    head = (
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n"
+    )
+    writer.write(head.encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+async def wait_for_server(port, timeout=20, host=HOST):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if await request(port, "GET", "/health", host=host) == 200:
+                return
+        except (OSError, IndexError, ValueError):
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
@@ -0,0 +1,264 @@
+# Load test for /generate, /send-email and /health against a fake LLM and a local SMTP sink
+#
+#   python -m benchmarks.loadtest --server gunicorn --workers 2 --concurrency 32 \
+#       --duration 20 --mix generate=6,send=2,health=2 --output results.json
+#   python -m benchmarks.loadtest ... --compare results.json
+#
+# The server runs as a subprocess with LLM_BACKEND=fake and SMTP_STARTTLS=0;
+# /send-email traffic goes to an in-process SMTP sink. Results (throughput,
+# latency percentiles per endpoint, server RSS) are printed and optionally
+# saved as JSON so runs from different commits can be compared.
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.client import HOST, percentile, request, wait_for_server
+from benchmarks.smtp_sink import SMTPSink
+
+ENDPOINTS = ("generate", "send", "health")
+
+
+def server_command(server, port, workers, threads):
+    if server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+                "-b", f"{HOST}:{port}", "--log-level", "warning", "--preload", "app:create_app()"]
+    if server == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "asgi:app", "--host", HOST, "--port", str(port),
+                "--workers", str(workers), "--log-level", "warning"]
+    return [sys.executable, "-m", "flask", "--app", "app", "run", "--host", HOST,
+            "--port", str(port), "--with-threads"]
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The ppid is the second field after the parenthesised command name
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def tree_rss_kb(pid):
+    # Resident memory of the server and all of its worker processes (Linux only)
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+        pending.extend(_children(current))
+    return total or None
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint in --mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def build_bodies(sink_port, repeat_ratio, rng):
+    counter = iter(range(10 ** 9))
+
+    def generate():
+        # repeat_ratio of requests reuse a small set of prompts and can hit the cache
+        if rng.random() < repeat_ratio:
+            prompt = f"Repeated load test prompt {rng.randrange(8)}"
+        else:
+            prompt = f"Unique load test prompt {next(counter)}"
+        return "POST", "/generate", {
+            "prompt": prompt,
+            "tone": "Formal",
+            "purpose": "a load test",
+            "recipient": "Load Tester",
+            "sender_name": "Benchmark",
+            "key_points": ["throughput", "latency"],
+        }
+
+    def send():
+        return "POST", "/send-email", {
+            "email_content": "<strong>Subject:</strong> Load test<br><br>Hello from the benchmark.",
+            "recipient_email": "recipient@example.com",
+            "sender_name": "Benchmark",
+            "sender_email": "sender@example.com",
+            "sender_password": "app-password",
+            "email_host": HOST,
+            "email_port": sink_port,
+        }
+
+    def health():
+        return "GET", "/health", None
+
+    return {"generate": generate, "send": send, "health": health}
+
+
+async def drive(port, server_pid, args):
+    await wait_for_server(port)
+    rng = random.Random(args.seed)
+    sink = SMTPSink(latency=args.smtp_latency).start()
+    bodies = build_bodies(sink.port, args.repeat_ratio, rng)
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    rss_samples = []
+    stop_at = time.monotonic() + args.warmup + args.duration
+    measure_from = time.monotonic() + args.warmup
+
+    async def user():
+        while time.monotonic() < stop_at:
+            name = rng.choices(names, weights)[0]
+            method, path, body = bodies[name]()
+            start = time.monotonic()
+            try:
+                status = await request(port, method, path, body)
+            except OSError:
+                status = 0
+            if start >= measure_from:
+                latencies[name].append(time.monotonic() - start)
+                if status != 200:
+                    errors[name] += 1
+
+    async def sample_rss():
+        while time.monotonic() < stop_at:
+            rss = tree_rss_kb(server_pid)
+            if rss:
+                rss_samples.append(rss)
+            await asyncio.sleep(0.25)
+
+    try:
+        await asyncio.gather(sample_rss(), *(user() for _ in range(args.concurrency)))
+    finally:
+        sink.shutdown()
+
+    endpoints = {}
+    for name in names:
+        values = sorted(latencies[name])
+        endpoints[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "throughput_rps": round(len(values) / args.duration, 2),
+            "p50_ms": _ms(percentile(values, 0.50)),
+            "p90_ms": _ms(percentile(values, 0.90)),
+            "p99_ms": _ms(percentile(values, 0.99)),
+            "max_ms": _ms(values[-1] if values else None),
+        }
+    total = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "endpoints": endpoints,
+        "total_throughput_rps": round(total / args.duration, 2),
+        "rss_kb": {
+            "peak": max(rss_samples) if rss_samples else None,
+            "end": rss_samples[-1] if rss_samples else None,
+        },
+        "smtp_sink": dict(sink.stats),
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results):
+    print(f"{'endpoint':<10}{'req':>8}{'err':>6}{'rps':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for name, endpoint in results["endpoints"].items():
+        print(f"{name:<10}{endpoint['requests']:>8}{endpoint['errors']:>6}{endpoint['throughput_rps']:>10}"
+              f"{endpoint['p50_ms']!s:>10}{endpoint['p90_ms']!s:>10}{endpoint['p99_ms']!s:>10}")
+    print(f"total throughput: {results['total_throughput_rps']} req/s   "
+          f"server RSS peak: {results['rss_kb']['peak']} kB")
+
+
+def print_comparison(baseline, results):
+    print(f"\ncompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for name, endpoint in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p99_ms"):
+            old, new = before.get(metric), endpoint.get(metric)
+            if old and new is not None:
+                print(f"  {name:<10}{metric:<16}{old:>10} -> {new:<10} ({(new - old) / old * 100:+.1f}%)")
+    old_rss, new_rss = baseline["rss_kb"].get("peak"), results["rss_kb"].get("peak")
+    if old_rss and new_rss:
+        print(f"  {'server':<10}{'rss_peak_kb':<16}{old_rss:>10} -> {new_rss:<10} "
+              f"({(new_rss - old_rss) / old_rss * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the email generator API")
+    parser.add_argument("--server", choices=["gunicorn", "uvicorn", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1, help="threads per gunicorn worker")
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before measuring")
+    parser.add_argument("--mix", default="generate=6,send=2,health=2", help="endpoint=weight,...")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake LLM latency in seconds")
+    parser.add_argument("--smtp-latency", type=float, default=0.002, help="SMTP sink reply latency")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0,
+                        help="fraction of /generate requests reusing a cacheable prompt")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    args = parser.parse_args()
+
+    env = dict(os.environ, LLM_BACKEND="fake", FAKE_LLM_LATENCY=str(args.llm_latency), SMTP_STARTTLS="0")
+    command = server_command(args.server, args.port, args.workers, args.threads)
+    server = subprocess.Popen(command, env=env)
+    try:
+        results = asyncio.run(drive(args.port, server.pid, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    results["meta"] = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "command": command,
+        "config": vars(args),
+    }
+    print_report(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# Minimal local Redis stand-in speaking RESP, for benchmarks and trying out
+# SHARED_STATE_URL=redis://... without a Redis server
+#
+# It keeps an in-memory dict and implements only the commands shared_state.py
+# sends; its Lua scripts are run by Python ports matched on the script's SHA.
+import argparse
+import hashlib
+import socketserver
+import threading
+import time
+
+from shared_state import TAKE_SCRIPT, UNLOCK_SCRIPT, RedisError
+
+
+def _reply(value):
+    if isinstance(value, RedisError):
+        return f"-{value}\r\n".encode("utf-8")
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        return b"+OK\r\n" if value else b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_reply(item) for item in value)
+    value = str(value).encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode("utf-8").split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    def handle(self):
+        self.server.count("connections")
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            self.server.count("commands")
+            try:
+                result = self.server.run(args[0].upper(), args[1:])
+            except (ValueError, IndexError) as e:
+                result = RedisError(f"ERR {e}")
+            self.wfile.write(_reply(result))
+            self.wfile.flush()
+
+
+class RedisSink(socketserver.ThreadingTCPServer):
+    """In-memory key/value and hash store with expiry; `latency` delays every reply."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), _SinkHandler)
+        self.latency = latency
+        self.stats = {"connections": 0, "commands": 0}
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._scripts = {
+            hashlib.sha1(TAKE_SCRIPT.encode("utf-8")).hexdigest(): self._take,
+            hashlib.sha1(UNLOCK_SCRIPT.encode("utf-8")).hexdigest(): self._unlock,
+        }
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def _get(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def _set(self, key, value, px=None):
+        self._data[key] = value
+        if px is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = time.time() + px / 1000
+
+    def _take(self, keys, args):
+        now = time.time()
+        interval, tolerance = float(args[0]), float(args[1])
+        tat = max(float(self._get(keys[0]) or 0), now) + interval
+        self._set(keys[0], f"{tat:.6f}", (tat - now + tolerance) * 1000 + 1000)
+        return f"{max(0.0, tat - now - tolerance):.6f}"
+
+    def _unlock(self, keys, args):
+        if self._get(keys[0]) == args[0]:
+            self._data.pop(keys[0], None)
+            return 1
+        return 0
+
+    def run(self, command, args):
+        with self._lock:
+            if command in ("PING",):
+                return "PONG"
+            if command in ("AUTH", "SELECT"):
+                return True
+            if command == "GET":
+                return self._get(args[0])
+            if command == "SET":
+                options = [arg.upper() for arg in args[2:]]
+                if "NX" in options and self._get(args[0]) is not None:
+                    return None
+                px = int(args[2 + options.index("PX") + 1]) if "PX" in options else None
+                self._set(args[0], args[1], px)
+                return True
+            if command == "DEL":
+                return sum(self._data.pop(key, None) is not None for key in args)
+            if command == "INCRBYFLOAT":
+                value = float(self._get(args[0]) or 0) + float(args[1])
+                self._data[args[0]] = repr(value)
+                return repr(value)
+            if command == "HSET":
+                table = self._get(args[0])
+                if table is None:
+                    table = self._data[args[0]] = {}
+                added = sum(field not in table for field in args[1::2])
+                table.update(zip(args[1::2], args[2::2]))
+                return added
+            if command == "HGETALL":
+                table = self._get(args[0]) or {}
+                return [item for pair in table.items() for item in pair]
+            if command == "PEXPIRE":
+                if self._get(args[0]) is None:
+                    return 0
+                self._expires[args[0]] = time.time() + int(args[1]) / 1000
+                return 1
+            if command in ("EVALSHA", "EVAL"):
+                sha = args[0] if command == "EVALSHA" else hashlib.sha1(args[0].encode("utf-8")).hexdigest()
+                script = self._scripts.get(sha)
+                if script is None:
+                    return RedisError("NOSCRIPT No matching script")
+                numkeys = int(args[1])
+                return script(args[2:2 + numkeys], args[2 + numkeys:])
+            return RedisError(f"ERR unknown command '{command}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local Redis stand-in")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each reply")
+    args = parser.parse_args()
+    sink = RedisSink(port=args.port, latency=args.latency)
+    print(f"Redis sink listening on 127.0.0.1:{sink.port}")
+    sink.serve_forever()
@@ -0,0 +1,82 @@
+# Minimal local SMTP server that accepts and discards mail, for benchmarks
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        self.server.count("connections")
+        self.reply("220 localhost SMTP sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250-AUTH PLAIN")
+                self.reply("250 8BITMIME")
+            elif command == "HELO":
+                self.reply("250 localhost")
+            elif command == "AUTH":
+                self.server.count("logins")
+                self.reply("235 Authentication successful")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                self.server.count("messages")
+                self.reply("250 OK: queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Accepts any login and message; `latency` delays every reply to mimic a remote server."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), _SinkHandler)
+        self.latency = latency
+        self.stats = {"connections": 0, "logins": 0, "messages": 0}
+        self._stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each reply")
+    args = parser.parse_args()
+    sink = SMTPSink(port=args.port, latency=args.latency)
+    print(f"SMTP sink listening on 127.0.0.1:{sink.port}")
+    sink.serve_forever()
@@ -0,0 +1,191 @@
+# Response cache for generated emails
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def make_cache_key(full_prompt, model_name, template_key=""):
+    # Normalize whitespace so indentation changes in the prompt don't split entries
+    normalized = _WHITESPACE.sub(" ", full_prompt).strip()
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(template_key.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalized.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SQLiteStore:
+    """On-disk second tier, shared by every worker pointing at the same file.
+
+    Expired rows are kept `retain` seconds for stale fallback; set() purges
+    older ones at most every `purge_interval` seconds.
+    """
+
+    def __init__(self, path, retain=3600, purge_interval=60):
+        self.path = path
+        self.retain = retain
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at);
+            """
+        )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def after_fork(self):
+        # A SQLite connection must not be used on both sides of a fork; a
+        # worker forked from a preloading master opens its own
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def get(self, key):
+        # Returns (value, expires_at) even when expired; the cache decides freshness
+        with self._lock:
+            return self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+        self._maybe_purge()
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            self.purge_expired(self.retain)
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def purge_expired(self, grace=0):
+        # Returns how many rows went; an index range scan on expires_at
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM response_cache WHERE expires_at < ?", (time.time() - grace,)
+            ).rowcount
+
+
+class ResponseCache:
+    """In-process LRU with per-entry TTL and an optional second-tier store.
+
+    Expired entries stay until evicted so they can be served as a stale
+    fallback while the upstream is unavailable (get(key, allow_stale=True)).
+    """
+
+    def __init__(self, max_entries=512, ttl=3600, store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, allow_stale=False):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if allow_stale:
+                    self.stale_hits += 1
+                    return value
+
+        if self.store is not None:
+            found = self.store.get(key)
+            if found is not None:
+                value, expires_at = found
+                if expires_at >= now:
+                    with self._lock:
+                        self._put(key, value, expires_at)
+                        self.store_hits += 1
+                    return value
+                if allow_stale:
+                    with self._lock:
+                        self.stale_hits += 1
+                    return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put(key, value, expires_at)
+        if self.store is not None:
+            self.store.set(key, value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def _put(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.store_hits) / lookups, 4) if lookups else 0.0,
+                "store": type(self.store).__name__ if self.store is not None else None,
+            }
+
+
+def cache_from_env(shared_state=None):
+    # Build the cache from CACHE_* environment variables; None disables caching.
+    # CACHE_DB_PATH takes precedence over the shared state as second tier
+    if os.getenv('CACHE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+        return None
+    db_path = os.getenv('CACHE_DB_PATH', '')
+    ttl = float(os.getenv('CACHE_TTL', 3600))
+    store = SQLiteStore(db_path, retain=ttl) if db_path else shared_state
+    return ResponseCache(
+        max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 512)),
+        ttl=ttl,
+        store=store,
+    )
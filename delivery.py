@@ -0,0 +1,494 @@
+# Background delivery queue for bulk and scheduled sends, with job status kept in SQLite
+#
+# DELIVERY_DB_PATH (delivery.db by default) is the SQLite file that keeps jobs
+# and their status across restarts; share it between the workers on a host.
+#
+# SMTP passwords are never written to it. A restart therefore cannot finish
+# a job: whatever it had not sent yet, including scheduled sends that were not
+# due, is reported as failed and has to be resubmitted. With DELIVERY_DB_PATH
+# set to :memory: nothing survives a restart, and the API refuses scheduled
+# sends altogether (see `durable`).
+import heapq
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+from ratelimit import KeyedRateLimiter
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED = "scheduled"
+QUEUED = "queued"
+SENDING = "sending"
+RETRYING = "retrying"
+SENT = "sent"
+FAILED = "failed"
+
+PENDING_STATUSES = (SCHEDULED, QUEUED, SENDING, RETRYING)
+
+# Seconds between sweeps for finished jobs past status_ttl
+PURGE_INTERVAL = 60
+
+
+@lru_cache(maxsize=None)
+def smtp_errors():
+    # (errors that will not go away by retrying the same message, any SMTP
+    # error); smtplib loads with the first delivery rather than at startup
+    import smtplib
+
+    permanent = (
+        smtplib.SMTPAuthenticationError,
+        smtplib.SMTPRecipientsRefused,
+        smtplib.SMTPSenderRefused,
+    )
+    return permanent, smtplib.SMTPException
+
+
+class DeliveryQueue:
+    """Durable job/message status with an in-process worker pool.
+
+    Message payloads and status live in SQLite so any worker process can
+    answer /jobs/<id>. SMTP passwords are only ever held in memory; if the
+    owning process dies, its unfinished messages are marked failed rather
+    than left pending forever. Every process that has submitted a job
+    heartbeats under a per-process owner id; queues sharing the database
+    fail pending messages whose owner stopped heartbeating, at startup, from
+    their heartbeat thread and when /jobs is polled.
+
+    Scheduled messages wait in the same in-memory heap as retries, keyed on
+    their due time, so the timer thread sleeps until the next one is due
+    instead of polling the table; their due time is stored in
+    next_attempt_at, which the (status, next_attempt_at) index covers.
+
+    With shared `state` (see shared_state.py) the per-host rate limit is
+    global and message status is mirrored there, so /jobs/<id> works on
+    every node, not just the one that accepted the job.
+    """
+
+    def __init__(self, send_fn, db_path=':memory:', workers=4, max_attempts=5,
+                 base_delay=2.0, max_delay=300.0, host_rate=5.0, host_burst=None,
+                 state=None, status_ttl=7 * 86400, heartbeat_interval=10.0):
+        self.send_fn = send_fn
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = KeyedRateLimiter(host_rate, host_burst, state=state, prefix="ratelimit:smtp:")
+        self.state = state
+        self.status_ttl = status_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.owner = self._new_owner()
+
+        self.db_path = db_path
+        # Whether jobs outlive this process at all
+        self.durable = db_path not in (':memory:', '')
+        self._db_lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS delivery_jobs (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                total INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS delivery_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                recipient_email TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at REAL,
+                owner TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_delivery_messages_job ON delivery_messages (job_id, idx);
+            CREATE INDEX IF NOT EXISTS idx_delivery_messages_status ON delivery_messages (status, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS idx_delivery_jobs_created ON delivery_jobs (created_at);
+            CREATE TABLE IF NOT EXISTS delivery_owners (
+                owner TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            );
+            """
+        )
+
+        self._ready = queue.Queue()
+        self._delayed = []
+        self._delayed_cond = threading.Condition()
+        self._credentials = {}
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._last_purge = time.monotonic()
+        self._last_recovery = time.monotonic()
+        # Messages left pending by a worker that died before this one started
+        self._recover_orphans()
+
+    # Storage helpers
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        if self.db_path != ':memory:':
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _execute(self, sql, params=()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _update(self, message_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(
+            f"UPDATE delivery_messages SET {assignments} WHERE id = ?",
+            (*fields.values(), message_id),
+        )
+        if self.state is not None:
+            rows = self._execute(
+                "SELECT job_id, idx, recipient_email, status, attempts, last_error, next_attempt_at "
+                "FROM delivery_messages WHERE id = ?",
+                (message_id,),
+            )
+            if rows:
+                job_id, *row = rows[0]
+                self._mirror(job_id, {row[0]: json.dumps(row)})
+
+    @staticmethod
+    def _status_key(job_id):
+        return f"delivery:job:{job_id}"
+
+    def _mirror(self, job_id, fields):
+        # Status rows are (idx, recipient_email, status, attempts, last_error, next_attempt_at)
+        try:
+            self.state.hset(self._status_key(job_id), fields, self.status_ttl)
+        except Exception as e:
+            # Shared status is a convenience; never let it fail a delivery
+            logger.warning("Could not mirror status of delivery job %s: %s", job_id, e)
+
+    @staticmethod
+    def _new_owner():
+        # Unique per process start: a restarted container may get the same pid back
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+    # Lifecycle
+
+    def after_fork(self):
+        # In a worker forked from a preloading master: no threads came along,
+        # and a database file gets a connection of its own (an in-memory one
+        # is already a private copy)
+        self._db_lock = threading.Lock()
+        if self.db_path != ':memory:':
+            self._conn = self._connect()
+        self.owner = self._new_owner()
+        self._ready = queue.Queue()
+        self._delayed = []
+        self._delayed_cond = threading.Condition()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Threads start lazily so the queue is safe to create before a fork
+        with self._start_lock:
+            if self._started:
+                return
+            # Beat before the first message is written, so it's never taken for an orphan
+            self._beat()
+            for _ in range(self.workers):
+                threading.Thread(target=self._worker, daemon=True).start()
+            threading.Thread(target=self._timer, daemon=True).start()
+            threading.Thread(target=self._heartbeat, daemon=True).start()
+            self._started = True
+
+    def _beat(self):
+        self._execute(
+            "INSERT OR REPLACE INTO delivery_owners (owner, heartbeat_at) VALUES (?, ?)",
+            (self.owner, time.time()),
+        )
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self._beat()
+                self._maybe_recover()
+            except Exception as e:
+                logger.warning("Delivery heartbeat failed: %s", e)
+
+    def _maybe_recover(self):
+        if time.monotonic() - self._last_recovery >= self.heartbeat_interval:
+            self._last_recovery = time.monotonic()
+            self._recover_orphans()
+
+    def _recover_orphans(self):
+        # Messages of a process that stopped heartbeating can't be resumed
+        # because their credentials died with it
+        cutoff = time.time() - 3 * self.heartbeat_interval
+        placeholders = ", ".join("?" for _ in PENDING_STATUSES)
+        with self._db_lock:
+            failed = self._conn.execute(
+                f"UPDATE delivery_messages SET status = ?, last_error = ?, updated_at = ? "
+                f"WHERE status IN ({placeholders}) AND owner != ? AND NOT EXISTS ("
+                "SELECT 1 FROM delivery_owners o WHERE o.owner = delivery_messages.owner AND o.heartbeat_at >= ?)",
+                (FAILED, "Delivery worker restarted before sending; please resubmit",
+                 time.time(), *PENDING_STATUSES, self.owner, cutoff),
+            ).rowcount
+            self._conn.execute("DELETE FROM delivery_owners WHERE heartbeat_at < ?", (cutoff,))
+        if failed:
+            logger.warning("Failed %d messages left pending by stopped delivery workers", failed)
+        return failed
+
+    # Public API
+
+    def submit(self, messages, password, send_at=None, spread=0.0):
+        # messages: list of payload dicts, each with recipient_email and email_host.
+        # send_at (epoch seconds) defers the job; spread staggers its messages
+        # evenly over that many seconds from then
+        self._ensure_started()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        owner = self.owner
+        start = max(now, send_at or now)
+        due = [start + spread * idx / len(messages) for idx in range(len(messages))]
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT INTO delivery_jobs (id, created_at, total) VALUES (?, ?, ?)",
+                    (job_id, now, len(messages)),
+                )
+                message_ids = []
+                for idx, payload in enumerate(messages):
+                    scheduled = due[idx] > now
+                    cursor = self._conn.execute(
+                        "INSERT INTO delivery_messages (job_id, idx, recipient_email, payload, status, "
+                        "next_attempt_at, owner, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, idx, payload['recipient_email'], json.dumps(payload),
+                         SCHEDULED if scheduled else QUEUED, due[idx] if scheduled else None, owner, now),
+                    )
+                    message_ids.append(cursor.lastrowid)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        if self.state is not None:
+            fields = {"job": json.dumps([now, len(messages)])}
+            for idx, payload in enumerate(messages):
+                scheduled = due[idx] > now
+                fields[idx] = json.dumps([idx, payload['recipient_email'], SCHEDULED if scheduled else QUEUED,
+                                          0, None, due[idx] if scheduled else None])
+            self._mirror(job_id, fields)
+
+        self._credentials[job_id] = password
+        for message_id, due_at in zip(message_ids, due):
+            if due_at > now:
+                self._schedule(message_id, due_at - now)
+            else:
+                self._ready.put(message_id)
+        return job_id
+
+    def job_status(self, job_id):
+        self._maybe_recover()
+        job = self._execute("SELECT created_at, total FROM delivery_jobs WHERE id = ?", (job_id,))
+        if job:
+            created_at, total = job[0]
+            rows = self._execute(
+                "SELECT idx, recipient_email, status, attempts, last_error, next_attempt_at "
+                "FROM delivery_messages WHERE job_id = ? ORDER BY idx",
+                (job_id,),
+            )
+        elif self.state is not None:
+            # Accepted by another node; its status is mirrored in shared state
+            fields = self.state.hgetall(self._status_key(job_id))
+            if "job" not in fields:
+                return None
+            created_at, total = json.loads(fields.pop("job"))
+            rows = sorted(json.loads(value) for value in fields.values())
+        else:
+            return None
+        counts = {status: 0 for status in (SCHEDULED, QUEUED, SENDING, RETRYING, SENT, FAILED)}
+        messages = []
+        for idx, recipient_email, status, attempts, last_error, next_attempt_at in rows:
+            counts[status] += 1
+            messages.append({
+                "index": idx,
+                "recipient_email": recipient_email,
+                "status": status,
+                "attempts": attempts,
+                "error": last_error,
+                "next_attempt_at": next_attempt_at if status in (SCHEDULED, RETRYING) else None,
+            })
+        if counts[SENT] + counts[FAILED] == total:
+            job_state = "completed"
+        elif counts[SCHEDULED] == total:
+            job_state = SCHEDULED
+        else:
+            job_state = "in_progress"
+        scheduled_at = [message["next_attempt_at"] for message in messages if message["status"] == SCHEDULED]
+        return {
+            "job_id": job_id,
+            "status": job_state,
+            "created_at": created_at,
+            "total": total,
+            "counts": counts,
+            "next_send_at": min(scheduled_at) if scheduled_at else None,
+            "messages": messages,
+        }
+
+    def stats(self):
+        with self._delayed_cond:
+            delayed = len(self._delayed)
+        return {
+            "started": self._started,
+            "ready": self._ready.qsize(),
+            "delayed": delayed,
+            "active_jobs": len(self._credentials),
+        }
+
+    # Workers
+
+    def _schedule(self, message_id, delay):
+        with self._delayed_cond:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, message_id))
+            self._delayed_cond.notify()
+
+    def _timer(self):
+        # Moves delayed messages onto the ready queue when they fall due
+        with self._delayed_cond:
+            while True:
+                if not self._delayed:
+                    self._delayed_cond.wait()
+                    continue
+                due, message_id = self._delayed[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._delayed_cond.wait(wait)
+                    continue
+                heapq.heappop(self._delayed)
+                self._ready.put(message_id)
+
+    def _worker(self):
+        while True:
+            message_id = self._ready.get()
+            try:
+                self._deliver(message_id)
+            except Exception as e:
+                self._update(message_id, status=FAILED, last_error=f"Internal error: {e}")
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _deliver(self, message_id):
+        rows = self._execute(
+            "SELECT job_id, payload, attempts, status FROM delivery_messages WHERE id = ?",
+            (message_id,),
+        )
+        if not rows:
+            return
+        job_id, payload, attempts, status = rows[0]
+        if status not in PENDING_STATUSES:
+            return
+        try:
+            self._attempt(message_id, job_id, payload, attempts)
+        except Exception as e:
+            # A bad payload or a database error; retrying would hit it again
+            self._update(message_id, status=FAILED, last_error=f"Internal error: {e}")
+        finally:
+            # Whichever way this message ended, it may have been the job's last
+            self._release_credentials(job_id)
+
+    def _attempt(self, message_id, job_id, payload, attempts):
+        password = self._credentials.get(job_id)
+        if password is None:
+            self._update(message_id, status=FAILED, last_error="Sender credentials are no longer available")
+            return
+
+        payload = json.loads(payload)
+        wait = self.limiter.reserve(payload['email_host'])
+        if wait > 0:
+            # Over the per-host rate; come back later without holding a worker
+            self._schedule(message_id, wait)
+            return
+
+        attempts += 1
+        self._update(message_id, status=SENDING, attempts=attempts)
+        permanent_errors, smtp_error = smtp_errors()
+        try:
+            self.send_fn(payload, password)
+        except permanent_errors as e:
+            self._update(message_id, status=FAILED, last_error=f"SMTP Error: {e}")
+        except (smtp_error, OSError) as e:
+            if attempts >= self.max_attempts:
+                self._update(message_id, status=FAILED, last_error=f"SMTP Error: {e}")
+            else:
+                delay = self._backoff(attempts)
+                self._update(message_id, status=RETRYING, last_error=f"SMTP Error: {e}",
+                             next_attempt_at=time.time() + delay)
+                self._schedule(message_id, delay)
+                return
+        except Exception as e:
+            self._update(message_id, status=FAILED, last_error=f"Failed to send email: {e}")
+        else:
+            self._update(message_id, status=SENT, last_error=None)
+
+    def _release_credentials(self, job_id):
+        # Forget the password as soon as the job has nothing left to send
+        placeholders = ", ".join("?" for _ in PENDING_STATUSES)
+        pending = self._execute(
+            f"SELECT COUNT(*) FROM delivery_messages WHERE job_id = ? AND status IN ({placeholders})",
+            (job_id, *PENDING_STATUSES),
+        )[0][0]
+        if not pending:
+            self._credentials.pop(job_id, None)
+            # Only the status is kept for /jobs; the bodies are no longer needed
+            self._execute("UPDATE delivery_messages SET payload = '{}' WHERE job_id = ?", (job_id,))
+        if time.monotonic() - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = time.monotonic()
+            self.purge_finished()
+
+    def purge_finished(self):
+        # Drop jobs with nothing pending and no change for status_ttl seconds,
+        # the same time their mirrored status lives in shared state
+        cutoff = time.time() - self.status_ttl
+        placeholders = ", ".join("?" for _ in PENDING_STATUSES)
+        finished = (
+            "SELECT id FROM delivery_jobs j WHERE j.created_at < ? AND NOT EXISTS ("
+            "SELECT 1 FROM delivery_messages m WHERE m.job_id = j.id "
+            f"AND (m.status IN ({placeholders}) OR m.updated_at >= ?))"
+        )
+        params = (cutoff, *PENDING_STATUSES, cutoff)
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(f"DELETE FROM delivery_messages WHERE job_id IN ({finished})", params)
+                deleted = self._conn.execute(f"DELETE FROM delivery_jobs WHERE id IN ({finished})", params).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+
+def queue_from_env(send_fn, shared_state=None):
+    return DeliveryQueue(
+        send_fn,
+        state=shared_state,
+        status_ttl=float(os.getenv('DELIVERY_STATUS_TTL', 7 * 86400)),
+        db_path=os.getenv('DELIVERY_DB_PATH', 'delivery.db'),
+        heartbeat_interval=float(os.getenv('DELIVERY_HEARTBEAT_INTERVAL', 10)),
+        workers=int(os.getenv('DELIVERY_WORKERS', 4)),
+        max_attempts=int(os.getenv('DELIVERY_MAX_ATTEMPTS', 5)),
+        base_delay=float(os.getenv('DELIVERY_RETRY_BASE_DELAY', 2)),
+        max_delay=float(os.getenv('DELIVERY_RETRY_MAX_DELAY', 300)),
+        host_rate=float(os.getenv('DELIVERY_HOST_RATE', 5)),
+    )
@@ -0,0 +1,171 @@
+# Structured emails: parsed once from generated text, rendered to HTML/plain text
+# and assembled into MIME messages
+#
+# Generated text is split into subject, greeting, body paragraphs and closing
+# in one pass over its lines. Rendering is a single join over those blocks,
+# so neither the send path nor the frontend has to re-parse HTML with regexes.
+import html
+import re
+from functools import cached_property
+
+DEFAULT_SUBJECT = "Generated Email"
+# Longer lines are body text even when they start like a sign-off
+MAX_CLOSING_LINE = 40
+
+# "Subject: ...", also with the markdown bold models like to add
+_SUBJECT = re.compile(r"^[*_]{0,2}subject\s*:\s*[*_]{0,2}\s*(.*?)\s*[*_]{0,2}$", re.IGNORECASE)
+_GREETING = re.compile(r"^(dear|hi|hello|hey|greetings|good (morning|afternoon|evening)|to whom)\b", re.IGNORECASE)
+_CLOSING = re.compile(
+    r"^(best|kind|warm|warmest)?\s*(regards|wishes)\b|^(best|sincerely|yours|cheers|thanks|thank you|"
+    r"respectfully|all the best|many thanks|with gratitude)\b[^.!?]*,?$",
+    re.IGNORECASE)
+# Line breaks and block ends become newlines, every other tag is dropped
+_MARKUP = re.compile(r"<(br)\b[^>\n]*>|</(p|div)\s*>|<[^>\n]*>", re.IGNORECASE)
+
+
+def _markup_to_text(match):
+    if match.group(1):
+        return "\n"
+    if match.group(2):
+        return "\n\n"
+    return ""
+
+
+class EmailDocument:
+    """An email as subject, greeting, body paragraphs and closing.
+
+    Every part but the paragraphs may be None. Documents are immutable and
+    hashable, so renderings and MIME parts can be cached per document.
+    """
+
+    def __init__(self, subject=None, greeting=None, paragraphs=(), closing=None):
+        self.subject = subject or None
+        self.greeting = greeting or None
+        self.paragraphs = tuple(paragraphs)
+        self.closing = closing or None
+
+    @classmethod
+    def parse(cls, text):
+        subject = greeting = closing = None
+        blocks = []
+        current = []
+        for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+            line = line.rstrip()
+            if not line.strip():
+                if current:
+                    blocks.append(current)
+                    current = []
+                continue
+            if subject is None and not blocks and not current:
+                match = _SUBJECT.match(line.strip())
+                if match:
+                    subject = match.group(1)
+                    continue
+            current.append(line)
+        if current:
+            blocks.append(current)
+
+        if blocks and _GREETING.match(blocks[0][0].strip()):
+            greeting = blocks[0][0].strip()
+            blocks[0] = blocks[0][1:]
+        if blocks:
+            # The sign-off may share its block with the last lines of the body
+            last = blocks[-1]
+            for i, line in enumerate(last):
+                line = line.strip()
+                if len(last) - i <= 4 and len(line) <= MAX_CLOSING_LINE and _CLOSING.match(line):
+                    closing = "\n".join(line.strip() for line in last[i:])
+                    blocks[-1] = last[:i]
+                    break
+        return cls(subject, greeting, ("\n".join(block) for block in blocks if block), closing)
+
+    @classmethod
+    def from_content(cls, content):
+        # Plain text, or the HTML the preview and older clients send
+        if "<" in content:
+            content = html.unescape(_MARKUP.sub(_markup_to_text, content))
+        return cls.parse(content)
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError("email_document must be an object")
+        paragraphs = data.get("paragraphs") or []
+        if not isinstance(paragraphs, list):
+            raise ValueError("email_document paragraphs must be a list")
+        parts = [data.get("subject"), data.get("greeting"), data.get("closing"), *paragraphs]
+        if not all(part is None or isinstance(part, str) for part in parts):
+            raise ValueError("email_document fields must be text")
+        return cls(data.get("subject"), data.get("greeting"), paragraphs, data.get("closing"))
+
+    def to_dict(self):
+        return {
+            "subject": self.subject,
+            "greeting": self.greeting,
+            "paragraphs": list(self.paragraphs),
+            "closing": self.closing,
+        }
+
+    def _key(self):
+        return (self.subject, self.greeting, self.paragraphs, self.closing)
+
+    def __eq__(self, other):
+        return isinstance(other, EmailDocument) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _blocks(self):
+        if self.greeting:
+            yield self.greeting
+        yield from self.paragraphs
+        if self.closing:
+            yield self.closing
+
+    def render_text(self, include_subject=False):
+        blocks = list(self._blocks())
+        if include_subject and self.subject:
+            blocks.insert(0, f"Subject: {self.subject}")
+        return "\n\n".join(blocks)
+
+    def render_html(self, include_subject=False):
+        parts = []
+        if include_subject and self.subject:
+            parts.append(f"<p><strong>Subject:</strong> {html.escape(self.subject, quote=False)}</p>")
+        for block in self._blocks():
+            parts.append(f"<p>{html.escape(block, quote=False).replace(chr(10), '<br>')}</p>")
+        return "".join(parts)
+
+    # Bodies as sent: the subject goes in the header, not the body
+    @cached_property
+    def text(self):
+        return self.render_text()
+
+    @cached_property
+    def html(self):
+        return self.render_html()
+
+
+class MessageBuilder:
+    """The plain text and HTML parts of one document, encoded once.
+
+    message() only adds the headers, so sending the same document to many
+    recipients shares the already encoded body parts.
+    """
+
+    def __init__(self, document):
+        # The email package loads with the first send, not with every import
+        # of this module (history and /generate only need EmailDocument)
+        from email.mime.text import MIMEText
+
+        self.subject = document.subject or DEFAULT_SUBJECT
+        self._parts = (MIMEText(document.text, 'plain'), MIMEText(document.html, 'html'))
+
+    def message(self, recipient_email, sender_name, sender_email):
+        from email.mime.multipart import MIMEMultipart
+
+        msg = MIMEMultipart('alternative', _subparts=self._parts)
+        msg['From'] = f"{sender_name} <{sender_email}>"
+        msg['To'] = recipient_email
+        msg['Subject'] = self.subject
+        return msg
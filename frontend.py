@@ -1,10 +1,19 @@
 import streamlit as st
 import requests
 import os
-import re
+import json
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from email_format import EmailDocument
+from textproc import is_valid_email, text_to_html
 
 # Get API URL from environment variable or use default
 API_URL = os.environ.get("API_URL", "https://email-generator-api.onrender.com")
+# Keep-alive connections to the API held per Streamlit process
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", 20))
+# Token for the API's /history; the History panel is hidden without it
+HISTORY_TOKEN = os.environ.get("HISTORY_TOKEN", "")
 
 # Page configuration
 st.set_page_config(
@@ -52,86 +61,81 @@ st.markdown("""
 st.title("✉️ AI Personalized Email Generator")
 st.markdown("Generate professional, personalized emails tailored to your specific needs.")
 
-# Check backend health
-@st.cache_data(ttl=60)
+@st.cache_resource
+def api_session():
+    # One pooled session shared by every user of this process, so calls reuse
+    # TCP/TLS connections; connection failures and 502-504 on GETs are retried
+    session = requests.Session()
+    retries = Retry(total=2, connect=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({"GET"}))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def document_views(document_fields):
+    # Preview HTML and editable text for one email, rendered once however often the page reruns
+    document = EmailDocument.from_dict(document_fields)
+    return document.render_html(include_subject=True), document.render_text(include_subject=True)
+
+# Check backend health, at most once a minute for every user of this process
+@st.cache_data(ttl=60, show_spinner=False)
 def check_backend_health():
     try:
-        response = requests.get(f"{API_URL}/health", timeout=5)
+        response = api_session().get(f"{API_URL}/health", timeout=5)
         return response.status_code == 200
     except:
         return False
 
-if not check_backend_health():
-    st.warning("⚠️ Backend API service is currently unavailable. Please try again later.")
+def stream_email(payload, placeholder):
+    # Render chunks from the streaming endpoint into the preview as they arrive
+    email_text = ""
+    with api_session().post(f"{API_URL}/generate/stream", json=payload, stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "chunk":
+                    email_text += data.get("text", "")
+                    placeholder.markdown(f"""
+                    <div class="email-container">
+                    {text_to_html(email_text)}
+                    </div>
+                    """, unsafe_allow_html=True)
+                elif event == "error":
+                    raise RuntimeError(data.get("error", "Unknown error"))
+    return email_text
 
-# Create two columns for input and output
-col1, col2 = st.columns([1, 1])
+def show_document(document):
+    # Render a new email once; reruns reuse the stored HTML instead of re-converting
+    st.session_state.email_document = document
+    st.session_state.generated_email = document_views(document.to_dict())[0]
+    st.session_state.edited_email = ""
+    st.session_state.raw_email_text = ""
 
-with col1:
-    st.subheader("Email Details")
-    
-    # Basic info
-    purpose = st.text_input("Purpose of Email", placeholder="Job application, meeting request, follow-up, etc.")
-    
-    # Recipient information
-    st.markdown("##### Recipient Information")
-    recipient = st.text_input("Recipient Name", placeholder="e.g., HR Manager, John Smith")
-    recipient_email = st.text_input("Recipient Email Address", placeholder="recipient@example.com")
-    
-    # Sender information
-    st.markdown("##### Your Information")
-    sender_name = st.text_input("Your Name", placeholder="Your full name")
-    sender_email = st.text_input("Your Email Address", placeholder="your@example.com")
-    
-    # Email service selection
-    st.markdown("##### Email Service")
-    email_service = st.selectbox(
-        "Email Service Provider",
-        ["Gmail", "Outlook/Hotmail", "Yahoo", "Other"]
-    )
+# Button callbacks run before the fragment redraws, so it needs no st.rerun()
+def add_key_point():
+    st.session_state.key_points.append("")
 
-    # Configure email settings based on selection
-    if email_service == "Gmail":
-        email_host = "smtp.gmail.com"
-        email_port = 587
-        st.markdown("⚠️ **Gmail Users**: You must use an App Password, not your regular password. [Learn how to create an App Password](https://support.google.com/accounts/answer/185833)")
-    elif email_service == "Outlook/Hotmail":
-        email_host = "smtp-mail.outlook.com"
-        email_port = 587
-    elif email_service == "Yahoo":
-        email_host = "smtp.mail.yahoo.com"
-        email_port = 587
-    else:
-        email_host = st.text_input("SMTP Server", "smtp.example.com")
-        email_port = st.number_input("SMTP Port", value=587)
-    
-    # Email service password (with warning)
-    st.markdown("##### Email Authentication")
-    sender_password = st.text_input("Your Email Password/App Password", 
-                                   type="password", 
-                                   help="For Gmail, use an App Password. Go to Google Account → Security → 2-Step Verification → App passwords")
-    
-    tone = st.selectbox(
-        "Email Tone",
-        ["Formal", "Friendly", "Persuasive", "Apologetic", "Thankful", "Urgent", "Professional"]
-    )
-    
-    # Context information
-    st.subheader("Context & Content")
-    prompt = st.text_area(
-        "Email Context",
-        placeholder="Describe the situation, background information, or any context needed for the email.",
-        height=150
-    )
-    
-    # Key points
-    st.subheader("Key Points (optional)")
-    st.markdown("Add important points to include in your email:")
-    
-    # Initialize session state for key points
-    if 'key_points' not in st.session_state:
-        st.session_state.key_points = [""]
-    
+def delete_key_point(i):
+    if len(st.session_state.key_points) > 1:
+        st.session_state.key_points.pop(i)
+
+def save_edit():
+    # Store the raw edited text, parse it once and render it for preview mode
+    st.session_state.raw_email_text = st.session_state.email_editor
+    st.session_state.email_document = EmailDocument.parse(st.session_state.email_editor)
+    st.session_state.edited_email = document_views(st.session_state.email_document.to_dict())[0]
+    st.session_state.display_mode = "preview"
+
+# Fragments (Streamlit 1.37+) rerun on their own when their widgets change
+@st.fragment
+def key_points_editor():
+    # Typing a point reruns only this editor, not the whole page
     # Display input fields for key points
     for i, point in enumerate(st.session_state.key_points):
         col_point, col_delete = st.columns([5, 1])
@@ -143,20 +147,13 @@ with col1:
                 label_visibility="collapsed"
             )
         with col_delete:
-            if st.button("🗑️", key=f"delete_{i}") and len(st.session_state.key_points) > 1:
-                st.session_state.key_points.pop(i)
-                st.rerun()
+            st.button("🗑️", key=f"delete_{i}", on_click=delete_key_point, args=(i,))
     
-    if st.button("➕ Add Point"):
-        st.session_state.key_points.append("")
-        st.rerun()
+    st.button("➕ Add Point", on_click=add_key_point)
 
-    # Generate button
-    generate_button = st.button("🚀 Generate Email", use_container_width=True)
-
-with col2:
-    st.subheader("Generated Email")
-    
+@st.fragment
+def email_pane(recipient_email, sender_name, sender_email, sender_password, email_host, email_port):
+    # Switching modes, editing and sending rerun only this pane
     # Initialize session state for raw email text
     if 'raw_email_text' not in st.session_state:
         st.session_state.raw_email_text = ""
@@ -185,6 +182,14 @@ with col2:
         if edit_button:
             st.session_state.display_mode = "edit"
     
+    # Switch between the candidates of a multi-variant generation
+    if len(st.session_state.get('email_variants', [])) > 1:
+        variant_labels = [f"Variant {i + 1}" for i in range(len(st.session_state.email_variants))]
+        chosen_label = st.radio("Variants", variant_labels, horizontal=True, key="variant_choice")
+        chosen_document = st.session_state.email_variants[variant_labels.index(chosen_label)]
+        if chosen_document != st.session_state.get('email_document'):
+            show_document(chosen_document)
+    
     # Display email container based on mode
     if st.session_state.display_mode == "preview":
         # Preview mode - show formatted email
@@ -206,34 +211,20 @@ with col2:
             """, unsafe_allow_html=True)
     else:
         # Edit mode - show editable text area
-        if not st.session_state.raw_email_text and 'generated_email' in st.session_state:
-            # Convert HTML-formatted email to plain text with line breaks for editing
-            raw_text = st.session_state.generated_email.replace("<br>", "\n")
-            raw_text = re.sub(r'<.*?>', '', raw_text)
-            st.session_state.raw_email_text = raw_text
+        if not st.session_state.raw_email_text and st.session_state.get('email_document'):
+            # Editable plain text comes straight from the structured email
+            st.session_state.raw_email_text = document_views(st.session_state.email_document.to_dict())[1]
         
-        edited_email = st.text_area(
+        st.text_area(
             "Edit your email",
             value=st.session_state.raw_email_text,
             height=400,
+            key="email_editor",
             label_visibility="collapsed"
         )
         
         # Save button for edits
-        if st.button("💾 Save Changes", use_container_width=True):
-            # Store the raw edited text
-            st.session_state.raw_email_text = edited_email
-            
-            # Convert back to HTML for display in preview mode
-            formatted_email = edited_email.replace("\n", "<br>")
-            
-            # Try to preserve subject line formatting
-            formatted_email = re.sub(r"Subject: (.*)", r"<strong>Subject:</strong> \1", formatted_email)
-            
-            st.session_state.edited_email = formatted_email
-            st.session_state.display_mode = "preview"
-            st.success("Changes saved successfully!")
-            st.rerun()
+        st.button("💾 Save Changes", use_container_width=True, on_click=save_edit)
     
     # Action buttons for generated email
     if ('generated_email' in st.session_state and st.session_state.generated_email) or st.session_state.edited_email:
@@ -245,7 +236,7 @@ with col2:
         with col_save:
             # Download the edited version if available, otherwise the generated version
             email_to_download = (st.session_state.raw_email_text if st.session_state.raw_email_text 
-                               else re.sub(r'<.*?>', '', st.session_state.generated_email.replace("<br>", "\n")))
+                               else document_views(st.session_state.email_document.to_dict())[1])
             
             st.download_button(
                 label="💾 Download as Text",
@@ -257,37 +248,49 @@ with col2:
             
         with col_send:
             send_button = st.button("📤 Send Email", key="send_button", type="primary")
+        
+        # The backend holds scheduled sends and delivers them when due
+        send_at = None
+        if st.checkbox("Schedule for later", key="schedule_send"):
+            default_time = datetime.now(timezone.utc) + timedelta(hours=1)
+            col_date, col_time = st.columns(2)
+            with col_date:
+                send_date = st.date_input("Send on (UTC)", value=default_time.date())
+            with col_time:
+                send_time = st.time_input("Send at (UTC)", value=default_time.time().replace(second=0, microsecond=0))
+            send_at = datetime.combine(send_date, send_time, tzinfo=timezone.utc).isoformat()
             
         # Send email function
         if send_button:
             # Validate required fields
-            if not recipient_email or not re.match(r"[^@]+@[^@]+\.[^@]+", recipient_email):
+            if not is_valid_email(recipient_email):
                 st.error("Please enter a valid recipient email address.")
-            elif not sender_email or not re.match(r"[^@]+@[^@]+\.[^@]+", sender_email):
+            elif not is_valid_email(sender_email):
                 st.error("Please enter a valid sender email address.")
             elif not sender_password:
                 st.error("Please enter your email password or app password.")
             else:
                 with st.spinner("Sending email..."):
                     try:
-                        # Use the edited version if available, otherwise use the generated version
-                        email_content = st.session_state.edited_email if st.session_state.edited_email else st.session_state.generated_email
-                        
-                        response = requests.post(
+                        # The structured email (edited or generated) needs no parsing on the server
+                        response = api_session().post(
                             f"{API_URL}/send-email",
                             json={
-                                "email_content": email_content,
+                                "email_document": st.session_state.email_document.to_dict(),
                                 "recipient_email": recipient_email,
                                 "sender_name": sender_name,
                                 "sender_email": sender_email,
                                 "sender_password": sender_password,
                                 "email_host": email_host,
-                                "email_port": email_port
+                                "email_port": email_port,
+                                "send_at": send_at
                             },
                             timeout=30
                         )
                         
-                        if response.status_code == 200 and response.json().get("success", False):
+                        if response.status_code == 202 and response.json().get("success", False):
+                            st.success(f"Email to {recipient_email} scheduled for {send_at.replace('T', ' ')}")
+                        elif response.status_code == 200 and response.json().get("success", False):
                             st.success(f"Email successfully sent to {recipient_email}!")
                         else:
                             st.error(f"Failed to send email: {response.json().get('error', 'Unknown error')}")
@@ -304,6 +307,100 @@ with col2:
         with feedback_cols[2]:
             st.button("🔄 Regenerate")
 
+# Filled in by the health check at the end of the script
+health_warning = st.empty()
+
+# Create two columns for input and output
+col1, col2 = st.columns([1, 1])
+
+with col1:
+    st.subheader("Email Details")
+    
+    # Basic info
+    purpose = st.text_input("Purpose of Email", placeholder="Job application, meeting request, follow-up, etc.")
+    
+    # Recipient information
+    st.markdown("##### Recipient Information")
+    recipient = st.text_input("Recipient Name", placeholder="e.g., HR Manager, John Smith")
+    recipient_email = st.text_input("Recipient Email Address", placeholder="recipient@example.com")
+    
+    # Sender information
+    st.markdown("##### Your Information")
+    sender_name = st.text_input("Your Name", placeholder="Your full name")
+    sender_email = st.text_input("Your Email Address", placeholder="your@example.com")
+    
+    # Email service selection
+    st.markdown("##### Email Service")
+    email_service = st.selectbox(
+        "Email Service Provider",
+        ["Gmail", "Outlook/Hotmail", "Yahoo", "Other"]
+    )
+
+    # Configure email settings based on selection
+    if email_service == "Gmail":
+        email_host = "smtp.gmail.com"
+        email_port = 587
+        st.markdown("⚠️ **Gmail Users**: You must use an App Password, not your regular password. [Learn how to create an App Password](https://support.google.com/accounts/answer/185833)")
+    elif email_service == "Outlook/Hotmail":
+        email_host = "smtp-mail.outlook.com"
+        email_port = 587
+    elif email_service == "Yahoo":
+        email_host = "smtp.mail.yahoo.com"
+        email_port = 587
+    else:
+        email_host = st.text_input("SMTP Server", "smtp.example.com")
+        email_port = st.number_input("SMTP Port", value=587)
+    
+    # Email service password (with warning)
+    st.markdown("##### Email Authentication")
+    sender_password = st.text_input("Your Email Password/App Password", 
+                                   type="password", 
+                                   help="For Gmail, use an App Password. Go to Google Account → Security → 2-Step Verification → App passwords")
+    
+    tone = st.selectbox(
+        "Email Tone",
+        ["Formal", "Friendly", "Persuasive", "Apologetic", "Thankful", "Urgent", "Professional"]
+    )
+    
+    # Context information
+    st.subheader("Context & Content")
+    prompt = st.text_area(
+        "Email Context",
+        placeholder="Describe the situation, background information, or any context needed for the email.",
+        height=150
+    )
+    
+    # Key points
+    st.subheader("Key Points (optional)")
+    st.markdown("Add important points to include in your email:")
+    
+    # Initialize session state for key points
+    if 'key_points' not in st.session_state:
+        st.session_state.key_points = [""]
+    
+    key_points_editor()
+    
+    # Stream the email into the preview pane while it is being written
+    stream_output = st.checkbox("Stream email as it is generated", value=True)
+
+    # Serve a close earlier email for the same recipient instead of generating a new one
+    reuse_previous = st.checkbox("Reuse a close match from history", value=False)
+
+    # Several candidates are generated in parallel in one request
+    n_variants = st.number_input("Number of variants", min_value=1, max_value=3, value=1,
+                                 help="Generate alternatives at once and pick one instead of regenerating")
+
+    # Generate button
+    generate_button = st.button("🚀 Generate Email", use_container_width=True)
+
+with col2:
+    st.subheader("Generated Email")
+    
+    # Placeholder that streamed chunks are rendered into during generation
+    stream_placeholder = st.empty()
+    
+    email_pane(recipient_email, sender_name, sender_email, sender_password, email_host, email_port)
+
 # Generate email when button is clicked
 if generate_button:
     # Validate inputs
@@ -313,36 +410,50 @@ if generate_button:
         # Filter out empty key points
         key_points = [point for point in st.session_state.key_points if point.strip()]
         
+        payload = {
+            "prompt": prompt,
+            "tone": tone,
+            "purpose": purpose,
+            "recipient": recipient,
+            "sender_name": sender_name,
+            "key_points": key_points,
+            "reuse_previous": reuse_previous
+        }
+        if n_variants > 1:
+            payload["n_variants"] = int(n_variants)
+        
         # Show loading spinner
         with st.spinner("Generating your email..."):
             try:
-                response = requests.post(
-                    f"{API_URL}/generate",
-                    json={
-                        "prompt": prompt,
-                        "tone": tone,
-                        "purpose": purpose,
-                        "recipient": recipient,
-                        "sender_name": sender_name,
-                        "key_points": key_points
-                    },
-                    timeout=30
-                )
+                # Reuse and variants are decided up front, which only the non-streaming endpoint does
+                documents = []
+                if stream_output and not reuse_previous and n_variants == 1:
+                    email_text = stream_email(payload, stream_placeholder)
+                    success, error = True, None
+                    documents = [EmailDocument.parse(email_text)]
+                else:
+                    response = api_session().post(
+                        f"{API_URL}/generate",
+                        json=payload,
+                        timeout=30
+                    )
+                    success = response.status_code == 200 and response.json().get("success", False)
+                    error = None if success else response.json().get('error', 'Unknown error')
+                    if success:
+                        # The backend already split each email into subject, greeting, body and closing
+                        results = response.json().get("variants") or [response.json()]
+                        documents = [
+                            EmailDocument.from_dict(result["document"]) if result.get("document")
+                            else EmailDocument.parse(result.get("email", ""))
+                            for result in results if result.get("success")
+                        ]
                 
-                if response.status_code == 200 and response.json().get("success", False):
-                    email_text = response.json().get("email", "")
-                    
-                    # Process the raw email text to make it more presentable
-                    # Enhance the formatting (bold subject, spacing, etc.)
-                    email_text = re.sub(r"Subject: (.*)", r"<strong>Subject:</strong> \1", email_text)
-                    email_text = email_text.replace("\n", "<br>")
-                    
-                    # Store the generated email
-                    st.session_state.generated_email = email_text
-                    
-                    # Clear any previous edits
-                    st.session_state.edited_email = ""
-                    st.session_state.raw_email_text = ""
+                if success:
+                    # Show the first email and keep any alternatives for the picker
+                    show_document(documents[0])
+                    st.session_state.email_variants = documents
+                    if 'variant_choice' in st.session_state:
+                        del st.session_state['variant_choice']
                     
                     # Set display mode to preview for the newly generated email
                     st.session_state.display_mode = "preview"
@@ -350,12 +461,33 @@ if generate_button:
                     st.success("Email generated successfully!")
                     st.rerun()
                 else:
-                    st.error(f"Failed to generate email: {response.json().get('error', 'Unknown error')}")
+                    st.error(f"Failed to generate email: {error}")
             except requests.exceptions.ConnectionError:
                 st.error("Cannot connect to the backend API. Please check your internet connection.")
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
 
+# Previously generated emails, searched on the server. The token opens every
+# user's history, so only set HISTORY_TOKEN for a private deployment
+if HISTORY_TOKEN:
+    with st.expander("📜 History"):
+        history_query = st.text_input("Search previous emails", placeholder="Words from the subject, body or context")
+        if st.button("Search History"):
+            try:
+                response = api_session().get(f"{API_URL}/history", params={"q": history_query, "limit": 10},
+                                             headers={"Authorization": f"Bearer {HISTORY_TOKEN}"}, timeout=10)
+                st.session_state.history_items = response.json().get("items", []) if response.status_code == 200 else []
+            except Exception as e:
+                st.error(f"Could not load history: {str(e)}")
+    
+        for item in st.session_state.get("history_items", []):
+            st.markdown(f"**{item.get('subject') or 'No subject'}** · {item.get('recipient') or 'No recipient'} · {item.get('purpose') or ''}")
+            if st.button("Use this email", key=f"history_{item['id']}"):
+                show_document(EmailDocument.parse(item["body"]))
+                st.session_state.email_variants = []
+                st.session_state.display_mode = "preview"
+                st.rerun()
+
 # Information about the service
 with st.expander("ℹ️ About this Email Generator"):
     st.markdown("""
@@ -380,3 +512,8 @@ with st.expander("ℹ️ About this Email Generator"):
     - AI: Google Gemini API (free tier)
     - Email: Uses your own email account's SMTP service
     """)
+
+# Checked last so the page renders without waiting on it; the request also
+# wakes a scaled-to-zero API while the user is still filling in the form
+if not check_backend_health():
+    health_warning.warning("⚠️ Backend API service is currently unavailable. Please try again later.")
@@ -0,0 +1,353 @@
+# Generation history in SQLite: audit trail, search and reuse of past emails
+#
+# Inserts are write-behind: record() only enqueues, and a background thread
+# writes batches in one transaction, so /generate never waits on the disk.
+# Subject, body and context are indexed with FTS5 when SQLite has it (plain
+# LIKE search otherwise).
+#
+# History holds every user's prompts, recipients and emails, so it is off
+# unless HISTORY_ENABLED is set, and /history also needs HISTORY_TOKEN. The
+# writer deletes rows older than `max_age` seconds or beyond the newest
+# `max_rows`.
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from email_format import EmailDocument
+from metrics import registry
+
+WRITES = registry.counter(
+    "email_api_history_writes_total", "History rows written or dropped by the write-behind queue",
+    ("outcome",))
+REUSED = registry.counter(
+    "email_api_history_reuse_total", "Reuse lookups by outcome", ("outcome",))
+PRUNED = registry.counter(
+    "email_api_history_pruned_total", "History rows deleted by the age and row limits")
+
+logger = logging.getLogger(__name__)
+
+_WORDS = re.compile(r"\w+")
+
+COLUMNS = ("created_at", "backend", "model", "template_id", "template_version", "tone", "purpose",
+           "recipient", "sender_name", "prompt", "key_points", "subject", "body", "cached")
+
+
+def _terms(text):
+    return set(_WORDS.findall(text.lower()))
+
+
+def similarity(a, b):
+    # Jaccard overlap of word sets, 1.0 for identical wording
+    a, b = _terms(a), _terms(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _request_text(prompt, key_points):
+    return " ".join([prompt, *key_points])
+
+
+class HistoryStore:
+    def __init__(self, db_path=':memory:', batch_size=100, flush_interval=1.0, max_pending=10000,
+                 reuse_threshold=0.85, reuse_candidates=20, max_rows=10000, max_age=30 * 86400):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.reuse_threshold = reuse_threshold
+        self.reuse_candidates = reuse_candidates
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.db_path = db_path
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS generations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                backend TEXT,
+                model TEXT,
+                template_id TEXT,
+                template_version TEXT,
+                tone TEXT,
+                purpose TEXT,
+                recipient TEXT,
+                sender_name TEXT,
+                prompt TEXT,
+                key_points TEXT,
+                subject TEXT,
+                body TEXT NOT NULL,
+                cached INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_generations_created ON generations (created_at);
+            CREATE INDEX IF NOT EXISTS idx_generations_sender ON generations (sender_name, created_at);
+            CREATE INDEX IF NOT EXISTS idx_generations_recipient ON generations (recipient, created_at);
+            CREATE INDEX IF NOT EXISTS idx_generations_purpose ON generations (purpose COLLATE NOCASE, created_at);
+            """
+        )
+        self.fts = self._create_fts()
+        self._started = False
+        self._start_lock = threading.Lock()
+        # Entries accepted by record() vs. entries the writer has finished with
+        self._progress = threading.Condition()
+        self._accepted = 0
+        self._processed = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        if self.db_path != ':memory:':
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def after_fork(self):
+        # In a worker forked from a preloading master: the writer thread did
+        # not come along, and a database file gets a connection of its own
+        self._lock = threading.Lock()
+        if self.db_path != ':memory:':
+            self._conn = self._connect()
+        self._pending = queue.Queue(maxsize=self._pending.maxsize)
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._progress = threading.Condition()
+        self._accepted = 0
+        self._processed = 0
+
+    def _create_fts(self):
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5("
+                "subject, body, prompt, content='generations', content_rowid='id')"
+            )
+            return True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5
+            return False
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # Writes
+
+    def record(self, entry):
+        # entry: dict with the COLUMNS fields (created_at and subject are filled in)
+        self._ensure_started()
+        with self._progress:
+            try:
+                self._pending.put_nowait(entry)
+                self._accepted += 1
+            except queue.Full:
+                # History must never slow generation down; drop rather than block
+                WRITES.inc(outcome="dropped")
+
+    def _ensure_started(self):
+        # The writer starts lazily so the store is safe to create before a fork
+        with self._start_lock:
+            if not self._started:
+                threading.Thread(target=self._writer, daemon=True).start()
+                self._started = True
+
+    def _writer(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                WRITES.inc(len(batch), outcome="written")
+            except Exception:
+                WRITES.inc(len(batch), outcome="failed")
+            try:
+                self.prune()
+            except Exception:
+                logger.exception("Could not prune generation history")
+            with self._progress:
+                self._processed += len(batch)
+                self._progress.notify_all()
+
+    def _write(self, batch):
+        rows = []
+        for entry in batch:
+            entry = dict(entry)
+            entry.setdefault("created_at", time.time())
+            if not entry.get("subject"):
+                entry["subject"] = EmailDocument.parse(entry["body"]).subject
+            entry["key_points"] = json.dumps(entry.get("key_points") or [])
+            entry["cached"] = int(bool(entry.get("cached")))
+            rows.append(tuple(entry.get(column) for column in COLUMNS))
+
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    cursor = self._conn.execute(
+                        f"INSERT INTO generations ({', '.join(COLUMNS)}) VALUES ({placeholders})", row)
+                    if self.fts:
+                        record = dict(zip(COLUMNS, row))
+                        self._conn.execute(
+                            "INSERT INTO generations_fts (rowid, subject, body, prompt) VALUES (?, ?, ?, ?)",
+                            (cursor.lastrowid, record["subject"], record["body"], record["prompt"]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def prune(self):
+        # Drop rows past the age or row limit; returns how many went. Both
+        # conditions are index lookups (created_at, and id since ids only grow)
+        clauses = []
+        params = []
+        if self.max_age:
+            clauses.append("created_at < ?")
+            params.append(time.time() - self.max_age)
+        if self.max_rows:
+            clauses.append("id <= (SELECT MAX(id) FROM generations) - ?")
+            params.append(self.max_rows)
+        if not clauses:
+            return 0
+        where = " OR ".join(clauses)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if self.fts:
+                    # External-content FTS rows are removed with the values they indexed
+                    self._conn.execute(
+                        "INSERT INTO generations_fts (generations_fts, rowid, subject, body, prompt) "
+                        f"SELECT 'delete', id, subject, body, prompt FROM generations WHERE {where}", params)
+                deleted = self._conn.execute(f"DELETE FROM generations WHERE {where}", params).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if deleted:
+            PRUNED.inc(deleted)
+        return deleted
+
+    def flush(self, timeout=5.0):
+        # Wait until everything recorded so far has been written, e.g. at exit
+        with self._progress:
+            target = self._accepted
+            return self._progress.wait_for(lambda: self._processed >= target, timeout)
+
+    # Reads
+
+    @staticmethod
+    def _match_query(text):
+        # Quote every term so user input can't inject FTS5 syntax
+        return " ".join('"' + term.replace('"', '""') + '"' for term in _WORDS.findall(text))
+
+    def search(self, q=None, sender_name=None, recipient=None, purpose=None, since=None, until=None,
+               limit=20, before_id=None):
+        # Newest first, paginated by id: pass the returned next_cursor as before_id
+        clauses = []
+        params = []
+        if q and self._match_query(q):
+            if self.fts:
+                clauses.append("g.id IN (SELECT rowid FROM generations_fts WHERE generations_fts MATCH ?)")
+                params.append(self._match_query(q))
+            else:
+                clauses.append("(g.subject LIKE ? OR g.body LIKE ? OR g.prompt LIKE ?)")
+                params.extend([f"%{q}%"] * 3)
+        for column, value in (("sender_name", sender_name), ("recipient", recipient)):
+            if value:
+                clauses.append(f"g.{column} = ?")
+                params.append(value)
+        if purpose:
+            clauses.append("g.purpose = ? COLLATE NOCASE")
+            params.append(purpose)
+        if since is not None:
+            clauses.append("g.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("g.created_at < ?")
+            params.append(until)
+        if before_id is not None:
+            clauses.append("g.id < ?")
+            params.append(before_id)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._execute(
+            f"SELECT g.id, {', '.join('g.' + column for column in COLUMNS)} FROM generations g "
+            f"{where} ORDER BY g.id DESC LIMIT ?",
+            (*params, limit + 1),
+        )
+        items = [self._row(row) for row in rows[:limit]]
+        return {
+            "items": items,
+            "next_cursor": items[-1]["id"] if len(rows) > limit else None,
+        }
+
+    @staticmethod
+    def _row(row):
+        item = dict(zip(("id", *COLUMNS), row))
+        item["key_points"] = json.loads(item["key_points"] or "[]")
+        item["cached"] = bool(item["cached"])
+        return item
+
+    def nearest(self, tone, purpose, recipient, sender_name, prompt, key_points):
+        # Closest earlier email for the same tone/purpose/recipient/sender,
+        # as (item, similarity), or (None, best similarity seen)
+        params = [tone, purpose, recipient, sender_name]
+        sql = (f"SELECT g.id, {', '.join('g.' + column for column in COLUMNS)} FROM generations g "
+               "WHERE g.tone = ? AND g.purpose = ? COLLATE NOCASE AND g.recipient = ? AND g.sender_name = ?")
+        match = self._match_query(prompt).replace('" "', '" OR "')
+        if self.fts and match:
+            # Let the full-text index shortlist candidates that share words with the context
+            sql += " AND g.id IN (SELECT rowid FROM generations_fts WHERE generations_fts MATCH ? ORDER BY rank LIMIT ?)"
+            params.extend([f"prompt : ({match})", self.reuse_candidates * 10])
+        sql += " ORDER BY g.id DESC LIMIT ?"
+        params.append(self.reuse_candidates)
+
+        wanted = _request_text(prompt, key_points)
+        best, best_score = None, 0.0
+        for row in self._execute(sql, params):
+            item = self._row(row)
+            score = similarity(wanted, _request_text(item["prompt"] or "", item["key_points"]))
+            if score > best_score:
+                best, best_score = item, score
+        if best is not None and best_score >= self.reuse_threshold:
+            REUSED.inc(outcome="hit")
+            return best, round(best_score, 4)
+        REUSED.inc(outcome="miss")
+        return None, round(best_score, 4)
+
+    def stats(self):
+        return {
+            # MAX(id) is an index lookup; COUNT(*) would scan the table
+            "latest_id": self._execute("SELECT MAX(id) FROM generations")[0][0],
+            "pending": self._pending.qsize(),
+            "full_text_search": self.fts,
+        }
+
+
+def history_from_env():
+    # None disables history (and with it /history and reuse); off by default
+    if os.getenv('HISTORY_ENABLED', '0').lower() not in ('1', 'true', 'yes'):
+        return None
+    store = HistoryStore(
+        db_path=os.getenv('HISTORY_DB_PATH', ':memory:'),
+        batch_size=int(os.getenv('HISTORY_BATCH_SIZE', 100)),
+        flush_interval=float(os.getenv('HISTORY_FLUSH_INTERVAL', 1)),
+        max_pending=int(os.getenv('HISTORY_MAX_PENDING', 10000)),
+        reuse_threshold=float(os.getenv('HISTORY_REUSE_THRESHOLD', 0.85)),
+        max_rows=int(os.getenv('HISTORY_MAX_ROWS', 10000)),
+        max_age=float(os.getenv('HISTORY_MAX_AGE', 30 * 86400)),
+    )
+    # Don't lose the last write-behind batch on a clean shutdown
+    atexit.register(store.flush)
+    return store
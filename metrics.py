@@ -0,0 +1,199 @@
+# In-process counters and histograms rendered in the Prometheus text format
+#
+# Values are per process: with several gunicorn workers each one reports its
+# own series, so scrape every worker or aggregate downstream.
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, ("le", repr(float(bound))))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from `callback`, which returns a number or {labels tuple: number}."""
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {item}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering returns the existing metric so modules can be reloaded
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        with self._lock:
+            # Gauges are replaced so the callback always points at live objects
+            gauge = self._metrics[name] = Gauge(name, documentation, callback, labelnames)
+        return gauge
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "email_api_requests_total", "HTTP requests handled", ("method", "endpoint", "status"))
+REQUEST_SECONDS = registry.histogram(
+    "email_api_request_duration_seconds", "Time to produce the response (first byte for streams)",
+    ("endpoint",))
+ERRORS = registry.counter(
+    "email_api_errors_total", "Failures by endpoint and exception type", ("endpoint", "exception"))
+PHASE_SECONDS = registry.histogram(
+    "email_api_phase_duration_seconds", "Time spent in each stage of the hot paths", ("phase",))
+LLM_TOKENS = registry.counter(
+    "email_api_llm_tokens_total", "Tokens reported by the generation backend", ("backend", "direction"))
+
+# Phase timings of the request currently being handled, for the slow-request log
+_request_phases = contextvars.ContextVar("request_phases", default=None)
+
+
+def start_request_trace():
+    phases = []
+    _request_phases.set(phases)
+    return phases
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_SECONDS.observe(elapsed, phase=phase)
+        phases = _request_phases.get()
+        if phases is not None:
+            phases.append((phase, elapsed))
+
+
+def timed_function(phase):
+    # Decorator form of timed()
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_error(endpoint, error):
+    ERRORS.inc(endpoint=endpoint, exception=type(error).__name__)
+
+
+def record_tokens(backend_name, result):
+    if result.input_tokens:
+        LLM_TOKENS.inc(result.input_tokens, backend=backend_name, direction="input")
+    if result.output_tokens:
+        LLM_TOKENS.inc(result.output_tokens, backend=backend_name, direction="output")
+
@@ -0,0 +1,34 @@
+# Reuse configured model objects instead of building one per request
+import json
+import threading
+
+
+class ModelRegistry:
+    """Caches factory(name, generation_config) per (name, generation_config)."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, generation_config):
+        config = json.dumps(generation_config, sort_keys=True) if generation_config else ""
+        return name, config
+
+    def get(self, name, generation_config=None):
+        key = self._key(name, generation_config)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self._models[key] = self.factory(name, generation_config)
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def __len__(self):
+        return len(self._models)
@@ -0,0 +1,150 @@
+# Prompt templates for /generate, loaded and compiled once at startup
+#
+# Templates are <name>.txt files in PROMPT_TEMPLATE_DIR (default: prompts/)
+# using $variables. A request uses the most specific one that exists:
+#
+#   <tone>.<purpose>.txt, <tone>.txt, default.txt
+#
+# with names lowercased and anything but letters and digits turned into "-"
+# (e.g. friendly.follow-up.txt). The instructions that never change come
+# first so upstream prefix/context caching can reuse them across requests.
+#
+# A/B tests: <name>@<variant>.txt is a variant of <name>.txt and
+# PROMPT_AB_SPLIT="default@short=0.2,..." routes that share of its traffic
+# to the variant, bucketed on the request's "ab_key" (or its prompt) so the
+# same caller keeps seeing the same variant.
+import hashlib
+import os
+import re
+import zlib
+from string import Template
+
+from metrics import registry
+
+VARIABLES = {"prompt", "tone", "purpose", "recipient", "sender_name", "key_points"}
+
+RENDERS = registry.counter(
+    "email_api_prompt_renders_total", "Prompts rendered per template version", ("template", "version"))
+
+_SLUG = re.compile(r"[^a-z0-9]+")
+
+
+class PromptTemplateError(ValueError):
+    pass
+
+
+def slugify(text):
+    return _SLUG.sub("-", str(text).lower()).strip("-")
+
+
+class PromptTemplate:
+    def __init__(self, template_id, source):
+        self.id = template_id
+        # Content hash, so any edit to the file yields a new version
+        self.version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+        self._parts, self.variables = self._compile(source)
+        unknown = self.variables - VARIABLES
+        if unknown:
+            raise PromptTemplateError(f"Template {template_id} uses unknown variables: {', '.join(sorted(unknown))}")
+
+    @property
+    def key(self):
+        return f"{self.id}:{self.version}"
+
+    def _compile(self, source):
+        # Split once into (literal, variable) pairs; rendering is then a join
+        parts = []
+        variables = set()
+        literal = ""
+        position = 0
+        for match in Template.pattern.finditer(source):
+            literal += source[position:match.start()]
+            position = match.end()
+            if match.group("escaped") is not None:
+                literal += "$"
+                continue
+            name = match.group("named") or match.group("braced")
+            if name is None:
+                raise PromptTemplateError(f"Template {self.id} has a stray '$' at offset {match.start()}")
+            parts.append((literal, name))
+            variables.add(name)
+            literal = ""
+        parts.append((literal + source[position:], None))
+        return parts, variables
+
+    def render(self, values):
+        missing = [name for name in self.variables if not isinstance(values.get(name), str)]
+        if missing:
+            raise PromptTemplateError(f"Missing or non-text prompt variables: {', '.join(sorted(missing))}")
+        return "".join(literal + values[name] if name else literal for literal, name in self._parts)
+
+
+class RenderedPrompt:
+    def __init__(self, text, template, input_tokens=None, trimmed=(), values=None):
+        self.text = text
+        self.template = template
+        # Estimated from the text; see tokens.py
+        self.input_tokens = input_tokens
+        self.trimmed = list(trimmed)
+        # The request's variables before compaction, and their embedding once computed
+        self.values = values or {}
+        self.embedding = None
+        # Alternatives of the same prompt (n_variants) are cached separately
+        self.variant = 0
+
+
+class PromptLibrary:
+    def __init__(self, templates, ab_split=None):
+        self.templates = {template.id: template for template in templates}
+        if "default" not in self.templates:
+            raise PromptTemplateError("A default prompt template is required")
+        # base id -> [(variant template, traffic share)]
+        self._variants = {}
+        for variant_id, share in (ab_split or {}).items():
+            if variant_id not in self.templates or "@" not in variant_id:
+                raise PromptTemplateError(f"Unknown A/B variant template: {variant_id}")
+            self._variants.setdefault(variant_id.split("@", 1)[0], []).append((self.templates[variant_id], share))
+
+    @classmethod
+    def load(cls, directory, ab_split=None):
+        templates = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".txt"):
+                with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                    templates.append(PromptTemplate(filename[:-len(".txt")], f.read()))
+        return cls(templates, ab_split)
+
+    def get(self, template_id):
+        return self.templates.get(template_id)
+
+    def select(self, tone, purpose, bucket_key=""):
+        tone, purpose = slugify(tone), slugify(purpose)
+        for candidate in (f"{tone}.{purpose}", tone, "default"):
+            template = self.templates.get(candidate)
+            if template is not None:
+                break
+        variants = self._variants.get(template.id)
+        if variants:
+            point = zlib.crc32(bucket_key.encode("utf-8")) % 10000 / 10000
+            for variant, share in variants:
+                if point < share:
+                    return variant
+                point -= share
+        return template
+
+    def versions(self):
+        return {template_id: template.version for template_id, template in sorted(self.templates.items())}
+
+
+def parse_ab_split(text):
+    split = {}
+    for part in text.split(","):
+        if part.strip():
+            template_id, _, share = part.partition("=")
+            split[template_id.strip()] = float(share)
+    return split
+
+
+def library_from_env():
+    directory = os.getenv('PROMPT_TEMPLATE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+    return PromptLibrary.load(directory, parse_ab_split(os.getenv('PROMPT_AB_SPLIT', '')))
@@ -0,0 +1,139 @@
+# Rate limiting primitives shared by the send and generate paths
+import threading
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    # take()/refund() stay in process; see SharedTokenBucket
+    shared = False
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        # Take tokens if available and return 0, otherwise return the seconds to wait
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def take(self, tokens=1):
+        # Always debit (the balance may go negative) and return the seconds until
+        # this reservation is covered, so concurrent callers queue up fairly
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, tokens=1):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def acquire(self, tokens=1, timeout=None):
+        # Block until tokens are available; False if that would exceed timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.reserve(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class KeyedRateLimiter:
+    """One TokenBucket per key (e.g. per SMTP host), created on first use.
+
+    With shared `state` the buckets are SharedTokenBucket under `prefix`.
+    """
+
+    def __init__(self, rate, capacity=None, state=None, prefix=""):
+        self.rate = rate
+        self.capacity = capacity
+        self.state = state
+        self.prefix = prefix
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if self.state is not None:
+                    bucket = SharedTokenBucket(self.state, self.prefix + key, self.rate, self.capacity)
+                else:
+                    bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+            return bucket
+
+    def reserve(self, key, tokens=1):
+        return self.bucket(key).reserve(tokens)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """TokenBucket whose rate backs off when upstream throttles us (AIMD).
+
+    Each throttle multiplies the rate by `decrease`; each success adds back
+    `increase` tokens/second until `max_rate` is reached again.
+    """
+
+    def __init__(self, max_rate, capacity=None, min_rate=None, decrease=0.5, increase=None):
+        super().__init__(max_rate, capacity)
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate if min_rate is not None else max_rate / 20)
+        self.decrease = decrease
+        self.increase = float(increase if increase is not None else max_rate / 20)
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drop banked burst so the lower rate takes effect immediately
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class SharedTokenBucket(AdaptiveTokenBucket):
+    """Token bucket whose reservations live in shared state (see shared_state.py).
+
+    Every worker and node using the same `key` draws from one budget. The
+    AIMD rate adjustments stay per process and only change how much of the
+    shared budget each reservation costs here.
+    """
+
+    # take()/refund() are round trips to the shared state
+    shared = True
+
+    def __init__(self, state, key, max_rate, capacity=None, **kwargs):
+        super().__init__(max_rate, capacity, **kwargs)
+        self.state = state
+        self.key = key
+
+    def take(self, tokens=1):
+        return self.state.take(self.key, tokens / self.rate, self.capacity / self.rate)
+
+    def refund(self, tokens=1):
+        self.state.refund(self.key, tokens / self.rate)
+
+    def reserve(self, tokens=1):
+        wait = self.take(tokens)
+        if wait > 0:
+            self.refund(tokens)
+        return wait
@@ -0,0 +1,347 @@
+# Protect the generation backend: admission control, rate limiting, retries
+# and a circuit breaker, so upstream incidents fail fast instead of piling up
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from backends import is_retryable, is_throttle
+from metrics import registry
+from ratelimit import AdaptiveTokenBucket, SharedTokenBucket
+
+RETRIES = registry.counter(
+    "email_api_llm_retries_total", "Backend calls retried after a transient error", ("backend",))
+SHED = registry.counter(
+    "email_api_llm_shed_total", "Backend calls refused without reaching upstream", ("backend", "reason"))
+
+
+class UpstreamUnavailable(Exception):
+    """The call was not attempted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class OverloadedError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive upstream failures.
+
+    While open every call fails fast; after `reset_timeout` one trial call is
+    let through (half-open) and its outcome closes or re-opens the circuit.
+    A trial that ends without an outcome (shed, cancelled, a stream closed by
+    the client) must be handed back with abandon_trial().
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # Token of the half-open trial call in flight, None while there is none
+        self._trial = None
+        self._lock = threading.Lock()
+
+    def is_failing_fast(self):
+        # Whether allow() would refuse right now, without claiming the trial
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self._trial is not None
+
+    def allow(self):
+        # Falsy to refuse; when the call is the half-open trial, its token
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial = None
+            if self.state == self.HALF_OPEN and self._trial is None:
+                self._trial = object()
+                return self._trial
+            return False
+
+    def abandon_trial(self, token):
+        # Let the next call be the trial; a no-op unless `token` is still in flight
+        with self._lock:
+            if token is not None and self._trial is token:
+                self._trial = None
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return 1
+            return max(1, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial = None
+
+
+class AdmissionQueue:
+    """Caps concurrent upstream calls; callers wait at most `max_wait` for a slot."""
+
+    def __init__(self, max_concurrent, max_wait):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._async_semaphores = {}
+
+    def acquire(self):
+        if self._semaphore is not None and not self._semaphore.acquire(timeout=self.max_wait):
+            raise OverloadedError("Too many generations in progress, please retry shortly")
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def _async_semaphore(self):
+        # asyncio primitives belong to one loop; keep one per running loop
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.max_concurrent)
+        return semaphore
+
+    async def acquire_async(self):
+        # Returns the semaphore to release, or None when concurrency is unlimited
+        if not self.max_concurrent:
+            return None
+        semaphore = self._async_semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            raise OverloadedError("Too many generations in progress, please retry shortly")
+        return semaphore
+
+
+class UpstreamGuard:
+    def __init__(self, name, limiter=None, breaker=None, admission=None, max_retries=2,
+                 base_delay=0.5, max_delay=8.0, max_wait=5.0):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.admission = admission or AdmissionQueue(0, max_wait)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+
+    def _circuit_open(self):
+        SHED.inc(backend=self.name, reason="circuit_open")
+        return CircuitOpenError("The generation service is temporarily unavailable",
+                                retry_after=self.breaker.retry_after())
+
+    def _check_breaker(self):
+        # Fail fast before queueing for a slot; the half-open trial is only
+        # claimed by _claim_breaker() once the call is about to go upstream
+        if self.breaker.is_failing_fast():
+            raise self._circuit_open()
+
+    def _claim_breaker(self):
+        # Returns what the breaker allowed (a trial token while half-open),
+        # to be passed to abandon_trial() when the call ends without an outcome
+        allowed = self.breaker.allow()
+        if not allowed:
+            if self.limiter is not None:
+                self.limiter.refund()
+            raise self._circuit_open()
+        return allowed
+
+    async def _claim_breaker_async(self):
+        allowed = self.breaker.allow()
+        if not allowed:
+            if self.limiter is not None:
+                await self._limiter_call(self.limiter.refund)
+            raise self._circuit_open()
+        return allowed
+
+    async def _limiter_call(self, fn):
+        # A shared bucket would block the event loop on Redis or SQLite
+        if self.limiter is not None and self.limiter.shared:
+            return await asyncio.to_thread(fn)
+        return fn()
+
+    def _admit(self):
+        try:
+            self.admission.acquire()
+        except OverloadedError:
+            SHED.inc(backend=self.name, reason="overloaded")
+            raise
+
+    async def _admit_async(self):
+        try:
+            return await self.admission.acquire_async()
+        except OverloadedError:
+            SHED.inc(backend=self.name, reason="overloaded")
+            raise
+
+    def _rate_wait(self):
+        # Seconds to wait for our rate-limit token, or shed if that exceeds max_wait
+        if self.limiter is None:
+            return 0.0
+        wait = self.limiter.take()
+        if wait > self.max_wait:
+            # Give the reservation back; we are not going to use it
+            self.limiter.refund()
+            SHED.inc(backend=self.name, reason="rate_limited")
+            raise OverloadedError("Generation rate limit reached, please retry shortly",
+                                  retry_after=int(wait) + 1)
+        return wait
+
+    def _backoff(self, attempt):
+        # Full jitter keeps retries from many workers from synchronising
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _on_error(self, error, attempt):
+        # Returns the delay before retrying, or re-raises when we should stop
+        if is_throttle(error) and self.limiter is not None:
+            self.limiter.on_throttle()
+        if not is_retryable(error):
+            # Upstream answered, it just didn't like the request
+            self.breaker.record_success()
+            raise error
+        self.breaker.record_failure()
+        if attempt >= self.max_retries or self.breaker.is_failing_fast():
+            raise error
+        RETRIES.inc(backend=self.name)
+        return self._backoff(attempt)
+
+    def _on_success(self):
+        self.breaker.record_success()
+        if self.limiter is not None:
+            self.limiter.on_success()
+
+    def call(self, fn):
+        self._check_breaker()
+        self._admit()
+        trial = None
+        try:
+            attempt = 0
+            while True:
+                wait = self._rate_wait()
+                trial = self._claim_breaker()
+                if wait:
+                    time.sleep(wait)
+                try:
+                    result = fn()
+                except Exception as e:
+                    time.sleep(self._on_error(e, attempt))
+                    attempt += 1
+                    continue
+                self._on_success()
+                return result
+        finally:
+            self.breaker.abandon_trial(trial)
+            self.admission.release()
+
+    async def call_async(self, fn):
+        self._check_breaker()
+        semaphore = await self._admit_async()
+        trial = None
+        try:
+            attempt = 0
+            while True:
+                wait = await self._limiter_call(self._rate_wait)
+                trial = await self._claim_breaker_async()
+                if wait:
+                    await asyncio.sleep(wait)
+                try:
+                    result = await fn()
+                except Exception as e:
+                    await asyncio.sleep(self._on_error(e, attempt))
+                    attempt += 1
+                    continue
+                self._on_success()
+                return result
+        finally:
+            self.breaker.abandon_trial(trial)
+            if semaphore is not None:
+                semaphore.release()
+
+    def stats(self):
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "rate_limit": round(self.limiter.rate, 3) if self.limiter is not None else None,
+        }
+
+    @contextmanager
+    def streaming(self):
+        # Streams can't be retried once chunks have gone out; guard the attempt only
+        self._check_breaker()
+        self._admit()
+        trial = None
+        try:
+            wait = self._rate_wait()
+            trial = self._claim_breaker()
+            if wait:
+                time.sleep(wait)
+            try:
+                yield
+            except Exception as e:
+                if is_throttle(e) and self.limiter is not None:
+                    self.limiter.on_throttle()
+                if is_retryable(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise
+            self._on_success()
+        finally:
+            # Also reached on GeneratorExit when the client closes the stream
+            self.breaker.abandon_trial(trial)
+            self.admission.release()
+
+
+def guard_from_env(name, state=None):
+    # With shared state, LLM_RATE_LIMIT is one budget for all workers and nodes
+    rate = float(os.getenv('LLM_RATE_LIMIT', 0))
+    burst = float(os.getenv('LLM_RATE_BURST', 0)) or None
+    max_wait = float(os.getenv('LLM_ADMISSION_TIMEOUT', 5))
+    if not rate:
+        limiter = None
+    elif state is not None:
+        limiter = SharedTokenBucket(state, f"ratelimit:llm:{name}", rate, burst)
+    else:
+        limiter = AdaptiveTokenBucket(rate, burst)
+    return UpstreamGuard(
+        name,
+        limiter=limiter,
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5)),
+            reset_timeout=float(os.getenv('BREAKER_RESET_TIMEOUT', 30)),
+        ),
+        admission=AdmissionQueue(int(os.getenv('LLM_MAX_CONCURRENT', 0)), max_wait),
+        max_retries=int(os.getenv('LLM_MAX_RETRIES', 2)),
+        base_delay=float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5)),
+        max_delay=float(os.getenv('LLM_RETRY_MAX_DELAY', 8)),
+        max_wait=max_wait,
+    )
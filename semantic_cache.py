@@ -0,0 +1,164 @@
+# Near-duplicate response cache: requests worded slightly differently share an email
+#
+# Requests are embedded as hashed character n-gram and word vectors (no model
+# download, CPU only) into a preallocated NumPy matrix. Only entries in the
+# same scope (model, template, tone, recipient, sender) can match, so a
+# near-duplicate never changes who the email is addressed to; a lookup is
+# one matrix-vector product over that scope's rows. NumPy is optional:
+# without it the semantic cache is simply unavailable. It is only imported
+# once a cache is created, so a disabled cache costs nothing at startup.
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+np = None
+
+logger = logging.getLogger(__name__)
+
+_WORDS = re.compile(r"\w+")
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+
+        np = numpy
+    return np
+
+
+class HashingEmbedder:
+    def __init__(self, dim=512, ngram=3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def embed(self, text):
+        words = _WORDS.findall(text.lower())
+        joined = " " + " ".join(words) + " "
+        features = [joined[i:i + self.ngram] for i in range(len(joined) - self.ngram + 1)]
+        features.extend("w:" + word for word in words)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not features:
+            return vector
+        hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features),
+                             dtype=np.uint32, count=len(features))
+        # The top bit picks a sign so collisions tend to cancel instead of pile up
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vector += np.bincount(hashes % self.dim, weights=signs, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Fixed-size matrix of unit vectors searched by cosine similarity.
+
+    When full, an expired entry is replaced first, otherwise the least
+    recently used one.
+    """
+
+    def __init__(self, max_entries=5000, threshold=0.92, ttl=3600, dim=512):
+        _import_numpy()
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.embedder = HashingEmbedder(dim)
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._scopes = np.zeros(max_entries, dtype=np.int64)
+        # scope id -> slots holding its entries
+        self._slots = {}
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._values = [None] * max_entries
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def scope_id(scope):
+        return zlib.crc32(scope.encode("utf-8"))
+
+    def embed(self, text):
+        return self.embedder.embed(text)
+
+    def get(self, scope, vector):
+        # Returns (value, similarity); value is None below the threshold
+        scope_id = self.scope_id(scope)
+        now = time.time()
+        with self._lock:
+            slots = self._slots.get(scope_id)
+            if slots:
+                if len(slots) * 4 > self._size:
+                    # A big scope: scanning every row beats copying most of them out
+                    slots = np.arange(self._size)
+                    scores = self._vectors[:self._size] @ vector
+                    scores[self._scopes[:self._size] != scope_id] = -1.0
+                else:
+                    slots = np.fromiter(slots, dtype=np.intp, count=len(slots))
+                    scores = self._vectors[slots] @ vector
+                scores[self._expires[slots] < now] = -1.0
+                best = int(np.argmax(scores))
+                similarity = float(scores[best])
+                if similarity >= self.threshold:
+                    slot = int(slots[best])
+                    self._last_used[slot] = now
+                    self.hits += 1
+                    return self._values[slot], similarity
+            self.misses += 1
+            return None, None
+
+    def set(self, scope, vector, value):
+        now = time.time()
+        with self._lock:
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                expired = np.flatnonzero(self._expires < now)
+                if expired.size:
+                    slot = int(expired[0])
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self.evictions += 1
+                self._slots[int(self._scopes[slot])].discard(slot)
+            scope_id = self.scope_id(scope)
+            self._slots.setdefault(scope_id, set()).add(slot)
+            self._vectors[slot] = vector
+            self._scopes[slot] = scope_id
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._values[slot] = value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def semantic_cache_from_env():
+    # Off unless SEMANTIC_CACHE_ENABLED is set; None when disabled or NumPy is missing
+    if os.getenv('SEMANTIC_CACHE_ENABLED', '0').lower() not in ('1', 'true', 'yes'):
+        return None
+    try:
+        _import_numpy()
+    except ImportError:
+        logger.warning("SEMANTIC_CACHE_ENABLED is set but NumPy is not installed; semantic cache disabled")
+        return None
+    return SemanticCache(
+        max_entries=int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 5000)),
+        threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92)),
+        ttl=float(os.getenv('SEMANTIC_CACHE_TTL', os.getenv('CACHE_TTL', 3600))),
+        dim=int(os.getenv('SEMANTIC_CACHE_DIM', 512)),
+    )
@@ -0,0 +1,358 @@
+# State shared by every gunicorn worker and every node: response cache
+# entries, rate-limit buckets, single-flight locks and delivery job status
+#
+# SHARED_STATE_URL picks the backend:
+#
+#   sqlite:///var/lib/email-api/state.db   workers on this host (one WAL file)
+#   redis://[:password@]host:6379/0        workers on every node
+#
+# Unset, everything stays in-process as before. Both backends offer the same
+# small API, so callers never know which one they have.
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import unquote, urlsplit
+
+from cache import SQLiteStore
+
+# Rate limits are GCRA: a bucket is a single "theoretical arrival time". A
+# reservation moves it `interval` seconds past max(tat, now) and must wait
+# for whatever exceeds `tolerance` (the burst, in seconds)
+TAKE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), now) + tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+redis.call('SET', KEYS[1], string.format('%.6f', tat), 'PX', math.ceil((tat - now + tolerance) * 1000) + 1000)
+return string.format('%.6f', math.max(0, tat - now - tolerance))
+"""
+
+# Only the holder's token may release a lock
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SQLiteState(SQLiteStore):
+    """Shared state in one SQLite file; transactions make reservations atomic.
+
+    Writes also purge what has expired (cache rows after `retain`, idle
+    rate-limit buckets, stale locks and job hashes), as Redis would itself.
+    """
+
+    def __init__(self, path, retain=3600, purge_interval=60):
+        super().__init__(path, retain, purge_interval)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_rate_limits_tat ON rate_limits (tat);
+            CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS hashes (
+                key TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (key, field)
+            );
+            CREATE INDEX IF NOT EXISTS idx_hashes_expires ON hashes (expires_at);
+            """
+        )
+
+    def purge_expired(self, grace=0):
+        # A bucket whose tat has passed is full again, the same as no row
+        purged = super().purge_expired(grace)
+        now = time.time()
+        with self._lock:
+            for statement in ("DELETE FROM rate_limits WHERE tat < ?",
+                              "DELETE FROM locks WHERE expires_at < ?",
+                              "DELETE FROM hashes WHERE expires_at < ?"):
+                purged += self._conn.execute(statement, (now,)).rowcount
+        return purged
+
+    def _transaction(self, statements):
+        # statements: callable(conn) run inside BEGIN IMMEDIATE, so other
+        # processes can't interleave between our read and write
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def take(self, key, interval, tolerance):
+        def reserve(conn):
+            now = time.time()
+            row = conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tat = max(row[0] if row else 0.0, now) + interval
+            conn.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, tat))
+            return max(0.0, tat - now - tolerance)
+        wait = self._transaction(reserve)
+        self._maybe_purge()
+        return wait
+
+    def refund(self, key, interval):
+        with self._lock:
+            self._conn.execute("UPDATE rate_limits SET tat = tat - ? WHERE key = ?", (interval, key))
+
+    def try_lock(self, key, ttl):
+        # Returns a token for unlock(), or None while someone else holds the lock
+        token = uuid.uuid4().hex
+
+        def acquire(conn):
+            now = time.time()
+            conn.execute("DELETE FROM locks WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = conn.execute("INSERT OR IGNORE INTO locks (key, token, expires_at) VALUES (?, ?, ?)",
+                                  (key, token, now + ttl))
+            return token if cursor.rowcount else None
+        return self._transaction(acquire)
+
+    def unlock(self, key, token):
+        with self._lock:
+            self._conn.execute("DELETE FROM locks WHERE key = ? AND token = ?", (key, token))
+
+    def hset(self, key, mapping, ttl):
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value, expires_at) VALUES (?, ?, ?, ?)",
+                [(key, str(field), value, expires_at) for field, value in mapping.items()],
+            )
+        self._maybe_purge()
+
+    def hgetall(self, key):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, value FROM hashes WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchall()
+        return dict(rows)
+
+    def stats(self):
+        return {"backend": "sqlite", "path": self.path}
+
+
+class RedisError(Exception):
+    pass
+
+
+def _encode(args):
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class _RedisConnection:
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            return RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self.read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis: {line!r}")
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisClient:
+    """Just enough RESP2 for RedisState: pooled connections and pipelines."""
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=5.0, max_idle=8):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = _RedisConnection(self.host, self.port, self.timeout)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            try:
+                self._send(conn, setup)
+            except Exception:
+                conn.close()
+                raise
+        return conn
+
+    @staticmethod
+    def _send(conn, commands):
+        conn.sock.sendall(b"".join(_encode(command) for command in commands))
+        replies = [conn.read_reply() for _ in commands]
+        # Every reply is read before raising so the connection stays in sync
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def pipeline(self, commands):
+        # One round trip for all commands; returns their replies in order
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            replies = self._send(conn, commands)
+        except RedisError:
+            self._release(conn)
+            raise
+        except Exception:
+            conn.close()
+            raise
+        self._release(conn)
+        return replies
+
+    def after_fork(self):
+        # Pooled sockets belong to the process that opened them
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def eval(self, script, sha, keys, args):
+        # EVALSHA, loading the script on first use (or after a server restart)
+        try:
+            return self.execute("EVALSHA", sha, len(keys), *keys, *args)
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            return self.execute("EVAL", script, len(keys), *keys, *args)
+
+
+class RedisState:
+    """Shared state in Redis, for workers spread over several nodes.
+
+    Cache entries outlive their expiry by `retain` seconds so they can
+    still be served stale while the upstream is down.
+    """
+
+    def __init__(self, client, prefix="email_api:", retain=3600):
+        self.client = client
+        self.prefix = prefix
+        self.retain = retain
+        self._take_sha = hashlib.sha1(TAKE_SCRIPT.encode("utf-8")).hexdigest()
+        self._unlock_sha = hashlib.sha1(UNLOCK_SCRIPT.encode("utf-8")).hexdigest()
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def after_fork(self):
+        self.client.after_fork()
+
+    def get(self, key):
+        # Returns (value, expires_at) even when expired, like SQLiteStore
+        raw = self.client.execute("GET", self._key(key))
+        if raw is None:
+            return None
+        expires_at, _, value = raw.partition("|")
+        return value, float(expires_at)
+
+    def set(self, key, value, expires_at):
+        keep_ms = max(1, int((expires_at - time.time() + self.retain) * 1000))
+        self.client.execute("SET", self._key(key), f"{expires_at!r}|{value}", "PX", keep_ms)
+
+    def delete(self, key):
+        self.client.execute("DEL", self._key(key))
+
+    def purge_expired(self, grace=0):
+        # Redis expires keys on its own
+        pass
+
+    def take(self, key, interval, tolerance):
+        return float(self.client.eval(TAKE_SCRIPT, self._take_sha, [self._key(key)], [interval, tolerance]))
+
+    def refund(self, key, interval):
+        self.client.execute("INCRBYFLOAT", self._key(key), -interval)
+
+    def try_lock(self, key, ttl):
+        token = uuid.uuid4().hex
+        acquired = self.client.execute("SET", self._key(key), token, "NX", "PX", max(1, int(ttl * 1000)))
+        return token if acquired == "OK" else None
+
+    def unlock(self, key, token):
+        self.client.eval(UNLOCK_SCRIPT, self._unlock_sha, [self._key(key)], [token])
+
+    def hset(self, key, mapping, ttl):
+        fields = [item for field_value in mapping.items() for item in field_value]
+        self.client.pipeline([
+            ("HSET", self._key(key), *fields),
+            ("PEXPIRE", self._key(key), max(1, int(ttl * 1000))),
+        ])
+
+    def hgetall(self, key):
+        reply = self.client.execute("HGETALL", self._key(key)) or []
+        return dict(zip(reply[::2], reply[1::2]))
+
+    def stats(self):
+        return {"backend": "redis", "host": self.client.host, "port": self.client.port, "db": self.client.db}
+
+
+def state_from_url(url, retain=3600):
+    parts = urlsplit(url)
+    if parts.scheme == "sqlite":
+        return SQLiteState(unquote(parts.path), retain=retain)
+    if parts.scheme == "redis":
+        client = RedisClient(
+            host=parts.hostname or "127.0.0.1",
+            port=parts.port or 6379,
+            db=int(parts.path.strip("/") or 0),
+            password=unquote(parts.password) if parts.password else None,
+            timeout=float(os.getenv('SHARED_STATE_TIMEOUT', 5)),
+        )
+        return RedisState(client, prefix=os.getenv('SHARED_STATE_PREFIX', 'email_api:'), retain=retain)
+    raise ValueError(f"Unsupported SHARED_STATE_URL scheme: {parts.scheme!r}")
+
+
+def state_from_env():
+    # None keeps caches, rate limits and job status in-process
+    url = os.getenv('SHARED_STATE_URL', '')
+    if not url:
+        return None
+    return state_from_url(url, retain=float(os.getenv('CACHE_TTL', 3600)))
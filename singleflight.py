@@ -0,0 +1,219 @@
+# Coalesce identical concurrent generations into a single upstream call
+import asyncio
+import fcntl
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from metrics import registry
+
+COALESCED = registry.counter(
+    "email_api_singleflight_coalesced_total", "Requests served by another request's in-flight call",
+    ("scope",))
+LEADERS = registry.counter(
+    "email_api_singleflight_calls_total", "Upstream calls made by single-flight leaders")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Threads asking for the same key while a call is running wait for its result.
+
+    With `lock_dir` set, leaders in different processes also serialize on a
+    striped file lock; a leader that had to wait calls `recheck()` first so it
+    can pick up what the other process stored (e.g. in the SQLite cache tier)
+    instead of calling upstream again. With shared `state` (see
+    shared_state.py) the lock is taken there instead, which also covers
+    workers on other nodes.
+    """
+
+    def __init__(self, lock_dir=None, lock_stripes=256, lock_timeout=60, state=None, poll_interval=0.05):
+        self.lock_dir = lock_dir
+        self.lock_stripes = lock_stripes
+        self.lock_timeout = lock_timeout
+        self.state = state
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, fn, recheck=None):
+        # Returns (result, shared); shared is True when this caller made no call itself
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            COALESCED.inc(scope="thread")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        shared = False
+        try:
+            with self._process_lock(key) as waited:
+                result = recheck() if waited and recheck is not None else None
+                if result is not None:
+                    COALESCED.inc(scope="process")
+                    shared = True
+                else:
+                    LEADERS.inc()
+                    result = fn()
+            call.result = result
+            return result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @contextmanager
+    def _process_lock(self, key):
+        # Yields True if another process held the lock when we arrived
+        if self.state is not None:
+            with self._state_lock(key) as waited:
+                yield waited
+            return
+        if not self.lock_dir:
+            yield False
+            return
+        stripe = zlib.crc32(key.encode("utf-8")) % self.lock_stripes
+        path = os.path.join(self.lock_dir, f"singleflight-{stripe}.lock")
+        with open(path, "a") as lock_file:
+            waited = False
+            deadline = time.monotonic() + self.lock_timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if time.monotonic() > deadline:
+                        # Give up on coordination rather than failing the request
+                        yield False
+                        return
+                    time.sleep(0.01)
+            try:
+                yield waited
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _state_lock(self, key):
+        name = f"singleflight:{key}"
+        waited = False
+        deadline = time.monotonic() + self.lock_timeout
+        token = self.state.try_lock(name, self.lock_timeout)
+        while token is None:
+            waited = True
+            if time.monotonic() > deadline:
+                # Give up on coordination rather than failing the request
+                yield False
+                return
+            time.sleep(self.poll_interval)
+            token = self.state.try_lock(name, self.lock_timeout)
+        try:
+            yield waited
+        finally:
+            self.state.unlock(name, token)
+
+
+class _LeaderCancelled(Exception):
+    # Handed to followers when the leader's task was cancelled (its client
+    # went away); they try again, one of them as the new leader
+    pass
+
+
+class AsyncSingleFlight:
+    """Event-loop counterpart of SingleFlight for the ASGI entry point.
+
+    With shared `state` the leader also takes the same lock as SingleFlight,
+    polling it from a worker thread, and an awaited `recheck()` runs first
+    when another process or node held it.
+    """
+
+    def __init__(self, lock_timeout=60, state=None, poll_interval=0.05):
+        self.lock_timeout = lock_timeout
+        self.state = state
+        self.poll_interval = poll_interval
+        self._calls = {}
+
+    async def do(self, key, fn, recheck=None):
+        future = self._calls.get(key)
+        while future is not None:
+            try:
+                result = await asyncio.shield(future)
+            except _LeaderCancelled:
+                future = self._calls.get(key)
+                continue
+            COALESCED.inc(scope="task")
+            return result, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result, shared = await self._lead(key, fn, recheck)
+            future.set_result(result)
+            return result, shared
+        except asyncio.CancelledError:
+            # Only the leader's own request is cancelled, not its followers
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure doesn't warn at shutdown
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+    async def _lead(self, key, fn, recheck):
+        if self.state is None:
+            LEADERS.inc()
+            return await fn(), False
+        name = f"singleflight:{key}"
+        token, waited = await self._state_lock(name)
+        try:
+            result = await recheck() if waited and recheck is not None else None
+            if result is not None:
+                COALESCED.inc(scope="process")
+                return result, True
+            LEADERS.inc()
+            return await fn(), False
+        finally:
+            if token is not None:
+                await asyncio.to_thread(self.state.unlock, name, token)
+
+    async def _state_lock(self, name):
+        # Returns (token, waited); token is None when we gave up on coordination
+        waited = False
+        deadline = time.monotonic() + self.lock_timeout
+        token = await asyncio.to_thread(self.state.try_lock, name, self.lock_timeout)
+        while token is None:
+            waited = True
+            if time.monotonic() > deadline:
+                return None, False
+            await asyncio.sleep(self.poll_interval)
+            token = await asyncio.to_thread(self.state.try_lock, name, self.lock_timeout)
+        return token, waited
+
+
+def singleflight_from_env(shared_state=None):
+    if os.getenv('SINGLEFLIGHT_ENABLED', '1').lower() in ('0', 'false', 'no'):
+        return None, None
+    lock_dir = os.getenv('SINGLEFLIGHT_LOCK_DIR') or None
+    return SingleFlight(lock_dir=lock_dir, state=shared_state), AsyncSingleFlight(state=shared_state)
@@ -0,0 +1,221 @@
+# Pool of authenticated SMTP sessions reused across sends
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+from metrics import timed
+
+
+class _PooledConnection:
+    def __init__(self, server, credential):
+        self.server = server
+        self.credential = credential
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.messages_sent = 0
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Keeps logged-in SMTP sessions per (host, port, sender_email).
+
+    A session is only handed out to callers presenting the same password it
+    was authenticated with, so a wrong password never rides on someone
+    else's login. Every sender has their own key, so idle sessions are also
+    capped at `max_idle_total` across keys (the least recently used goes
+    first), and expired ones are closed on every acquire and release.
+    """
+
+    def __init__(self, idle_timeout=60, max_messages=100, max_idle_per_key=2, max_idle_total=32,
+                 noop_after=5, timeout=30, starttls=True):
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.max_idle_per_key = max_idle_per_key
+        self.max_idle_total = max_idle_total
+        self.noop_after = noop_after
+        self.timeout = timeout
+        self.starttls = starttls
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._secret = secrets.token_bytes(32)
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    def after_fork(self):
+        # Sessions logged in by the parent process stay with the parent
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, password):
+        return hmac.new(self._secret, password.encode("utf-8"), hashlib.sha256).digest()
+
+    def _connect(self, host, port, sender_email, password, credential):
+        # smtplib loads with the first connection rather than at startup
+        import smtplib
+
+        with timed("smtp_connect"):
+            server = smtplib.SMTP(host, port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                with timed("smtp_starttls"):
+                    server.starttls()
+            with timed("smtp_login"):
+                server.login(sender_email, password)
+        except Exception:
+            server.close()
+            raise
+        with self._lock:
+            self.connects += 1
+        return _PooledConnection(server, credential)
+
+    def _is_alive(self, conn):
+        # Only probe sessions that have been sitting idle for a while
+        if time.monotonic() - conn.last_used < self.noop_after:
+            return True
+        try:
+            return conn.server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _sweep(self, now):
+        # Takes every expired session out of the pool, for all keys; call with
+        # the lock held and close what it returns after releasing it
+        expired = []
+        for key in list(self._idle):
+            idle = self._idle[key]
+            fresh = [conn for conn in idle if now - conn.last_used <= self.idle_timeout]
+            if len(fresh) < len(idle):
+                expired.extend(conn for conn in idle if now - conn.last_used > self.idle_timeout)
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+        return expired
+
+    def _evict_oldest(self):
+        # Lock held; removes and returns the least recently used idle session
+        key = min(self._idle, key=lambda key: self._idle[key][0].last_used)
+        conn = self._idle[key].pop(0)
+        if not self._idle[key]:
+            del self._idle[key]
+        self.evictions += 1
+        return conn
+
+    def _acquire(self, key, credential):
+        now = time.monotonic()
+        found = None
+        with self._lock:
+            stale = self._sweep(now)
+            idle = self._idle.get(key, [])
+            while idle:
+                conn = idle.pop()
+                if now - conn.last_used > self.idle_timeout:
+                    stale.append(conn)
+                elif not hmac.compare_digest(conn.credential, credential):
+                    stale.append(conn)
+                else:
+                    found = conn
+                    break
+            if not idle:
+                self._idle.pop(key, None)
+        for conn in stale:
+            conn.close()
+        if found is not None and not self._is_alive(found):
+            found.close()
+            found = None
+        return found
+
+    def _release(self, key, conn):
+        conn.last_used = time.monotonic()
+        if conn.messages_sent >= self.max_messages:
+            conn.close()
+            return
+        with self._lock:
+            closing = self._sweep(conn.last_used)
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_key:
+                idle.append(conn)
+                while sum(len(conns) for conns in self._idle.values()) > self.max_idle_total:
+                    closing.append(self._evict_oldest())
+            else:
+                closing.append(conn)
+                if not idle:
+                    del self._idle[key]
+        for conn in closing:
+            conn.close()
+
+    def send(self, host, port, sender_email, password, msg):
+        import smtplib
+
+        key = (host, port, sender_email)
+        credential = self._fingerprint(password)
+
+        conn = self._acquire(key, credential)
+        if conn is not None:
+            with self._lock:
+                self.reuses += 1
+        else:
+            conn = self._connect(host, port, sender_email, password, credential)
+
+        try:
+            with timed("smtp_send"):
+                conn.server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The server dropped a pooled session; retry once on a fresh one
+            conn.close()
+            with self._lock:
+                self.reconnects += 1
+            conn = self._connect(host, port, sender_email, password, credential)
+            try:
+                with timed("smtp_send"):
+                    conn.server.send_message(msg)
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        conn.messages_sent += 1
+        self._release(key, conn)
+
+    def close_all(self):
+        with self._lock:
+            conns = [conn for idle in self._idle.values() for conn in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle_connections": sum(len(idle) for idle in self._idle.values()),
+                "connects": self.connects,
+                "reuses": self.reuses,
+                "reconnects": self.reconnects,
+                "evictions": self.evictions,
+            }
+
+
+def pool_from_env():
+    return SMTPConnectionPool(
+        idle_timeout=float(os.getenv('SMTP_POOL_IDLE_TIMEOUT', 60)),
+        max_messages=int(os.getenv('SMTP_POOL_MAX_MESSAGES', 100)),
+        max_idle_per_key=int(os.getenv('SMTP_POOL_MAX_IDLE', 2)),
+        max_idle_total=int(os.getenv('SMTP_POOL_MAX_IDLE_TOTAL', 32)),
+        # Only local test servers should ever run without STARTTLS
+        starttls=os.getenv('SMTP_STARTTLS', '1').lower() not in ('0', 'false', 'no'),
+    )
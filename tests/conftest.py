@@ -0,0 +1,19 @@
+# The modules live at the repository root, next to app.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py builds its components from the environment at import
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+os.environ.setdefault("DELIVERY_DB_PATH", os.path.join(tempfile.mkdtemp(), "delivery.db"))
+
+
+@pytest.fixture
+def client():
+    import app
+    return app.create_app().test_client()
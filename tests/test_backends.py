@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import pytest
+
+from backends import FakeBackend, OpenAICompatibleBackend, backends_from_env, create_backend, is_retryable, is_throttle
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.code = status_code
+
+
+def test_throttles_and_server_errors_are_retryable():
+    assert is_throttle(ResourceExhausted()) and is_retryable(ResourceExhausted())
+    assert is_throttle(HTTPError(429))
+    assert is_retryable(HTTPError(503))
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(HTTPError(400))
+    assert not is_retryable(ValueError("bad prompt"))
+
+
+def test_fake_backend_streams_what_it_generates():
+    backend = FakeBackend()
+    text = backend.generate("Write to Ann").text
+    assert "".join(backend.stream("Write to Ann")) == text
+    assert asyncio.run(backend.generate_async("Write to Ann")).text == text
+    assert backend.generate("Write to Bob").text != text
+
+
+class FakeResponse:
+    def __init__(self, body=None, lines=()):
+        self.body = body
+        self.lines = lines
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+    def iter_lines(self, decode_unicode=True):
+        return iter(self.lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def post(self, url, json=None, **kwargs):
+        self.requests.append((url, json))
+        return self.response
+
+
+def test_openai_backend_reads_content_and_usage():
+    backend = OpenAICompatibleBackend("http://llm.local/v1/", "local-model")
+    backend._session = FakeSession(FakeResponse({
+        "choices": [{"message": {"content": "Subject: Hi"}}],
+        "usage": {"prompt_tokens": 12, "completion_tokens": 3},
+    }))
+    result = backend.generate("Write to Ann")
+    assert (result.text, result.input_tokens, result.output_tokens) == ("Subject: Hi", 12, 3)
+    url, body = backend._session.requests[0]
+    assert url == "http://llm.local/v1/chat/completions"
+    assert body["messages"] == [{"role": "user", "content": "Write to Ann"}]
+
+
+def test_openai_backend_streams_deltas_until_done():
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}" for text in ("Subject", ": Hi")]
+    backend = OpenAICompatibleBackend("http://llm.local/v1", "local-model")
+    backend._session = FakeSession(FakeResponse(lines=["", *lines, "data: [DONE]", lines[0]]))
+    assert list(backend.stream("Write to Ann")) == ["Subject", ": Hi"]
+
+
+def test_backends_from_env_adds_the_default(monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("LLM_BACKENDS", "openai")
+    default, backends = backends_from_env()
+    assert default == "fake"
+    assert sorted(backends) == ["fake", "openai"]
+    with pytest.raises(ValueError):
+        create_backend("nope")
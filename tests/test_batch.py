@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"template": "oops", "recipients": [{}]}, "template must be an object of shared fields"),
+    ({"recipients": [{"variables": "oops"}]}, "Recipient 0: variables must be an object of merge fields"),
+    ({"recipients": [{}, {"key_points": "oops"}]}, "Recipient 1: key_points must be a list of strings"),
+    ({"template": {"key_points": [1]}, "recipients": [{}]}, "key_points must be a list of strings"),
+    ({"recipients": [{"prompt": 5}]}, "Recipient 0: prompt must be a string"),
+    ({"recipients": [{"recipient_email": ["a@example.com"]}]}, "Recipient 0: recipient_email must be a string"),
+])
+def test_malformed_batch_fields_are_rejected(client, body, error):
+    response = client.post("/generate/batch", json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {"success": False, "error": error}
+
+
+def test_batch_merges_variables(client):
+    response = client.post("/generate/batch", json={
+        "template": {"prompt": "Thank $name", "purpose": "Thanks"},
+        "recipients": [{"variables": {"name": "Ann"}}, {"variables": {"name": "Bob"}}],
+    })
+    assert response.status_code == 200
+    assert [item["success"] for item in response.get_json()["results"]] == [True, True]
+
+
+def test_template_variables_are_shared_and_recipients_override_them():
+    template = {"prompt": "Hi $name from $team", "key_points": ["Ask $team"], "variables": {"team": "Ops", "name": "all"}}
+    merged = app.merge_batch_item(template, {"variables": {"name": "Ann"}})
+    assert merged["prompt"] == "Hi Ann from Ops"
+    assert merged["key_points"] == ["Ask Ops"]
+    assert "variables" not in merged
+
+
+def test_template_email_keeps_a_string_key_point_whole():
+    assert "- Budget review\n" in app.template_email({"key_points": "Budget review"})
+
+
+def test_non_string_recipient_email_is_a_bad_request(client):
+    response = client.post("/send-email", json={
+        "recipient_email": 5, "sender_email": "a@example.com", "sender_password": "x", "email_content": "Hi"
+    })
+    assert response.status_code == 400
+
+
+def scheduled_send(client):
+    return client.post("/send-email", json={
+        "recipient_email": "b@example.com", "sender_email": "a@example.com", "sender_password": "x",
+        "email_content": "Hi", "send_at": time.time() + 3600
+    })
+
+
+def test_scheduled_sends_are_queued_durably(client):
+    response = scheduled_send(client)
+    assert response.status_code == 202
+    assert client.get(response.get_json()["status_url"]).get_json()["status"] == "scheduled"
+
+
+def test_scheduled_sends_are_refused_without_a_durable_queue(client, monkeypatch):
+    monkeypatch.setattr(app.delivery_queue, "durable", False)
+    assert scheduled_send(client).status_code == 400
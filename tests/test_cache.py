@@ -0,0 +1,64 @@
+import time
+
+from cache import ResponseCache, SQLiteStore, make_cache_key
+
+
+def test_key_ignores_whitespace_but_not_model_or_template():
+    key = make_cache_key("Write to  Ann\n about the review", "gemini-1.5-flash", "default@1")
+    assert key == make_cache_key("  Write to Ann about\tthe review ", "gemini-1.5-flash", "default@1")
+    assert key != make_cache_key("Write to Ann about the review", "gemini-1.5-pro", "default@1")
+    assert key != make_cache_key("Write to Ann about the review", "gemini-1.5-flash", "default@2")
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_only_served_as_stale():
+    cache = ResponseCache(ttl=-1)
+    cache.set("key", "email")
+    assert cache.get("key") is None
+    assert cache.get("key", allow_stale=True) == "email"
+    stats = cache.stats()
+    assert (stats["misses"], stats["stale_hits"]) == (1, 1)
+
+
+def test_store_hits_are_promoted_to_memory(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"))
+    ResponseCache(store=store).set("key", "email")
+    cache = ResponseCache(store=store)
+    assert cache.get("key") == "email"
+    assert cache.get("key") == "email"
+    assert (cache.stats()["store_hits"], cache.stats()["hits"]) == (1, 1)
+
+
+def test_store_keeps_expired_rows_for_stale_fallback(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"), retain=60)
+    cache = ResponseCache(ttl=-1, store=store)
+    cache.set("key", "stale email")
+    assert ResponseCache(store=store).get("key") is None
+    assert ResponseCache(store=store).get("key", allow_stale=True) == "stale email"
+
+
+def test_purge_drops_rows_past_retention(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"), retain=60)
+    store.set("old", "a", time.time() - 120)
+    store.set("recent", "b", time.time() - 30)
+    assert store.purge_expired(grace=60) == 1
+    assert store.get("old") is None
+    assert store.get("recent") is not None
+
+
+def test_set_purges_periodically(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"), retain=0, purge_interval=0)
+    store.set("old", "a", time.time() - 10)
+    store.set("new", "b", time.time() + 60)
+    assert store.get("old") is None
+    assert store.get("new") is not None
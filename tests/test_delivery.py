@@ -0,0 +1,96 @@
+import os
+import socket
+import time
+
+from delivery import DeliveryQueue
+
+
+def wait_for(queue, job_id, status="completed", timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.job_status(job_id)
+        if job is not None and job["status"] == status:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} never reached {status}: {queue.job_status(job_id)}")
+
+
+def payload(recipient):
+    return {"recipient_email": recipient, "email_host": "smtp.example.com", "email_document": {"paragraphs": ["Hi"]}}
+
+
+def test_finished_job_keeps_status_but_not_bodies():
+    sent = []
+    queue = DeliveryQueue(lambda message, password: sent.append(message["recipient_email"]), host_rate=1000)
+    job_id = queue.submit([payload("a@example.com"), payload("b@example.com")], "secret")
+    job = wait_for(queue, job_id)
+    assert job["counts"]["sent"] == 2
+    assert sorted(sent) == ["a@example.com", "b@example.com"]
+    assert queue._execute("SELECT DISTINCT payload FROM delivery_messages") == [("{}",)]
+
+
+
+def test_internal_errors_fail_the_message_and_drop_the_password():
+    queue = DeliveryQueue(lambda message, password: None, host_rate=1000)
+    # No email_host: the worker fails before it ever reaches SMTP
+    job_id = queue.submit([{"recipient_email": "a@example.com"}], "secret")
+    job = wait_for(queue, job_id)
+    assert job["counts"]["failed"] == 1
+    assert job_id not in queue._credentials
+
+def test_purge_drops_finished_jobs_past_status_ttl():
+    queue = DeliveryQueue(lambda message, password: None, host_rate=1000, status_ttl=0.2)
+    job_id = queue.submit([payload("a@example.com")], "secret")
+    wait_for(queue, job_id)
+    assert queue.purge_finished() == 0
+    time.sleep(0.3)
+    assert queue.purge_finished() == 1
+    assert queue.job_status(job_id) is None
+
+
+def test_purge_keeps_pending_jobs():
+    queue = DeliveryQueue(lambda message, password: None, host_rate=1000, status_ttl=0)
+    job_id = queue.submit([payload("a@example.com")], "secret", send_at=time.time() + 60)
+    time.sleep(0.05)
+    assert queue.purge_finished() == 0
+    assert queue.job_status(job_id)["status"] == "scheduled"
+
+
+def leave_pending(db_path, owner, heartbeat_at=None):
+    # What a worker that died mid-job leaves behind in a shared database
+    queue = DeliveryQueue(lambda message, password: None, db_path=db_path)
+    queue._execute("INSERT INTO delivery_jobs (id, created_at, total) VALUES (?, ?, 1)", (owner, time.time()))
+    queue._execute(
+        "INSERT INTO delivery_messages (job_id, idx, recipient_email, payload, status, next_attempt_at, owner, "
+        "updated_at) VALUES (?, 0, 'a@example.com', '{}', 'scheduled', ?, ?, ?)",
+        (owner, time.time() + 3600, owner, time.time()),
+    )
+    if heartbeat_at is not None:
+        queue._execute("INSERT INTO delivery_owners (owner, heartbeat_at) VALUES (?, ?)", (owner, heartbeat_at))
+    return owner
+
+
+def test_startup_fails_messages_of_stopped_workers(tmp_path):
+    db_path = str(tmp_path / "delivery.db")
+    # Same host and pid as this process, as in a restarted container
+    job_id = leave_pending(db_path, f"{socket.gethostname()}:{os.getpid()}:previous")
+    queue = DeliveryQueue(lambda message, password: None, db_path=db_path)
+    job = queue.job_status(job_id)
+    assert job["status"] == "completed"
+    assert job["counts"]["failed"] == 1
+
+
+def test_live_workers_keep_their_messages(tmp_path):
+    db_path = str(tmp_path / "delivery.db")
+    job_id = leave_pending(db_path, "other-node:42:alive", heartbeat_at=time.time())
+    queue = DeliveryQueue(lambda message, password: None, db_path=db_path)
+    assert queue.job_status(job_id)["status"] == "scheduled"
+
+
+def test_polling_status_recovers_after_heartbeats_stop(tmp_path):
+    db_path = str(tmp_path / "delivery.db")
+    job_id = leave_pending(db_path, "other-node:42:stopped", heartbeat_at=time.time())
+    queue = DeliveryQueue(lambda message, password: None, db_path=db_path, heartbeat_interval=0.05)
+    assert queue.job_status(job_id)["status"] == "scheduled"
+    time.sleep(0.2)
+    assert queue.job_status(job_id)["status"] == "completed"
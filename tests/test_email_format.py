@@ -0,0 +1,99 @@
+import pytest
+
+from email_format import DEFAULT_SUBJECT, EmailDocument, MessageBuilder
+
+GENERATED = """**Subject:** Quarterly update
+
+Dear Ann,
+
+Revenue grew this quarter.
+Costs held steady.
+
+Thanks for your support.
+
+Best regards,
+Bob"""
+
+
+def test_parse_splits_the_parts():
+    document = EmailDocument.parse(GENERATED)
+    assert document.subject == "Quarterly update"
+    assert document.greeting == "Dear Ann,"
+    assert document.paragraphs == (
+        "Revenue grew this quarter.\nCosts held steady.",
+        "Thanks for your support.",
+    )
+    assert document.closing == "Best regards,\nBob"
+
+
+def test_closing_sharing_a_block_with_the_body():
+    document = EmailDocument.parse("Hi Ann,\n\nSee you soon.\nCheers,\nBob")
+    assert document.paragraphs == ("See you soon.",)
+    assert document.closing == "Cheers,\nBob"
+
+
+def test_plain_text_without_parts():
+    document = EmailDocument.parse("Just one line.")
+    assert document.subject is None
+    assert document.greeting is None
+    assert document.closing is None
+    assert document.text == "Just one line."
+
+
+def test_text_round_trip_leaves_the_subject_out_of_the_body():
+    document = EmailDocument.parse(GENERATED)
+    assert not document.text.startswith("Subject")
+    assert EmailDocument.parse(document.render_text(include_subject=True)) == document
+
+
+def test_html_escapes_and_keeps_line_breaks():
+    document = EmailDocument(paragraphs=["a < b\nc & d"])
+    assert document.html == "<p>a &lt; b<br>c &amp; d</p>"
+    assert document.render_html(include_subject=True) == document.html
+    titled = EmailDocument(subject="x > y", paragraphs=["body"])
+    assert titled.render_html(include_subject=True).startswith("<p><strong>Subject:</strong> x &gt; y</p>")
+
+
+def test_from_content_reads_preview_html():
+    content = "<strong>Subject:</strong> Hello<br><br>Dear Ann,<br><br>Tom &amp; Jerry say hi.<br><br>Best,<br>Bob"
+    document = EmailDocument.from_content(content)
+    assert document.subject == "Hello"
+    assert document.paragraphs == ("Tom & Jerry say hi.",)
+    assert document.closing == "Best,\nBob"
+
+
+def test_dict_round_trip_and_hashing():
+    document = EmailDocument.parse(GENERATED)
+    copy = EmailDocument.from_dict(document.to_dict())
+    assert copy == document
+    assert len({copy, document}) == 1
+
+
+@pytest.mark.parametrize("data", [
+    "text",
+    {"paragraphs": "not a list"},
+    {"subject": 1, "paragraphs": []},
+    {"paragraphs": ["ok", 2]},
+])
+def test_from_dict_rejects_bad_input(data):
+    with pytest.raises(ValueError):
+        EmailDocument.from_dict(data)
+
+
+def test_builder_shares_body_parts_across_recipients():
+    builder = MessageBuilder(EmailDocument.parse(GENERATED))
+    first = builder.message("ann@example.com", "Bob", "bob@example.com")
+    second = builder.message("cat@example.com", "Bob", "bob@example.com")
+    assert first['To'] == "ann@example.com"
+    assert first['From'] == "Bob <bob@example.com>"
+    assert first['Subject'] == second['Subject'] == "Quarterly update"
+    assert first.get_payload()[0] is second.get_payload()[0]
+    plain, rich = first.get_payload()
+    assert plain.get_content_type() == "text/plain"
+    assert rich.get_content_type() == "text/html"
+    assert "Revenue grew" in plain.get_payload(decode=True).decode()
+
+
+def test_builder_default_subject():
+    builder = MessageBuilder(EmailDocument(paragraphs=["body"]))
+    assert builder.message("a@example.com", "B", "b@example.com")['Subject'] == DEFAULT_SUBJECT
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+
+def sse_events(response):
+    events = []
+    for frame in response.get_data(as_text=True).strip().split("\n\n"):
+        event, data = frame.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_stream_sends_chunks_then_the_document(client):
+    response = client.post("/generate/stream", json={"prompt": f"Review {uuid.uuid4()}", "purpose": "Follow-up"})
+    assert response.mimetype == "text/event-stream"
+    events = sse_events(response)
+    chunks = [payload["text"] for event, payload in events if event == "chunk"]
+    assert len(chunks) > 1
+    event, done = events[-1]
+    assert event == "done" and done["success"] and not done["cached"]
+    assert "".join(chunks).startswith("Subject: Generated email")
+
+
+def test_stream_serves_a_cached_email_in_one_chunk(client):
+    body = {"prompt": f"Review {uuid.uuid4()}"}
+    first = "".join(p["text"] for e, p in sse_events(client.post("/generate/stream", json=body)) if e == "chunk")
+    events = sse_events(client.post("/generate/stream", json=body))
+    assert [event for event, _ in events] == ["chunk", "done"]
+    assert events[0][1]["text"] == first
+    assert events[1][1]["cached"]
+
+
+def test_stream_rejects_an_unknown_backend(client):
+    response = client.post("/generate/stream", json={"prompt": "Hi", "backend": "nope"})
+    assert response.status_code == 400
+
+
+def test_variants_per_tone_are_generated_separately(client):
+    response = client.post("/generate", json={
+        "prompt": f"Review {uuid.uuid4()}", "tones": ["Formal", "Friendly"], "n_variants": 2, "bypass_cache": True
+    })
+    body = response.get_json()
+    assert response.status_code == 200 and body["success"]
+    assert [(item["index"], item["tone"]) for item in body["variants"]] == [
+        (0, "Formal"), (1, "Formal"), (2, "Friendly"), (3, "Friendly")
+    ]
+    assert not any(item["cached"] for item in body["variants"])
+    assert body["email"] == body["variants"][0]["email"]
+
+
+def test_asgi_variants_match_the_flask_route():
+    import asgi
+
+    data = {"prompt": f"Review {uuid.uuid4()}", "n_variants": 3}
+    body, status = asyncio.run(asgi.generate_email(data))
+    assert status == 200
+    assert [item["index"] for item in body["variants"]] == [0, 1, 2]
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"tones": []}, "tones must be a non-empty list of tone names"),
+    ({"n_variants": 0}, "n_variants must be at least 1"),
+    ({"n_variants": "many"}, "n_variants must be a number"),
+])
+def test_bad_variant_requests_are_rejected(client, body, error):
+    response = client.post("/generate", json={"prompt": "Hi", **body})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == error
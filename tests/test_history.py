@@ -0,0 +1,41 @@
+import time
+
+from history import HistoryStore
+
+
+def entry(i, created_at=None):
+    return {
+        "created_at": created_at or time.time(),
+        "tone": "Formal",
+        "purpose": "follow-up",
+        "recipient": "Ms. Smith",
+        "sender_name": "Alex",
+        "prompt": f"quarterly review number{i}",
+        "body": f"Subject: Review {i}\n\nDear Ms. Smith,\n\nNotes number{i}.\n\nBest regards,\nAlex",
+    }
+
+
+def test_prune_keeps_newest_rows():
+    store = HistoryStore(max_rows=3, max_age=0)
+    store._write([entry(i) for i in range(5)])
+    assert store.prune() == 2
+    items = store.search(limit=10)["items"]
+    assert [item["subject"] for item in items] == ["Review 4", "Review 3", "Review 2"]
+    # Pruned rows are gone from the full-text index too
+    assert store.search(q="number1")["items"] == []
+    assert len(store.search(q="number3")["items"]) == 1
+
+
+def test_prune_drops_rows_past_max_age():
+    store = HistoryStore(max_rows=0, max_age=60)
+    store._write([entry(0, created_at=time.time() - 120), entry(1)])
+    assert store.prune() == 1
+    assert [item["subject"] for item in store.search()["items"]] == ["Review 1"]
+
+
+def test_writer_prunes_after_each_batch():
+    store = HistoryStore(max_rows=2, max_age=0, flush_interval=0.01)
+    for i in range(4):
+        store.record(entry(i))
+    assert store.flush()
+    assert len(store.search(limit=10)["items"]) == 2
@@ -0,0 +1,46 @@
+import random
+from email.message import EmailMessage
+
+import pytest
+
+from benchmarks.client import percentile
+from benchmarks.loadtest import build_bodies, parse_mix
+from benchmarks.smtp_sink import SMTPSink
+from smtp_pool import SMTPConnectionPool
+
+
+def test_mix_weights_default_to_one():
+    assert parse_mix("generate=6,send,health=0.5") == {"generate": 6.0, "send": 1.0, "health": 0.5}
+    with pytest.raises(SystemExit):
+        parse_mix("generate,upload")
+
+
+def test_percentile_picks_from_sorted_samples():
+    samples = list(range(1, 101))
+    assert percentile(samples, 0.5) == 51
+    assert percentile(samples, 0.99) == 100
+    assert percentile([], 0.5) is None
+
+
+def test_repeat_ratio_controls_prompt_reuse():
+    bodies = build_bodies(2525, repeat_ratio=0.0, rng=random.Random(1))
+    prompts = {bodies["generate"]()[2]["prompt"] for _ in range(20)}
+    assert len(prompts) == 20
+    bodies = build_bodies(2525, repeat_ratio=1.0, rng=random.Random(1))
+    assert len({bodies["generate"]()[2]["prompt"] for _ in range(50)}) <= 8
+
+
+def test_smtp_sink_counts_logins_and_messages():
+    sink = SMTPSink().start()
+    try:
+        pool = SMTPConnectionPool(starttls=False)
+        for _ in range(3):
+            msg = EmailMessage()
+            msg["From"], msg["To"], msg["Subject"] = "a@example.com", "b@example.com", "Load test"
+            msg.set_content("Hello")
+            pool.send("127.0.0.1", sink.port, "a@example.com", "secret", msg)
+        pool.close_all()
+        assert sink.stats == {"connections": 1, "logins": 1, "messages": 3}
+    finally:
+        sink.shutdown()
+        sink.server_close()
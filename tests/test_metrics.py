@@ -0,0 +1,51 @@
+import metrics
+from metrics import Registry
+
+
+def test_counter_renders_labelled_series():
+    registry = Registry()
+    sent = registry.counter("test_sent_total", "Messages sent", ("status",))
+    sent.inc(status="ok")
+    sent.inc(2, status="ok")
+    sent.inc(status='bad "quote"')
+    assert sent.value(status="ok") == 3
+    assert registry.render().splitlines() == [
+        "# HELP test_sent_total Messages sent",
+        "# TYPE test_sent_total counter",
+        'test_sent_total{status="bad \\"quote\\""} 1',
+        'test_sent_total{status="ok"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("test_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value)
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_seconds_count 4" in lines
+
+
+def test_registering_twice_returns_the_same_counter_but_replaces_gauges():
+    registry = Registry()
+    assert registry.counter("test_total", "x") is registry.counter("test_total", "x")
+    registry.gauge("test_depth", "Depth", lambda: 1)
+    registry.gauge("test_depth", "Depth", lambda: 2)
+    assert "test_depth 2" in registry.render().splitlines()
+
+
+def test_timed_records_phases_of_the_current_request():
+    phases = metrics.start_request_trace()
+    with metrics.timed("test_phase"):
+        pass
+    assert [name for name, _ in phases] == ["test_phase"]
+
+
+def test_metrics_endpoint_serves_the_text_format(client):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'email_api_requests_total{method="GET",endpoint="/health",status="200"}' in response.get_data(as_text=True)
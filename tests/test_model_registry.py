@@ -0,0 +1,42 @@
+import threading
+
+from model_registry import ModelRegistry
+
+
+def test_one_model_per_name_and_config():
+    built = []
+    registry = ModelRegistry(lambda name, config: built.append((name, config)) or object())
+    model = registry.get("flash", {"temperature": 0.2, "top_p": 0.9})
+    assert registry.get("flash", {"top_p": 0.9, "temperature": 0.2}) is model
+    assert registry.get("flash") is not model
+    assert registry.get("pro", {"temperature": 0.2, "top_p": 0.9}) is not model
+    assert len(built) == len(registry) == 3
+
+
+def test_concurrent_first_use_builds_once():
+    built = []
+    start = threading.Barrier(8)
+
+    def factory(name, config):
+        built.append(name)
+        return object()
+
+    registry = ModelRegistry(factory)
+
+    def use():
+        start.wait()
+        registry.get("flash")
+
+    threads = [threading.Thread(target=use) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert built == ["flash"]
+
+
+def test_clear_rebuilds_on_next_use():
+    registry = ModelRegistry(lambda name, config: object())
+    model = registry.get("flash")
+    registry.clear()
+    assert registry.get("flash") is not model
@@ -0,0 +1,54 @@
+import pytest
+
+from prompts import PromptLibrary, PromptTemplate, PromptTemplateError, library_from_env, parse_ab_split
+
+VALUES = {"prompt": "Budget review", "tone": "friendly", "purpose": "follow-up", "recipient": "Ann",
+          "sender_name": "Bob", "key_points": "- Dates"}
+
+
+def test_render_fills_variables_and_keeps_escaped_dollars():
+    template = PromptTemplate("default", "Write a $tone email to ${recipient} costing $$5")
+    assert template.render(VALUES) == "Write a friendly email to Ann costing $5"
+    assert template.variables == {"tone", "recipient"}
+
+
+def test_bad_templates_and_values_are_rejected():
+    with pytest.raises(PromptTemplateError):
+        PromptTemplate("default", "Hello $password")
+    with pytest.raises(PromptTemplateError):
+        PromptTemplate("default", "Costs $ 5")
+    with pytest.raises(PromptTemplateError):
+        PromptTemplate("default", "Hello $recipient").render({"recipient": 5})
+
+
+def test_versions_change_with_content():
+    assert PromptTemplate("default", "A $tone").version != PromptTemplate("default", "B $tone").version
+
+
+def test_most_specific_template_wins():
+    library = PromptLibrary([PromptTemplate(name, name) for name in ("default", "friendly", "friendly.follow-up")])
+    assert library.select("Friendly", "Follow up").id == "friendly.follow-up"
+    assert library.select("friendly", "Thanks").id == "friendly"
+    assert library.select("Formal", "Follow up").id == "default"
+
+
+def test_ab_split_is_sticky_per_bucket_key():
+    library = PromptLibrary([PromptTemplate("default", "a"), PromptTemplate("default@short", "b")],
+                            parse_ab_split("default@short=0.3"))
+    picks = [library.select("formal", "x", f"caller-{i}").id for i in range(2000)]
+    assert 0.25 < picks.count("default@short") / len(picks) < 0.35
+    assert {library.select("formal", "x", "caller-7").id for _ in range(10)} == {picks[7]}
+
+
+def test_library_requires_a_default_and_known_variants():
+    with pytest.raises(PromptTemplateError):
+        PromptLibrary([PromptTemplate("friendly", "x")])
+    with pytest.raises(PromptTemplateError):
+        PromptLibrary([PromptTemplate("default", "x")], {"default@missing": 0.5})
+
+
+def test_shipped_templates_load(monkeypatch):
+    monkeypatch.delenv("PROMPT_TEMPLATE_DIR", raising=False)
+    monkeypatch.delenv("PROMPT_AB_SPLIT", raising=False)
+    library = library_from_env()
+    assert library.get("default").variables <= set(VALUES)
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from resilience import AdmissionQueue, CircuitBreaker, CircuitOpenError, OverloadedError, UpstreamGuard
+
+
+class ServiceUnavailable(Exception):
+    # Retryable by name, like google.api_core's exception of the same name
+    pass
+
+
+def failing():
+    raise ServiceUnavailable("upstream down")
+
+
+def make_guard(breaker, admission=None):
+    return UpstreamGuard("test", breaker=breaker, admission=admission, max_retries=0, max_wait=0.05)
+
+
+def open_circuit(guard):
+    with pytest.raises(ServiceUnavailable):
+        guard.call(failing)
+    assert guard.breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.is_failing_fast()
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert not breaker.is_failing_fast()
+    trial = breaker.allow()
+    assert trial and trial is not True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    assert breaker.is_failing_fast()
+
+
+def test_trial_outcome_closes_or_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() is True
+
+
+def test_abandoned_trial_frees_the_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    trial = breaker.allow()
+    breaker.abandon_trial(trial)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_stale_token_does_not_free_another_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    first = breaker.allow()
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.abandon_trial(first)
+    breaker.abandon_trial(True)
+    assert not breaker.allow()
+
+
+def test_guard_fails_fast_while_open():
+    guard = make_guard(CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    open_circuit(guard)
+    with pytest.raises(CircuitOpenError):
+        guard.call(lambda: "never called")
+
+
+def test_shed_trial_does_not_wedge_the_breaker():
+    admission = AdmissionQueue(1, 0.01)
+    guard = make_guard(CircuitBreaker(failure_threshold=1, reset_timeout=0.05), admission)
+    open_circuit(guard)
+    time.sleep(0.06)
+
+    admission.acquire()
+    with pytest.raises(OverloadedError):
+        guard.call(lambda: "shed before reaching upstream")
+    admission.release()
+
+    assert guard.call(lambda: "ok") == "ok"
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_closed_stream_does_not_wedge_the_breaker():
+    guard = make_guard(CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+    open_circuit(guard)
+    time.sleep(0.06)
+
+    def chunks():
+        with guard.streaming():
+            yield "first"
+            yield "second"
+
+    stream = chunks()
+    assert next(stream) == "first"
+    stream.close()
+
+    assert guard.call(lambda: "ok") == "ok"
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_async_trial_does_not_wedge_the_breaker():
+    guard = make_guard(CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+    open_circuit(guard)
+    time.sleep(0.06)
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        task = asyncio.create_task(guard.call_async(slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await guard.call_async(ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert guard.breaker.state == CircuitBreaker.CLOSED
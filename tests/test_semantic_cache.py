@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from semantic_cache import SemanticCache, semantic_cache_from_env  # noqa: E402
+
+REQUEST = "Follow up on the quarterly budget review meeting and confirm the new deadlines"
+
+
+def test_near_duplicates_match_and_unrelated_requests_do_not():
+    cache = SemanticCache(max_entries=10, threshold=0.8)
+    cache.set("scope", cache.embed(REQUEST), "email")
+    value, similarity = cache.get("scope", cache.embed(REQUEST.replace("confirm", "please confirm") + "."))
+    assert value == "email" and similarity >= 0.8
+    assert cache.get("scope", cache.embed("Invite the team to the summer party on Friday")) == (None, None)
+
+
+def test_matches_never_cross_scopes():
+    cache = SemanticCache(max_entries=10, threshold=0.8)
+    cache.set("to Ann", cache.embed(REQUEST), "email for Ann")
+    for i in range(5):
+        cache.set(f"other {i}", cache.embed(f"{REQUEST} {i}"), "other")
+    assert cache.get("to Bob", cache.embed(REQUEST)) == (None, None)
+    assert cache.get("to Ann", cache.embed(REQUEST))[0] == "email for Ann"
+
+
+def test_expired_entries_miss_and_are_reused_first():
+    cache = SemanticCache(max_entries=2, threshold=0.8, ttl=0.05)
+    cache.set("scope", cache.embed(REQUEST), "old")
+    time.sleep(0.1)
+    assert cache.get("scope", cache.embed(REQUEST)) == (None, None)
+    cache.ttl = 60
+    cache.set("scope", cache.embed("Second request"), "second")
+    cache.set("scope", cache.embed("Third request"), "third")
+    assert cache.stats()["evictions"] == 0
+    assert cache.get("scope", cache.embed("Third request"))[0] == "third"
+
+
+def test_least_recently_used_entry_is_evicted_when_full():
+    cache = SemanticCache(max_entries=2, threshold=0.99)
+    cache.set("scope", cache.embed("first request text"), "first")
+    cache.set("scope", cache.embed("second request text"), "second")
+    cache.get("scope", cache.embed("first request text"))
+    cache.set("scope", cache.embed("third request text"), "third")
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("scope", cache.embed("second request text")) == (None, None)
+    assert cache.get("scope", cache.embed("first request text"))[0] == "first"
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("SEMANTIC_CACHE_ENABLED", raising=False)
+    assert semantic_cache_from_env() is None
@@ -0,0 +1,24 @@
+import time
+
+from shared_state import SQLiteState
+
+
+def test_purge_drops_idle_buckets_locks_and_hashes(tmp_path):
+    state = SQLiteState(str(tmp_path / "state.db"), retain=0)
+    state.take("idle", -10, 0)
+    state.take("busy", 60, 0)
+    state.try_lock("stale", -1)
+    state.hset("job:old", {"status": "completed"}, -1)
+    state.hset("job:new", {"status": "completed"}, 60)
+    state.set("cached", "email", time.time() - 1)
+    assert state.purge_expired() == 4
+    assert state.take("busy", 0, 0) > 0
+    assert state.hgetall("job:new") == {"status": "completed"}
+
+
+def test_writes_purge_periodically(tmp_path):
+    state = SQLiteState(str(tmp_path / "state.db"), purge_interval=0)
+    state.hset("job:old", {"status": "completed"}, -1)
+    state.take("bucket", 1, 0)
+    rows = state._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+    assert rows == 0
@@ -0,0 +1,52 @@
+import asyncio
+
+from shared_state import SQLiteState
+from singleflight import AsyncSingleFlight
+
+
+def test_async_leaders_in_other_processes_share_through_state(tmp_path):
+    # Two AsyncSingleFlight instances stand in for two workers on one state file
+    state = SQLiteState(str(tmp_path / "state.db"))
+    first, second = AsyncSingleFlight(state=state, poll_interval=0.01), AsyncSingleFlight(state=state)
+    store = {}
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        store["key"] = "email"
+        return "email"
+
+    async def recheck():
+        return store.get("key")
+
+    async def main():
+        leader = asyncio.create_task(first.do("key", produce, recheck))
+        await asyncio.sleep(0.02)
+        return await asyncio.gather(leader, second.do("key", produce, recheck))
+
+    assert asyncio.run(main()) == [("email", False), ("email", True)]
+    assert len(calls) == 1
+
+
+def test_followers_outlive_a_cancelled_leader():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "email"
+
+    async def main():
+        leader = asyncio.create_task(flight.do("key", produce))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.do("key", produce)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(*followers)
+
+    results = asyncio.run(main())
+    # One follower took over as leader and the others shared its call
+    assert sorted(results) == [("email", False), ("email", True), ("email", True)]
+    assert len(calls) == 2
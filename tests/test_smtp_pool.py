@@ -0,0 +1,96 @@
+import smtplib
+import time
+
+import pytest
+
+from smtp_pool import SMTPConnectionPool
+
+
+class FakeSMTP:
+    instances = []
+
+    def __init__(self, host, port, timeout=None):
+        self.logins = []
+        self.sent = 0
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def login(self, user, password):
+        if password == "wrong":
+            raise smtplib.SMTPAuthenticationError(535, b"bad credentials")
+        self.logins.append(user)
+
+    def send_message(self, msg):
+        self.sent += 1
+
+    def noop(self):
+        return (250, b"OK")
+
+    def quit(self):
+        self.closed = True
+
+    close = quit
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeSMTP.instances = []
+    monkeypatch.setattr(smtplib, "SMTP", FakeSMTP)
+    return SMTPConnectionPool(starttls=False)
+
+
+def send(pool, sender, password="secret"):
+    pool.send("smtp.example.com", 587, sender, password, "message")
+
+
+def test_sessions_are_reused_per_sender(pool):
+    send(pool, "a@example.com")
+    send(pool, "a@example.com")
+    send(pool, "b@example.com")
+    assert pool.stats()["connects"] == 2
+    assert pool.stats()["reuses"] == 1
+
+
+def test_a_different_password_never_reuses_a_session(pool):
+    send(pool, "a@example.com", "secret")
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        send(pool, "a@example.com", "wrong")
+    assert pool.stats()["reuses"] == 0
+
+
+def test_idle_sessions_are_capped_across_senders(pool):
+    pool.max_idle_total = 3
+    for i in range(5):
+        send(pool, f"user{i}@example.com")
+    assert pool.stats()["idle_connections"] == 3
+    assert pool.stats()["evictions"] == 2
+    # The least recently used senders lost their sessions
+    assert [server.closed for server in FakeSMTP.instances] == [True, True, False, False, False]
+
+
+def test_expired_sessions_are_closed_on_any_senders_release(pool):
+    pool.idle_timeout = 0.05
+    send(pool, "a@example.com")
+    time.sleep(0.1)
+    send(pool, "b@example.com")
+    assert FakeSMTP.instances[0].closed
+    assert pool.stats()["idle_connections"] == 1
+
+
+def test_sessions_retire_after_max_messages(pool):
+    pool.max_messages = 2
+    for _ in range(3):
+        send(pool, "a@example.com")
+    assert pool.stats()["connects"] == 2
+    assert FakeSMTP.instances[0].sent == 2 and FakeSMTP.instances[0].closed
+
+
+def test_a_dropped_session_is_retried_once_on_a_fresh_login(pool, monkeypatch):
+    send(pool, "a@example.com")
+
+    def disconnected(msg):
+        raise smtplib.SMTPServerDisconnected("gone")
+    monkeypatch.setattr(FakeSMTP.instances[0], "send_message", disconnected)
+    send(pool, "a@example.com")
+    assert pool.stats()["reconnects"] == 1
+    assert FakeSMTP.instances[1].sent == 1
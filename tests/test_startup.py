@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys
+import app
+app.create_app()
+print(json.dumps({name: name in sys.modules for name in ("smtplib", "requests", "numpy", "email.mime.text")}))
+"""
+
+
+def imported_at_startup(tmp_path, preload):
+    env = dict(os.environ, LLM_BACKEND="fake", PRELOAD_MODULES="1" if preload else "0",
+               DELIVERY_DB_PATH=str(tmp_path / "delivery.db"))
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_endpoint_dependencies_load_on_first_use(tmp_path):
+    assert imported_at_startup(tmp_path, preload=False) == {
+        "smtplib": False, "requests": False, "numpy": False, "email.mime.text": False
+    }
+
+
+def test_preload_imports_them_up_front(tmp_path):
+    imported = imported_at_startup(tmp_path, preload=True)
+    assert imported["smtplib"] and imported["email.mime.text"]
+
+
+def test_create_app_records_startup_time():
+    import app
+
+    assert app.create_app() is app.app
+    assert app.startup_seconds > 0
+
+
+def test_a_forked_worker_serves_requests(client):
+    # As under gunicorn --preload: components built before the fork are
+    # reopened in the child by after_fork_in_child()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            ok = (client.get("/health").status_code == 200
+                  and client.post("/generate", json={"prompt": "After fork", "bypass_cache": True}).status_code == 200)
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
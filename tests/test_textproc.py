@@ -0,0 +1,12 @@
+from textproc import is_valid_email, text_to_html
+
+
+def test_email_addresses():
+    assert is_valid_email("ann@example.com")
+    assert not is_valid_email("ann@example")
+    assert not is_valid_email("")
+    assert not is_valid_email(None)
+
+
+def test_preview_bolds_the_subject_and_keeps_line_breaks():
+    assert text_to_html("Subject: Hi\n\nDear Ann,") == "<strong>Subject:</strong> Hi<br><br>Dear Ann,"
@@ -0,0 +1,64 @@
+import pytest
+
+from prompts import PromptTemplate
+from tokens import (TRUNCATION_MARK, PromptBudget, PromptTooLong, compact_text, dedupe_key_points, estimate_tokens,
+                    truncate_to_tokens)
+
+TEMPLATE = PromptTemplate("default", "Context: $prompt\nKey points:\n$key_points")
+
+
+def values(prompt, key_points=()):
+    return {"prompt": prompt, "key_points": list(key_points)}
+
+
+def test_compact_text_drops_repeated_lines_and_extra_blank_lines():
+    signature = "Best regards, Alex from the platform team"
+    text = f"Hello   there\r\n\n\n\n{signature}\nMore\n{signature}\nOk\nOk"
+    assert compact_text(text) == f"Hello there\n\n{signature}\nMore\nOk\nOk"
+
+
+def test_key_points_are_deduplicated_capped_and_shortened():
+    points, trimmed = dedupe_key_points(["Budget", " budget! ", "", "Dates", "x " * 100, "Extra"], 3, 10)
+    assert points[:2] == ["Budget", "Dates"]
+    assert points[2].endswith(TRUNCATION_MARK) and estimate_tokens(points[2]) <= 10
+    assert trimmed
+
+
+def test_truncation_cuts_on_a_word_boundary():
+    text = "word " * 50
+    cut = truncate_to_tokens(text, 10)
+    assert cut.endswith(" word" + TRUNCATION_MARK)
+    assert estimate_tokens(cut) <= 10
+    assert truncate_to_tokens("short", 10) == "short"
+
+
+def test_a_prompt_within_budget_is_untouched():
+    text, tokens, trimmed = PromptBudget().fit(TEMPLATE, values("Budget review", ["Dates"]))
+    assert text == "Context: Budget review\nKey points:\n- Dates"
+    assert tokens == estimate_tokens(text)
+    assert trimmed == []
+
+
+def test_long_context_is_trimmed_before_key_points():
+    budget = PromptBudget(max_input_tokens=100, min_context_tokens=20)
+    text, tokens, trimmed = budget.fit(TEMPLATE, values("lorem ipsum " * 200, ["Dates", "Budget"]))
+    assert tokens <= 100
+    assert trimmed == ["prompt"]
+    assert text.endswith("- Dates\n- Budget")
+
+
+def test_key_points_go_once_the_context_is_at_its_minimum():
+    budget = PromptBudget(max_input_tokens=60, min_context_tokens=40)
+    text, tokens, trimmed = budget.fit(TEMPLATE, values("lorem ipsum " * 200, [f"Point {i}" for i in range(10)]))
+    assert tokens <= 60
+    assert trimmed == ["prompt", "key_points"]
+    assert "- Point 0" in text and "- Point 9" not in text
+
+
+def test_reject_mode_and_requested_limits():
+    budget = PromptBudget(max_input_tokens=50, reject=True)
+    with pytest.raises(PromptTooLong):
+        budget.fit(TEMPLATE, values("lorem ipsum " * 100))
+    assert budget.limit("20") == 20
+    assert budget.limit(500) == 50
+    assert budget.limit("lots") == 50
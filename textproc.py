@@ -0,0 +1,15 @@
+# Precompiled text helpers shared by the Flask backend and the Streamlit frontend
+import re
+
+EMAIL_ADDRESS_RE = re.compile(r"[^@]+@[^@]+\.[^@]+")
+SUBJECT_LINE_RE = re.compile(r"Subject: (.*)")
+
+
+def is_valid_email(address):
+    # Anything but a string (a number, a list from a JSON body) is invalid, not an error
+    return isinstance(address, str) and EMAIL_ADDRESS_RE.match(address) is not None
+
+
+def text_to_html(text):
+    # Bold the subject line and keep line breaks for the HTML preview
+    return SUBJECT_LINE_RE.sub(r"<strong>Subject:</strong> \1", text).replace("\n", "<br>")
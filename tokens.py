@@ -0,0 +1,164 @@
+# Token estimates and per-request input budgets for generation prompts
+#
+# Estimates are deliberately cheap (no tokenizer dependency): about four
+# characters per token for English text, tunable with TOKEN_CHARS_PER_TOKEN.
+# Backends that report real usage override the estimate in responses.
+import math
+import os
+import re
+
+from metrics import registry
+from prompts import PromptTemplateError
+
+CHARS_PER_TOKEN = float(os.getenv('TOKEN_CHARS_PER_TOKEN', 4))
+
+PROMPT_TOKENS = registry.histogram(
+    "email_api_prompt_tokens", "Estimated input tokens per rendered prompt",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+TRIMMED = registry.counter(
+    "email_api_prompt_trimmed_total", "Prompts shortened to fit the input budget", ("part",))
+
+_SPACES = re.compile(r"[ \t\f\v]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_KEY = re.compile(r"\W+")
+TRUNCATION_MARK = " [...]"
+
+
+class PromptTooLong(PromptTemplateError):
+    pass
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def compact_text(text):
+    # Collapse runs of spaces, drop repeated lines and keep at most one blank line
+    lines = []
+    seen = set()
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        line = _SPACES.sub(" ", line).strip()
+        if line:
+            # Pasted threads often repeat whole lines (signatures, quoted text)
+            key = line.lower()
+            if key in seen and len(key) > 20:
+                continue
+            seen.add(key)
+        lines.append(line)
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def dedupe_key_points(points, max_points, max_point_tokens):
+    # Returns (points, trimmed) with empty and repeated points removed
+    result = []
+    seen = set()
+    trimmed = False
+    for point in points:
+        point = _SPACES.sub(" ", str(point)).strip()
+        key = _KEY.sub(" ", point.lower()).strip()
+        if not key or key in seen:
+            trimmed = trimmed or bool(key)
+            continue
+        seen.add(key)
+        if estimate_tokens(point) > max_point_tokens:
+            point = truncate_to_tokens(point, max_point_tokens)
+            trimmed = True
+        result.append(point)
+    if len(result) > max_points:
+        result = result[:max_points]
+        trimmed = True
+    return result, trimmed
+
+
+def truncate_to_tokens(text, max_tokens):
+    max_chars = int(max_tokens * CHARS_PER_TOKEN) - len(TRUNCATION_MARK)
+    if len(text) <= max_chars + len(TRUNCATION_MARK):
+        return text
+    if max_chars <= 0:
+        return ""
+    # Cut on a word boundary when there is one reasonably close
+    cut = text.rfind(" ", 0, max_chars)
+    if cut < max_chars * 0.8:
+        cut = max_chars
+    return text[:cut].rstrip() + TRUNCATION_MARK
+
+
+def format_key_points(points):
+    return "\n".join(f"- {point}" for point in points)
+
+
+class PromptBudget:
+    """Fits a template's variables into `max_input_tokens`.
+
+    Context and key points are compacted and deduplicated first; if the
+    prompt is still too long the context is trimmed down to
+    `min_context_tokens`, then trailing key points are dropped. With
+    `reject` set an oversized prompt is refused instead of trimmed.
+    """
+
+    def __init__(self, max_input_tokens=4000, max_key_points=20, max_point_tokens=80,
+                 min_context_tokens=200, reject=False):
+        self.max_input_tokens = max_input_tokens
+        self.max_key_points = max_key_points
+        self.max_point_tokens = max_point_tokens
+        self.min_context_tokens = min_context_tokens
+        self.reject = reject
+
+    def limit(self, requested=None):
+        # Requests may ask for a smaller budget, never a bigger one
+        try:
+            requested = int(requested)
+        except (TypeError, ValueError):
+            return self.max_input_tokens
+        return max(1, min(requested, self.max_input_tokens))
+
+    def fit(self, template, values, max_input_tokens=None):
+        # `values["key_points"]` is a list; returns (text, input_tokens, trimmed parts)
+        limit = max_input_tokens or self.max_input_tokens
+        values = dict(values)
+        context = compact_text(values["prompt"])
+        points, points_trimmed = dedupe_key_points(values["key_points"], self.max_key_points,
+                                                   self.max_point_tokens)
+        trimmed = ["key_points"] if points_trimmed else []
+
+        def render():
+            return template.render(dict(values, prompt=context, key_points=format_key_points(points)))
+
+        text = render()
+        tokens = estimate_tokens(text)
+        if tokens > limit and self.reject:
+            raise PromptTooLong(f"Prompt is about {tokens} tokens, over the budget of {limit}")
+
+        if tokens > limit:
+            context_tokens = estimate_tokens(context)
+            allowed = max(self.min_context_tokens, context_tokens - (tokens - limit))
+            if allowed < context_tokens:
+                context = truncate_to_tokens(context, allowed)
+                trimmed.append("prompt")
+                text = render()
+                tokens = estimate_tokens(text)
+
+        while tokens > limit and points:
+            points.pop()
+            if "key_points" not in trimmed:
+                trimmed.append("key_points")
+            text = render()
+            tokens = estimate_tokens(text)
+
+        if tokens > limit:
+            raise PromptTooLong(f"Prompt is about {tokens} tokens, over the budget of {limit}")
+
+        for part in trimmed:
+            TRIMMED.inc(part=part)
+        PROMPT_TOKENS.observe(tokens)
+        return text, tokens, trimmed
+
+
+def budget_from_env():
+    return PromptBudget(
+        max_input_tokens=int(os.getenv('PROMPT_MAX_INPUT_TOKENS', 4000)),
+        max_key_points=int(os.getenv('PROMPT_MAX_KEY_POINTS', 20)),
+        max_point_tokens=int(os.getenv('PROMPT_MAX_KEY_POINT_TOKENS', 80)),
+        min_context_tokens=int(os.getenv('PROMPT_MIN_CONTEXT_TOKENS', 200)),
+        reject=os.getenv('PROMPT_BUDGET_MODE', 'trim').lower() == 'reject',
+    )